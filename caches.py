@@ -0,0 +1,114 @@
+"""
+行程內 (per-instance) 快取
+
+Cloud Functions 的執行個體在「暖機」狀態下會重複處理多個請求，
+模組層級的物件會在請求之間保留下來。這裡的快取就是利用這點，
+讓很少變動的資料 (例如 prayer_groups 文件) 不必每個請求都重新讀取。
+"""
+import collections
+import threading
+import time
+
+
+class LRUTTLCache:
+    """
+    具有容量上限 (LRU 淘汰) 與存活時間 (TTL) 的執行緒安全快取。
+    - max_size=None 表示不限容量；ttl_seconds=None 表示永不過期。
+    - 會統計 hits / misses / expired / evictions，供診斷與監控使用。
+    """
+    _MISSING = object()
+
+    def __init__(self, max_size=None, ttl_seconds=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries = collections.OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._entries.get(key, self._MISSING)
+            if item is self._MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at is not None and self._clock() >= expires_at:
+                del self._entries[key]
+                self.expired += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        """讀取但不影響統計與 LRU 順序 (過期的項目視為不存在)。"""
+        with self._lock:
+            item = self._entries.get(key, self._MISSING)
+            if item is self._MISSING:
+                return default
+            value, expires_at = item
+            if expires_at is not None and self._clock() >= expires_at:
+                return default
+            return value
+
+    def put(self, key, value, ttl_seconds=_MISSING):
+        ttl = self.ttl_seconds if ttl_seconds is self._MISSING else ttl_seconds
+        with self._lock:
+            self._entries[key] = (value, None if ttl is None else self._clock() + ttl)
+            self._entries.move_to_end(key)
+            while self.max_size is not None and len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'expired': self.expired, 'evictions': self.evictions}
+
+
+class GroupDocCache(LRUTTLCache):
+    """
+    prayer_groups 文件的快取。
+    每條寫入路徑 (加入、改名、開始/結束輪次) 都會把文件中的 `version` 欄位加一，
+    快取只接受版本號不小於目前快取內容的資料，避免較舊的讀取結果覆蓋較新的資料；
+    若呼叫端發現快取內容與實際狀態不符，可用 mark_stale() 丟棄並計入 stale 次數。
+    快取中的 dict 會被多個請求共用，請視為唯讀。
+    """
+
+    def __init__(self, ttl_seconds, max_size=None, clock=time.monotonic):
+        super().__init__(max_size=max_size, ttl_seconds=ttl_seconds, clock=clock)
+        self.stale = 0
+
+    def put_group(self, group_id, group_data):
+        version = group_data.get('version', 0)
+        current = self.peek(group_id)
+        if current is not None and current.get('version', 0) > version:
+            return False
+        self.put(group_id, group_data)
+        return True
+
+    def mark_stale(self, group_id):
+        with self._lock:
+            if self._entries.pop(group_id, None) is not None:
+                self.stale += 1
+
+    def stats(self):
+        result = super().stats()
+        result['stale'] = self.stale
+        return result
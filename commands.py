@@ -0,0 +1,72 @@
+"""
+指令路由 (Command Router)
+
+- 指令在匯入時註冊到字首樹 (trie)，每則訊息只需沿著訊息開頭逐字走訪一次，
+  所需時間只與指令名稱的長度有關，與註冊了多少指令無關。
+- 比對結果以最長且有效的指令為準：exact 指令必須整則訊息完全相同 (例如 代禱列表)，
+  prefix 指令只要訊息以它開頭即可 (例如 代禱 [事項])，因此不再依賴 if/elif 的先後順序。
+- 全形空白 (U+3000) 會先轉成半形空白，讓「代禱　事項」與「代禱 事項」效果相同。
+"""
+import collections
+
+SOURCE_USER = 'user'
+SOURCE_GROUP = 'group'
+
+EXACT = 'exact'
+PREFIX = 'prefix'
+
+# 解析後的指令：verb 為比對到的指令名稱，args 為指令後面的內容 (已去除前後空白)，
+# text 為正規化後的整則訊息 (交給沿用 text_received 的處理函式)
+ParsedCommand = collections.namedtuple(
+    'ParsedCommand', ['verb', 'args', 'text', 'source_type', 'user_id', 'group_id', 'route'])
+
+# 一個已註冊的指令：handler(command, ctx) 回傳要回覆的文字；needs_group 表示私訊時必須先確定作用的群組；
+# idempotent 表示重複執行不會改變資料 (例如查詢類指令)，重送時不需要跨執行個體去重
+Route = collections.namedtuple('Route', ['verb', 'handler', 'match', 'needs_group', 'idempotent'])
+
+
+def normalize_text(text):
+    """去除前後空白並將全形空白轉為半形空白。"""
+    return text.replace('　', ' ').strip()
+
+
+class CommandRouter:
+    """單一來源 (私訊或群組) 的指令表。"""
+
+    def __init__(self, source_type):
+        self.source_type = source_type
+        self._root = {}
+        self.routes = []
+
+    def add(self, verb, handler, match=EXACT, needs_group=False, idempotent=False):
+        route = Route(verb.lower(), handler, match, needs_group, idempotent)
+        node = self._root
+        for char in route.verb:
+            node = node.setdefault(char, {})
+        if None in node:
+            raise ValueError(f"指令「{verb}」重複註冊")
+        node[None] = route  # None 作為 key 存放在此結束的指令
+        self.routes.append(route)
+        return route
+
+    def match(self, text):
+        """回傳 (route, verb 長度)，沒有符合的指令時回傳 (None, 0)。text 需已正規化。"""
+        lowered = text.lower()
+        node = self._root
+        best, best_length = None, 0
+        for depth, char in enumerate(lowered, start=1):
+            node = node.get(char)
+            if node is None:
+                break
+            route = node.get(None)
+            if route is not None and (route.match == PREFIX or depth == len(lowered)):
+                best, best_length = route, depth
+        return best, best_length
+
+    def parse(self, text, user_id=None, group_id=None):
+        """解析訊息，不是指令時回傳 None。"""
+        text = normalize_text(text)
+        route, verb_length = self.match(text)
+        if route is None:
+            return None
+        return ParsedCommand(route.verb, text[verb_length:].strip(), text, self.source_type, user_id, group_id, route)
@@ -0,0 +1,143 @@
+"""
+截止時間解析 (Deadlines)
+
+將 開始代禱 [截止時間] 的文字解析成 UTC 時間 (deadline_at)，讓排程可以自動結束輪次與發送提醒。
+支援的寫法 (可組合日期與時間，無法解析時回傳 None，輪次仍只保留文字)：
+- 日期：2024/6/7、2024-06-07、6/7、今天 / 今晚 / 明天 / 後天、週五 / 星期五 / 禮拜五 / 下週五
+- 時間：21:00、晚上9點、下午3點半、9pm、晚上 9:30、9:30pm；只寫日期時視為當天 23:59 (晚上12點為隔天 00:00)
+「週五」、「今天」、只寫時間等相對寫法若已經過了，會順延到下一個符合的時間；明確的日期則原樣回傳，由呼叫端拒絕過去的時間。
+"""
+import datetime
+import re
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python 3.8
+    ZoneInfo = None
+
+DEFAULT_TIMEZONE = 'Asia/Taipei'
+WEEKDAY_NAMES = "一二三四五六日"
+_WEEKDAYS = {name: index for index, name in enumerate(WEEKDAY_NAMES)}
+_WEEKDAYS['天'] = 6
+
+_FULL_DATE = re.compile(r'(\d{4})\s*[/\-.年]\s*(\d{1,2})\s*[/\-.月]\s*(\d{1,2})\s*日?')
+_MONTH_DAY = re.compile(r'(?<!\d)(\d{1,2})\s*[/\-月]\s*(\d{1,2})\s*[日號]?(?![\d:：])')
+_WEEKDAY = re.compile(r'(下|本|這)?\s*(?:週|周|星期|禮拜)\s*([一二三四五六日天])')
+_RELATIVE_DAY = re.compile(r'(今天|今晚|明天|明晚|後天)')
+_PERIOD = r'(凌晨|早上|上午|中午|下午|傍晚|晚上)?\s*'
+_CLOCK_TIME = re.compile(_PERIOD + r'(\d{1,2})\s*[:：]\s*(\d{2})\s*(am|pm)?', re.IGNORECASE)
+_CHINESE_TIME = re.compile(_PERIOD + r'(\d{1,2})\s*[點时時](半|(\d{1,2})\s*分?)?')
+_AM_PM_TIME = re.compile(_PERIOD + r'(\d{1,2})\s*(am|pm)', re.IGNORECASE)
+_EVENING_WORDS = ('下午', '傍晚', '晚上', '今晚', '明晚')
+_NIGHT_WORDS = ('晚上', '今晚', '明晚')
+_MORNING_PERIODS = ('凌晨', '早上', '上午')
+
+
+def get_timezone(name=DEFAULT_TIMEZONE):
+    """取得時區；環境沒有時區資料時退回台灣的固定 UTC+8。"""
+    if ZoneInfo is not None:
+        try:
+            return ZoneInfo(name)
+        except Exception:
+            pass
+    return datetime.timezone(datetime.timedelta(hours=8))
+
+
+def _parse_date(text, today):
+    """
+    回傳 (date, 順延天數)，沒有寫日期時回傳 (None, 0)。
+    順延天數是相對寫法 (週X、今天/明天) 的時間已經過去時要往後移的天數；明確的日期為 0。
+    """
+    match = _FULL_DATE.search(text)
+    if match:
+        return datetime.date(int(match.group(1)), int(match.group(2)), int(match.group(3))), 0
+    match = _MONTH_DAY.search(text)
+    if match:
+        candidate = datetime.date(today.year, int(match.group(1)), int(match.group(2)))
+        # 已經過去的月/日視為明年
+        return (candidate if candidate >= today else candidate.replace(year=today.year + 1)), 0
+    match = _WEEKDAY.search(text)
+    if match:
+        weekday = _WEEKDAYS[match.group(2)]
+        if match.group(1) == '下':
+            # 下週X：下一個日曆週 (週一開始) 的星期X，一定在未來
+            monday = today - datetime.timedelta(days=today.weekday())
+            return monday + datetime.timedelta(days=7 + weekday), 0
+        # 週X / 本週X：接下來 (含今天) 的第一個星期X；今天的時間已過則為下一個星期X
+        return today + datetime.timedelta(days=(weekday - today.weekday()) % 7), 7
+    match = _RELATIVE_DAY.search(text)
+    if match:
+        offset = {'今天': 0, '今晚': 0, '明天': 1, '明晚': 1, '後天': 2}[match.group(1)]
+        return today + datetime.timedelta(days=offset), 1
+    return None, 0
+
+
+def _apply_period(text, period, hour, minute, suffix=None):
+    """
+    依 am/pm 或 早上/晚上 等字樣換算成 24 小時制，回傳 (hour, minute, 加幾天)。
+    晚上12點 (或 今晚12點) 是隔天的 00:00。
+    """
+    if suffix:
+        if not 1 <= hour <= 12:
+            raise ValueError(f"{hour}{suffix}")
+        return hour % 12 + (12 if suffix.lower() == 'pm' else 0), minute, 0
+    night = period == '晚上' or (period is None and any(word in text for word in _NIGHT_WORDS))
+    evening = period in ('下午', '傍晚', '晚上') or (period is None and any(word in text for word in _EVENING_WORDS))
+    if hour == 12 and night:
+        return 0, minute, 1
+    if hour == 12 and period in _MORNING_PERIODS:
+        return 0, minute, 0
+    if (evening or (period == '中午' and hour < 6)) and hour < 12:
+        hour += 12
+    return hour, minute, 0
+
+
+def _parse_time(text):
+    """回傳 (hour, minute, 加幾天)，沒有寫時間時回傳 None。"""
+    match = _CLOCK_TIME.search(text)
+    if match:
+        return _apply_period(text, match.group(1), int(match.group(2)), int(match.group(3)), match.group(4))
+    match = _AM_PM_TIME.search(text)
+    if match:
+        return _apply_period(text, match.group(1), int(match.group(2)), 0, match.group(3))
+    match = _CHINESE_TIME.search(text)
+    if match:
+        minute = 30 if match.group(3) == '半' else int(match.group(4) or 0)
+        return _apply_period(text, match.group(1), int(match.group(2)), minute)
+    return None
+
+
+def parse_deadline(text, now=None, tz_name=DEFAULT_TIMEZONE):
+    """
+    將截止時間文字解析為 UTC 的 datetime (tz-aware)，無法解析時回傳 None。
+    now 為目前時間 (tz-aware，預設為現在)，用來決定「週五」、「6/7」等相對日期；
+    相對寫法會順延到 now 之後，明確的日期 (例如 2024/1/1) 仍可能早於 now，由呼叫端檢查。
+    """
+    if not text:
+        return None
+    tz = get_timezone(tz_name)
+    now = (now or datetime.datetime.now(datetime.timezone.utc)).astimezone(tz)
+    try:
+        date, rollover_days = _parse_date(text, now.date())
+        clock = _parse_time(text)
+        if date is None and clock is None:
+            return None
+        hour, minute, extra_days = clock if clock else (23, 59, 0)
+        if date is None:
+            # 只寫時間：今天的這個時間，已經過了就是明天
+            date, rollover_days = now.date(), 1
+        date += datetime.timedelta(days=extra_days)
+        local = datetime.datetime(date.year, date.month, date.day, hour, minute, tzinfo=tz)
+        if local <= now and rollover_days:
+            date += datetime.timedelta(days=rollover_days)
+            local = datetime.datetime(date.year, date.month, date.day, hour, minute, tzinfo=tz)
+    except ValueError:
+        # 例如 2/30、25:00
+        return None
+    return local.astimezone(datetime.timezone.utc)
+
+
+def format_deadline(deadline_at, tz_name=DEFAULT_TIMEZONE):
+    """以當地時間顯示，例如 06/07 (五) 21:00。"""
+    local = deadline_at.astimezone(get_timezone(tz_name))
+    return f"{local:%m/%d} ({WEEKDAY_NAMES[local.weekday()]}) {local:%H:%M}"
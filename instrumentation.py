@@ -0,0 +1,94 @@
+"""
+指令層級的效能量測 (Instrumentation)
+
+- command_scope(): 標記「目前正在處理哪個指令」(contextvars，每個執行緒/事件各自獨立)，
+  並在結束時把耗時記錄到 prayer_bot_command_seconds{command, source}。
+- instrument_firestore(): 包裝 Firestore (或記憶體替身) 的讀寫方法，依目前的指令計算
+  讀取的文件數、寫入的文件數與查詢次數；LINE API 的呼叫次數則由 line_transport 以 current_command() 標記。
+  不在任何指令中的操作 (例如排程、背景合併寫入) 標記為 "none"。
+"""
+import contextlib
+import contextvars
+import functools
+import time
+
+import metrics
+
+NO_COMMAND = 'none'
+
+_current_command = contextvars.ContextVar('prayer_bot_command', default=NO_COMMAND)
+
+command_seconds = metrics.REGISTRY.histogram(
+    'prayer_bot_command_seconds', "處理一個指令 (含回覆) 的時間", ('command', 'source'))
+firestore_reads = metrics.REGISTRY.counter(
+    'prayer_bot_firestore_reads_total', "讀取的 Firestore 文件數 (依指令)", ('command',))
+firestore_writes = metrics.REGISTRY.counter(
+    'prayer_bot_firestore_writes_total', "寫入的 Firestore 文件數 (依指令)", ('command',))
+firestore_queries = metrics.REGISTRY.counter(
+    'prayer_bot_firestore_queries_total', "Firestore 查詢 (query / get_all) 次數 (依指令)", ('command',))
+
+
+def current_command():
+    return _current_command.get()
+
+
+@contextlib.contextmanager
+def command_scope(command, source=NO_COMMAND):
+    """在 with 區塊中的 Firestore / LINE API 呼叫都會標記為 command，並記錄整個區塊的耗時。"""
+    token = _current_command.set(command)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        command_seconds.observe(time.perf_counter() - started, command=command, source=source)
+        _current_command.reset(token)
+
+
+def _counting_get(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        firestore_reads.inc(command=current_command())
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _counting_stream(method):
+    """stream() / get_all() 回傳 generator：查詢計一次，讀取數依實際取得的文件數計算。"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        command = current_command()
+        firestore_queries.inc(command=command)
+        for snapshot in method(self, *args, **kwargs):
+            firestore_reads.inc(command=command)
+            yield snapshot
+    return wrapper
+
+
+def _counting_commit(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        results = method(self, *args, **kwargs)
+        firestore_writes.inc(len(results), command=current_command())
+        return results
+    return wrapper
+
+
+def instrument_firestore(module):
+    """
+    包裝 module (google.cloud.firestore 或 storage.memory_firestore) 的類別方法，重複呼叫不會重複包裝。
+    單筆的 set/create/update/delete 在兩種後端都是透過 WriteBatch.commit() 送出，因此寫入只需在 commit 計算
+    (交易則是 Transaction._commit())；
+    Query.get() 與 CollectionReference.stream() 最終都會呼叫 Query.stream()。
+    """
+    for cls, name, wrap in ((module.DocumentReference, 'get', _counting_get),
+                            (module.Query, 'stream', _counting_stream),
+                            (module.Client, 'get_all', _counting_stream),
+                            (module.WriteBatch, 'commit', _counting_commit),
+                            (module.Transaction, '_commit', _counting_commit)):
+        method = getattr(cls, name)
+        if getattr(method, '_prayer_bot_instrumented', False):
+            continue
+        wrapped = wrap(method)
+        wrapped._prayer_bot_instrumented = True
+        setattr(cls, name, wrapped)
+    return module
@@ -0,0 +1,59 @@
+"""
+延遲初始化 (Lazy Initialization)
+
+Cloud Functions 冷啟動時，匯入 main.py 的時間會直接加在第一個 Webhook 的延遲上。
+建立 Firestore Client (匯入 google.cloud.firestore、尋找憑證) 與 LineBotApi 都很花時間，
+因此改用 LazyObject 包裝：第一次存取屬性時才建立實際物件 (多執行緒同時存取時只會建立一次)，
+之後的存取直接轉給實際物件，呼叫端的寫法 (例如 db.collection(...)) 不需要修改。
+"""
+import threading
+
+
+class LazyObject:
+    """第一次使用時才呼叫 factory() 建立的物件。建立失敗時記錄錯誤，之後不再重試。"""
+
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+        self._resolved = False
+        self.error = None
+
+    def resolve(self):
+        """回傳實際物件 (必要時先建立)，建立失敗時回傳 None。"""
+        if not self._resolved:
+            with self._lock:
+                if not self._resolved:
+                    try:
+                        self._value = self._factory()
+                    except Exception as e:
+                        self.error = e
+                        print(f"嚴重錯誤 (繁中): {self._name} 初始化失敗: {e}")
+                    self._resolved = True
+        return self._value
+
+    @property
+    def resolved(self):
+        """是否已經嘗試建立過 (不會觸發建立)。"""
+        return self._resolved
+
+    def __bool__(self):
+        return self.resolve() is not None
+
+    def _require(self):
+        value = self.resolve()
+        if value is None:
+            raise RuntimeError(f"{self._name} 無法使用: {self.error}")
+        return value
+
+    def __getattr__(self, attr):
+        return getattr(self._require(), attr)
+
+    def __call__(self, *args, **kwargs):
+        """實際物件為類別或函式時 (例如 FieldPath)，可以直接呼叫。"""
+        return self._require()(*args, **kwargs)
+
+    def __repr__(self):
+        state = repr(self._value) if self._resolved else "尚未初始化"
+        return f"<LazyObject {self._name}: {state}>"
@@ -0,0 +1,137 @@
+"""
+LINE Messaging API 的 HTTP 傳輸層 (Transport)
+
+line-bot-sdk 預設的 RequestsHttpClient 每次呼叫都使用 requests.get/post，不會重複使用連線，也不會重試。
+PooledHttpClient 改用長駐的 requests.Session (keep-alive 連線池)，並提供：
+- 連線 / 讀取逾時 (connect, read)
+- 遇到 429 與 5xx (以及連線錯誤) 時以隨機抖動 (full jitter) 的指數退避重試，並遵守 Retry-After
+- push / multicast 等推播請求自動帶上 X-Line-Retry-Key，重試時沿用同一個 key，
+  LINE 因此不會重複送出訊息 (重試收到 409 代表先前的請求其實已被接受，視為成功)
+- 每次呼叫的延遲、重試次數與最終狀態碼 (依觸發的指令) 記錄到 metrics
+
+用法：LineBotApi(token, timeout=(3, 10), http_client=functools.partial(PooledHttpClient, max_retries=3))
+"""
+import random
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+
+import instrumentation
+import metrics
+
+RETRY_KEY_HEADER = 'X-Line-Retry-Key'
+# 這些 API 支援 X-Line-Retry-Key (https://developers.line.biz/en/reference/messaging-api/#retry-api-request)
+RETRY_KEY_PATHS = ('/v2/bot/message/push', '/v2/bot/message/multicast',
+                   '/v2/bot/message/narrowcast', '/v2/bot/message/broadcast')
+REPLY_PATH = '/v2/bot/message/reply'
+
+line_api_seconds = metrics.REGISTRY.histogram(
+    'prayer_bot_line_api_seconds', "每次呼叫 LINE API 的延遲 (含重試)", ('endpoint',))
+line_api_retries = metrics.REGISTRY.counter(
+    'prayer_bot_line_api_retries_total', "呼叫 LINE API 的重試次數", ('endpoint', 'reason'))
+line_api_errors = metrics.REGISTRY.counter(
+    'prayer_bot_line_api_errors_total', "LINE API 最終失敗 (非 2xx 或連線錯誤) 的次數", ('endpoint',))
+line_api_requests = metrics.REGISTRY.counter(
+    'prayer_bot_line_api_requests_total', "LINE API 呼叫次數 (依最終狀態碼與觸發的指令)", ('endpoint', 'status', 'command'))
+
+
+def endpoint_label(url):
+    """將 URL 轉為指標標籤，例如 message/reply、profile、group (不含使用者或群組 ID)。"""
+    path = url.split('://', 1)[-1].split('/', 1)[-1].split('?', 1)[0]
+    parts = [part for part in path.split('/') if part][2:]  # 去掉 v2/bot
+    if not parts:
+        return 'other'
+    if parts[0] == 'message' and len(parts) > 1:
+        return f"message/{parts[1]}"
+    return parts[0]
+
+
+class _AcceptedResponse(RequestsHttpResponse):
+    """重試時收到 409：同一個 retry key 的請求先前已被 LINE 接受，對呼叫端而言等同成功。"""
+
+    @property
+    def status_code(self):
+        return 200
+
+
+class PooledHttpClient(RequestsHttpClient):
+    """以 requests.Session 連線池實作、具逾時與重試的 HttpClient。"""
+
+    def __init__(self, timeout=RequestsHttpClient.DEFAULT_TIMEOUT, pool_size=10, max_retries=3,
+                 backoff_base=0.5, backoff_max=8.0, sleep=time.sleep):
+        super().__init__(timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._sleep = sleep
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return self._request('GET', url, headers=headers, params=params, stream=stream, timeout=timeout)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._request('POST', url, headers=headers, data=data, timeout=timeout)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return self._request('DELETE', url, headers=headers, data=data, timeout=timeout)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        return self._request('PUT', url, headers=headers, data=data, timeout=timeout)
+
+    def _backoff_seconds(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _request(self, method, url, headers=None, timeout=None, **kwargs):
+        headers = dict(headers or {})
+        path = '/' + url.split('://', 1)[-1].split('/', 1)[-1].split('?', 1)[0]
+        if method == 'POST' and path in RETRY_KEY_PATHS:
+            headers.setdefault(RETRY_KEY_HEADER, str(uuid.uuid4()))
+        # 沒有 retry key 的 POST (reply 除外，reply token 只能使用一次，重送不會重複發送) 發生連線錯誤時不重試，
+        # 因為無法確定 LINE 是否已經處理過該請求
+        retry_on_connection_error = method != 'POST' or RETRY_KEY_HEADER in headers or path == REPLY_PATH
+        label = endpoint_label(url)
+        command = instrumentation.current_command()
+        started = time.perf_counter()
+        try:
+            attempt = 0
+            while True:
+                try:
+                    response = self.session.request(method, url, headers=headers,
+                                                    timeout=timeout if timeout is not None else self.timeout, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if not retry_on_connection_error or attempt >= self.max_retries:
+                        line_api_errors.inc(endpoint=label)
+                        line_api_requests.inc(endpoint=label, status='connection_error', command=command)
+                        raise
+                    line_api_retries.inc(endpoint=label, reason=type(e).__name__)
+                    self._sleep(self._backoff_seconds(attempt))
+                    attempt += 1
+                    continue
+
+                status = response.status_code
+                if status == 409 and attempt > 0 and RETRY_KEY_HEADER in headers:
+                    line_api_requests.inc(endpoint=label, status='409', command=command)
+                    return _AcceptedResponse(response)
+                if (status == 429 or status >= 500) and attempt < self.max_retries:
+                    line_api_retries.inc(endpoint=label, reason=str(status))
+                    self._sleep(self._backoff_seconds(attempt, response))
+                    attempt += 1
+                    continue
+                if not 200 <= status < 300:
+                    line_api_errors.inc(endpoint=label)
+                line_api_requests.inc(endpoint=label, status=str(status), command=command)
+                return RequestsHttpResponse(response)
+        finally:
+            line_api_seconds.observe(time.perf_counter() - started, endpoint=label)
@@ -1,29 +1,37 @@
 import os
 import sys
+import contextvars
 import datetime
+import functools
+import threading
+import unicodedata
 import functions_framework
-from flask import Flask, request, abort
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request, abort, jsonify
+
+import caches
+import commands
+import deadlines
+import instrumentation
+import lazy
+import metrics
+import rendering
+import roster
+import search
+import storage
+import workers
 
 # --- 全域狀態變數 ---
 linebot_actual_version = "未知"
 linebot_module_imported = False
 sdk_import_successful = False
-sdk_initialized_successfully = False
-db_initialized_successfully = False
 firestore_client_version = "未知"
-FieldPath = None 
 
-# --- 導入 linebot 主模組 ---
+# --- 導入 linebot 主模組 (WebhookHandler 需要在匯入時註冊事件處理函式) ---
 try:
     import linebot
     linebot_module_imported = True
-    print(f"INFO (繁中): 成功導入 'linebot' 主模組。")
-    try:
-        linebot_actual_version = linebot.__version__
-        print(f"INFO (繁中): Python line-bot-sdk 版本: {linebot_actual_version}")
-    except AttributeError:
-        print("警告 (繁中): 無法確定 line-bot-sdk 版本。")
+    linebot_actual_version = getattr(linebot, '__version__', "未知")
 except ImportError as e_linebot_main:
     print(f"嚴重錯誤 (繁中): 導入 'linebot' 主模組失敗: {e_linebot_main}")
 
@@ -37,58 +45,106 @@ if linebot_module_imported:
         from linebot.models import MessageEvent as GlobalMessageEvent, FollowEvent as GlobalFollowEvent, UnfollowEvent as GlobalUnfollowEvent, TextMessage as GlobalTextMessage, TextSendMessage as GlobalTextSendMessage, SourceUser as GlobalSourceUser, SourceGroup as GlobalSourceGroup
         LineBotApi, WebhookHandler, InvalidSignatureError, MessageEvent, FollowEvent, UnfollowEvent, TextMessageContent, TextSendMessage, SourceUser, SourceGroup = GlobalLineBotApi, GlobalWebhookHandler, GlobalInvalidSignatureError, GlobalMessageEvent, GlobalFollowEvent, GlobalUnfollowEvent, GlobalTextMessage, GlobalTextSendMessage, GlobalSourceUser, GlobalSourceGroup
         sdk_import_successful = True
-        print(f"INFO (繁中): 已成功從 linebot.* (v1/v2 風格) 導入核心 SDK 類別。")
     except ImportError as e:
         print(f"嚴重錯誤 (繁中): 導入 LINE SDK 核心類別失敗: {e}")
 else:
      print(f"錯誤 (繁中): linebot 主模組導入失敗，無法進行後續導入。")
 
-# --- 導入 Firestore Client ---
-try:
-    from google.cloud import firestore
-    from google.cloud.firestore_v1.field_path import FieldPath as ImportedFieldPath 
-    FieldPath = ImportedFieldPath 
-    print(f"INFO (繁中): 成功導入 Firestore 相關模組。")
-    try:
-        firestore_client_version = firestore.__version__
-        print(f"INFO (繁中): google-cloud-firestore 版本: {firestore_client_version}")
-    except AttributeError:
-        print("警告 (繁中): 無法確定 google-cloud-firestore 版本。")
-except ImportError as e:
-    print(f"嚴重錯誤 (繁中): 導入 Firestore 相關模組失敗: {e}")
-    firestore = None
-    FieldPath = None 
-
 # --- 載入 .env 與讀取環境變數 ---
-load_dotenv()
+# 正式環境 (Cloud Functions / Cloud Run 會設定 K_SERVICE 或 FUNCTION_NAME) 的設定都來自環境變數，不讀取 .env
+IS_PRODUCTION = bool(os.environ.get('K_SERVICE') or os.environ.get('FUNCTION_NAME'))
+if not IS_PRODUCTION:
+    from dotenv import load_dotenv
+    load_dotenv()
 LINE_CHANNEL_SECRET = os.environ.get('LINE_CHANNEL_SECRET')
 LINE_CHANNEL_ACCESS_TOKEN = os.environ.get('LINE_CHANNEL_ACCESS_TOKEN')
 GCP_PROJECT_ID = os.environ.get('GCP_PROJECT_ID')
 TARGET_GROUP_ID = os.environ.get('TARGET_GROUP_ID')
-
-# --- 初始化 Flask App 和服務 ---
+# 儲存後端：firestore (預設，正式環境) 或 memory (本地測試/壓力測試用的記憶體替身)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'firestore').lower()
+# LINE API 的 HTTP 傳輸設定 (line_transport.PooledHttpClient)：連線/讀取逾時 (秒)、429/5xx 重試次數、連線池大小
+LINE_API_CONNECT_TIMEOUT = float(os.environ.get('LINE_API_CONNECT_TIMEOUT', '3'))
+LINE_API_READ_TIMEOUT = float(os.environ.get('LINE_API_READ_TIMEOUT', '10'))
+LINE_API_MAX_RETRIES = int(os.environ.get('LINE_API_MAX_RETRIES', '3'))
+LINE_API_POOL_SIZE = int(os.environ.get('LINE_API_POOL_SIZE', '10'))
+# 截止時間的時區，以及截止前幾小時發送提醒 (逗號分隔，例如 "24,2"；空字串表示不提醒)
+DEADLINE_TIMEZONE = os.environ.get('DEADLINE_TIMEZONE', deadlines.DEFAULT_TIMEZONE)
+DEADLINE_REMINDER_HOURS = sorted((float(h) for h in os.environ.get('DEADLINE_REMINDER_HOURS', '24,2').split(',') if h.strip()), reverse=True)
+# 排程/維運用的 /tasks/* 端點需要在 X-Task-Token 標頭帶上這個值 (未設定時端點停用)
+TASK_AUTH_TOKEN = os.environ.get('TASK_AUTH_TOKEN')
+# 非同步模式：收到 Webhook 後立即回覆 200，事件交給背景執行緒處理
+ASYNC_WEBHOOK = os.environ.get('ASYNC_WEBHOOK', 'false').lower() in ('1', 'true', 'yes')
+# 處理事件的執行緒數上限 (非同步模式，以及同步模式下一次收到多個事件時共用)
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '4'))
+# reply token 的有效時間約為 1 分鐘，超過此秒數就改用 push 傳送回覆
+REPLY_TOKEN_MAX_AGE_SECONDS = float(os.environ.get('REPLY_TOKEN_MAX_AGE_SECONDS', '50'))
+# 代禱事項寫入合併的時間窗 (毫秒)，0 表示停用，每次更新各自寫入
+WRITE_COALESCE_MS = float(os.environ.get('WRITE_COALESCE_MS', '0'))
+
+# --- 延遲初始化 Firestore 與 LINE API (lazy.LazyObject) ---
+# 匯入 main.py 時不建立任何連線，第一次使用 firestore / FieldPath / db / line_bot_api 時才初始化 (thread-safe，只做一次)，
+# 縮短冷啟動到可以處理第一個 Webhook 的時間。
+def _load_firestore_module():
+    """導入 Firestore 模組 (或記憶體替身)。"""
+    global firestore_client_version
+    # 依指令計算 Firestore 的讀取/寫入/查詢次數 (/metrics)
+    module = instrumentation.instrument_firestore(storage.load_firestore_module(STORAGE_BACKEND))
+    firestore_client_version = getattr(module, '__version__', "未知")
+    print(f"INFO (繁中): 成功導入儲存後端模組 ({STORAGE_BACKEND}，版本: {firestore_client_version})。")
+    return module
+
+def _load_field_path():
+    """FieldPath 類別 (google.cloud.firestore 沒有在頂層匯出，記憶體後端則由替身模組提供)。"""
+    module = firestore.resolve()
+    if module is None:
+        raise RuntimeError("Firestore 主模組未導入，無法使用 FieldPath。")
+    if STORAGE_BACKEND == 'firestore':
+        from google.cloud.firestore_v1.field_path import FieldPath as ImportedFieldPath
+        return ImportedFieldPath
+    return module.FieldPath
+
+def _create_db():
+    module = firestore.resolve()
+    if module is None:
+        raise RuntimeError("Firestore 主模組未導入，無法初始化 Client。")
+    client = module.Client(project=GCP_PROJECT_ID) if GCP_PROJECT_ID else module.Client()
+    print(f"INFO (繁中): Firestore Client 初始化完成 (後端: {STORAGE_BACKEND})。")
+    return client
+
+def _create_line_bot_api():
+    if not sdk_import_successful or not LINE_CHANNEL_ACCESS_TOKEN:
+        raise RuntimeError("缺少金鑰或核心類別")
+    import line_transport
+    api = LineBotApi(
+        LINE_CHANNEL_ACCESS_TOKEN,
+        timeout=(LINE_API_CONNECT_TIMEOUT, LINE_API_READ_TIMEOUT),
+        http_client=functools.partial(line_transport.PooledHttpClient,
+                                      pool_size=LINE_API_POOL_SIZE, max_retries=LINE_API_MAX_RETRIES))
+    print(f"INFO (繁中): LINE Bot SDK 初始化完成 (line-bot-sdk 版本: {linebot_actual_version})。")
+    return api
+
+firestore = lazy.LazyObject("Firestore 模組", _load_firestore_module)
+FieldPath = lazy.LazyObject("FieldPath", _load_field_path)
+db = lazy.LazyObject("Firestore Client", _create_db)
+line_bot_api = lazy.LazyObject("LINE Bot API", _create_line_bot_api)
+
+def db_ready():
+    """Firestore Client 是否可用 (第一次呼叫時會初始化)。"""
+    return bool(db)
+
+def sdk_ready():
+    """LINE Bot SDK 是否可用 (第一次呼叫時會初始化 LineBotApi)。"""
+    return handler is not None and bool(line_bot_api)
+
+# --- 初始化 Flask App 與 WebhookHandler (只做簽章驗證，建立成本很低) ---
 flask_app = Flask(__name__)
-db = None
-line_bot_api = None 
 handler = None      
 
-if firestore: 
+if sdk_import_successful and LINE_CHANNEL_SECRET and LINE_CHANNEL_ACCESS_TOKEN:
     try:
-        db = firestore.Client(project=GCP_PROJECT_ID) if GCP_PROJECT_ID else firestore.Client()
-        db_initialized_successfully = True
-        print(f"INFO (繁中): Firestore Client 初始化完成。")
-    except Exception as e: print(f"嚴重錯誤 (繁中): Firestore Client 初始化失敗: {e}")
-else: print("嚴重錯誤 (繁中): Firestore 主模組未導入，無法初始化 Client。")
-
-if sdk_import_successful:
-    if LINE_CHANNEL_SECRET and LINE_CHANNEL_ACCESS_TOKEN and LineBotApi and WebhookHandler:
-        try:
-            line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
-            handler = WebhookHandler(LINE_CHANNEL_SECRET)      
-            sdk_initialized_successfully = True
-            print("INFO (繁中): LINE Bot SDK 初始化完成。")
-        except Exception as e: print(f"錯誤 (繁中): LINE Bot SDK 初始化過程中發生錯誤: {e}")
-    else: print("錯誤 (繁中): LINE Bot SDK 未能初始化 (缺少金鑰或核心類別)。")
+        handler = WebhookHandler(LINE_CHANNEL_SECRET)      
+    except Exception as e: print(f"錯誤 (繁中): LINE Bot SDK 初始化過程中發生錯誤: {e}")
+elif sdk_import_successful: print("錯誤 (繁中): LINE Bot SDK 未能初始化 (缺少金鑰或核心類別)。")
 else: print("錯誤 (繁中): 因核心組件導入失敗，無法初始化 LINE Bot SDK。")
 
 # === Flask App 的路由定義 ===
@@ -96,29 +152,92 @@ else: print("錯誤 (繁中): 因核心組件導入失敗，無法初始化 LINE
 def hello_world_flask():
     print("--- ROUTE: / (hello_world_flask) executed ---")
     return (f"LINE Bot 代禱事項小幫手 (診斷模式)<br>"
-            f"SDK 初始化: {'成功' if sdk_initialized_successfully else '失敗'}<br>"
-            f"DB 初始化: {'成功' if db_initialized_successfully else '失敗'}<br>"
-            f"目標群組 ID: {'已設定' if TARGET_GROUP_ID else '未設定'}")
+            f"SDK 初始化: {'成功' if sdk_ready() else '失敗'}<br>"
+            f"DB 初始化: {'成功' if db_ready() else '失敗'} (後端: {STORAGE_BACKEND})<br>"
+            f"預設群組 ID (TARGET_GROUP_ID): {'已設定' if TARGET_GROUP_ID else '未設定'}<br>"
+            f"群組快取: 命中 {group_cache.hits} / 未命中 {group_cache.misses} / 過期淘汰 {group_cache.stale}<br>"
+            f"代禱列表快取: 命中 {round_list_cache.hits} / 未命中 {round_list_cache.misses}<br>"
+            f"個人資料快取: 命中 {profile_cache.hits} / 未命中 {profile_cache.misses}<br>"
+            f"輪次快照快取: 命中 {round_snapshot_cache.hits} / 未命中 {round_snapshot_cache.misses}<br>"
+            f"略過的重複事件: 本執行個體 {int(duplicate_events.value(layer='memory'))} / Firestore {int(duplicate_events.value(layer='firestore'))}")
+
+@flask_app.route('/metrics')
+def metrics_flask():
+    """Prometheus 格式的效能指標 (此執行個體啟動以來的累計值)。"""
+    return metrics.render_prometheus(), 200, {'Content-Type': metrics.PROMETHEUS_CONTENT_TYPE}
 
 @flask_app.route('/callback', methods=['POST'])
 def line_callback_flask():
     print("--- ROUTE: /callback (line_callback_flask) executed ---")
-    if not sdk_initialized_successfully or not handler or not line_bot_api:
+    if not sdk_ready():
         abort(500) 
-    if not db_initialized_successfully or not db :
+    if not db_ready():
         abort(500)
     
     signature = request.headers['X-Line-Signature']
     body = request.get_data(as_text=True)
     
     try:
-        handler.handle(body, signature)
+        payload = handler.parser.parse(body, signature, as_payload=True)
+        if ASYNC_WEBHOOK:
+            # 非同步模式：驗證簽章並解析事件後立即回覆 200，事件交給背景執行緒處理
+            for event in payload.events:
+                submit_event(event, payload)
+        elif len(payload.events) > 1:
+            # 同一個 Webhook 中有多個事件：不同使用者的事件同時處理，全部完成後才回覆 200
+            for future in [submit_event(event, payload) for event in payload.events]:
+                future.result()
+        else:
+            for event in payload.events:
+                dispatch_event(event, payload)
     except InvalidSignatureError:
         abort(400) 
     except Exception as e:
         print(f"錯誤 (繁中): 處理 Webhook 時發生未預期錯誤: {e}"); abort(500) 
     return 'OK'
 
+def check_task_auth():
+    """/tasks/* 端點的驗證 (供 Cloud Scheduler 等排程服務呼叫)。"""
+    if not TASK_AUTH_TOKEN or request.headers.get('X-Task-Token') != TASK_AUTH_TOKEN:
+        abort(403)
+    if not sdk_ready() or not db_ready():
+        abort(503)
+
+@flask_app.route('/tasks/remind', methods=['POST'])
+def remind_task_flask():
+    """提醒尚未更新代禱事項的成員。Body: {"group_id": "..."} (省略時使用 TARGET_GROUP_ID)。"""
+    check_task_auth()
+    group_id = (request.get_json(silent=True) or {}).get('group_id') or TARGET_GROUP_ID
+    if not group_id:
+        abort(400)
+    with instrumentation.command_scope('task:remind', 'task'):
+        result = send_pending_reminders(PrayerContext(group_id, use_cache=False))
+    if result is None:
+        return jsonify({'group_id': group_id, 'active_round': False})
+    return jsonify({'group_id': group_id, 'active_round': True, **result})
+
+@flask_app.route('/api/users/<user_id>/prayer_history')
+def prayer_history_api_flask(user_id):
+    """個人代禱紀錄 (由新到舊)。Query: cursor (上一頁的 next_cursor)、limit (預設 5，最多 50)。需要 X-Task-Token。"""
+    check_task_auth()
+    try:
+        limit = min(max(int(request.args.get('limit', PRAYER_HISTORY_PAGE_SIZE)), 1), PRAYER_HISTORY_MAX_PAGE_SIZE)
+        items, next_cursor = load_prayer_history(user_id, request.args.get('cursor') or None, limit)
+    except ValueError:
+        abort(400)
+    for item in items:
+        for field in ('created_time', 'ended_time'):
+            if isinstance(item.get(field), datetime.datetime):
+                item[field] = item[field].isoformat()
+    return jsonify({'user_id': user_id, 'items': items, 'next_cursor': next_cursor})
+
+@flask_app.route('/tasks/deadlines', methods=['POST'])
+def deadlines_task_flask():
+    """自動結束已到截止時間的輪次，並發送截止前提醒 (建議由 Cloud Scheduler 每 5~15 分鐘呼叫一次)。"""
+    check_task_auth()
+    with instrumentation.command_scope('task:deadlines', 'task'):
+        return jsonify(process_deadlines())
+
 # --- 幫助訊息內容 (區分版本) ---
 
 USER_HELP_MESSAGE = """📖 代禱事項小幫手 - 指令說明 📖
@@ -139,9 +258,18 @@ USER_HELP_MESSAGE = """📖 代禱事項小幫手 - 指令說明 📖
   ▪️ 我的代禱
      (查詢您目前的代禱事項)
      
+  ▪️ 我的代禱紀錄
+     (查詢您在過去輪次的代禱事項，私訊專用)
+     
   ▪️ 代禱列表
      (查詢所有人的代禱事項)
      
+  ▪️ 上輪總結
+     (查看上一輪結束時的代禱事項總結)
+     
+  ▪️ 切換群組 [編號]
+     (加入多個代禱群組時，選擇私訊指令要作用的群組)
+     
 💡 其他
   ▪️ 幫助 或 help
      (顯示此幫助訊息)
@@ -157,6 +285,9 @@ ADMIN_HELP_MESSAGE = """👑 代禱事項小幫手 - 指令說明 (管理員版)
   ▪️ 開始代禱 [截止時間]
   ▪️ 結束代禱
   ▪️ 代禱列表
+  ▪️ 上輪總結
+  ▪️ 提醒代禱 (私訊提醒尚未更新的成員)
+  ▪️ 搜尋代禱 [關鍵字] (搜尋過去輪次的代禱事項)
 
 🙋 個人指令 (可在私訊或群組中使用)
   ▪️ 加入代禱
@@ -164,8 +295,12 @@ ADMIN_HELP_MESSAGE = """👑 代禱事項小幫手 - 指令說明 (管理員版)
   ▪️ 代禱 [事項]
   ▪️ 代禱 同上週
   ▪️ 我的代禱
+  ▪️ 我的代禱紀錄 (私訊專用)
   ▪️ 名單列表 (私訊專用)
   ▪️ 修改成員名字 [舊名字] [新名字]
+  ▪️ 移除成員 [名字] (私訊專用，多位以逗號分隔)
+  ▪️ 名單設定 (私訊專用，換行後每行一位成員)
+  ▪️ 切換群組 [編號] (私訊專用)
   
 💡 其他
   ▪️ 幫助 或 help
@@ -173,61 +308,1106 @@ ADMIN_HELP_MESSAGE = """👑 代禱事項小幫手 - 指令說明 (管理員版)
 """
 
 # --- 輔助函式 ---
-def is_group_admin(group_id_check, user_id_check):
-    if not db_initialized_successfully or not group_id_check or not user_id_check: return False
-    try:
-        group_doc_ref = db.collection('prayer_groups').document(group_id_check)
-        group_data_snapshot = group_doc_ref.get()
-        if group_data_snapshot.exists:
-            admin_ids = group_data_snapshot.to_dict().get('admin_user_ids', [])
-            return user_id_check in admin_ids
-    except Exception as e: print(f"錯誤 (繁中): 檢查管理員權限時發生錯誤: {e}")
-    return False
-
-def reply_message_handler(reply_token, reply_text):
-    """統一的回覆訊息函式"""
+# LINE multicast 每次最多 500 位收件者
+MULTICAST_LIMIT = 500
+
+def build_text_messages(text):
+    """將文字依成員邊界切成多則 TextSendMessage (每則不超過 LINE 的 5000 字上限)。"""
+    return [TextSendMessage(text=chunk) for chunk in rendering.split_text_messages(text)]
+
+def push_text_messages(to, messages):
+    """推播多則訊息，每次 push 最多 LINE_MESSAGES_PER_CALL 則。"""
+    per_call = rendering.LINE_MESSAGES_PER_CALL
+    for start in range(0, len(messages), per_call):
+        line_bot_api.push_message(to, messages[start:start + per_call])
+
+def push_text(to, text):
+    push_text_messages(to, build_text_messages(text))
+
+def multicast_text(user_ids, text):
+    """
+    以 multicast 私訊多位使用者 (每次最多 MULTICAST_LIMIT 人)，回傳 (成功人數, 失敗人數)。
+    推播請求會由 line_transport 帶上 X-Line-Retry-Key，重試時不會重複發送。
+    """
+    messages = build_text_messages(text)[:rendering.LINE_MESSAGES_PER_CALL]
+    sent = failed = 0
+    for start in range(0, len(user_ids), MULTICAST_LIMIT):
+        chunk = user_ids[start:start + MULTICAST_LIMIT]
+        try:
+            line_bot_api.multicast(chunk, messages)
+            sent += len(chunk)
+        except Exception as e:
+            failed += len(chunk)
+            print(f"錯誤 (繁中): multicast 給 {len(chunk)} 位使用者時發生錯誤: {e}")
+    return sent, failed
+
+def reply_message_handler(reply_token, reply_text, push_target=None):
+    """
+    統一的回覆訊息函式。
+    過長的內容會切成多則訊息；一次 reply 最多 5 則，其餘的以 push 傳給 push_target (群組或使用者)。
+    """
     if reply_text:
         try:
-            line_bot_api.reply_message(reply_token, TextSendMessage(text=reply_text))
-            print(f"INFO (繁中): 已成功回覆訊息。")
+            messages = build_text_messages(reply_text)
+            per_call = rendering.LINE_MESSAGES_PER_CALL
+            line_bot_api.reply_message(reply_token, messages[:per_call])
+            print(f"INFO (繁中): 已成功回覆訊息 ({min(len(messages), per_call)} 則)。")
+            overflow = messages[per_call:]
+            if overflow and push_target:
+                push_text_messages(push_target, overflow)
+                print(f"INFO (繁中): 訊息超過一次回覆的上限，其餘 {len(overflow)} 則已改用推播送出。")
+            elif overflow:
+                print(f"警告 (繁中): 訊息超過一次回覆的上限，但沒有推播對象，其餘 {len(overflow)} 則未送出。")
         except Exception as e: print(f"錯誤 (繁中): 回覆訊息時發生錯誤: {e}")
     else:
         print(f"INFO (繁中): 無需回覆訊息。")
 
+def reply_to_event(event, reply_text):
+    """
+    回覆某個事件。reply token 仍在有效時間內時使用 reply_message；
+    若事件在背景佇列中等待太久 (token 可能已失效)，則改用 push_message 傳給原本的聊天室。
+    """
+    event_age_seconds = (datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000 - (event.timestamp or 0)) / 1000
+    push_target = getattr(event.source, 'group_id', None) or event.source.user_id
+    if not reply_text or event_age_seconds <= REPLY_TOKEN_MAX_AGE_SECONDS:
+        reply_message_handler(event.reply_token, reply_text, push_target)
+        return
+    try:
+        push_text(push_target, reply_text)
+        print(f"INFO (繁中): 事件已等待 {event_age_seconds:.1f} 秒，reply token 可能失效，已改用推播回覆。")
+    except Exception as e: print(f"錯誤 (繁中): 以推播方式回覆訊息時發生錯誤: {e}")
+
+# --- 背景事件處理 (非同步模式) ---
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+def get_worker_pool():
+    """第一次使用時才建立執行緒池 (同步模式下只有在單一 Webhook 含多個事件時才會建立)。"""
+    global _worker_pool
+    if _worker_pool is None:
+        with _worker_pool_lock:
+            if _worker_pool is None:
+                _worker_pool = workers.BackgroundWorkerPool(max_workers=WEBHOOK_WORKERS)
+    return _worker_pool
+
+def event_ordering_key(event):
+    """同一位使用者的事件必須依序處理；沒有使用者 ID 的事件各自獨立。"""
+    source = getattr(event, 'source', None)
+    return getattr(source, 'user_id', None) or id(event)
+
+def submit_event(event, payload):
+    return get_worker_pool().submit_ordered(event_ordering_key(event), dispatch_event, event, payload)
+
+# 事件處理函式的對應表 {(事件類別, 訊息類別或 None): 處理函式}。WebhookHandler 只公開一次處理整個 Webhook 的
+# handler.handle()，背景執行緒需要逐一分派已解析的事件，因此以 on_event 註冊時同時記錄在這裡
+# (並以公開的 handler.add 註冊到 WebhookHandler)，不依賴 SDK 內部的 handler._handlers。
+EVENT_HANDLERS = {}
+
+def on_event(event_class, message=None):
+    """取代 @handler.add 的裝飾器。"""
+    def decorator(func):
+        EVENT_HANDLERS[(event_class, message)] = func
+        return handler.add(event_class, message=message)(func)
+    return decorator
+
+def dispatch_event(event, payload):
+    """依照以 on_event 註冊的處理函式分派單一事件 (與 handler.handle 的對應規則相同：先比對訊息類別，再比對事件類別)。"""
+    func = None
+    if isinstance(event, MessageEvent):
+        func = EVENT_HANDLERS.get((event.__class__, event.message.__class__))
+    if func is None:
+        func = EVENT_HANDLERS.get((event.__class__, None))
+    if func is None:
+        print(f"INFO (繁中): 沒有對應 {event.__class__.__name__} 的處理函式，略過。")
+        return
+    func(event)
+
+# --- 重送事件去重 (Idempotency) ---
+# 處理太慢時 LINE 會以相同的 webhookEventId 重送事件 (deliveryContext.isRedelivery)。
+# 會執行的事件 (指令、加好友) 在處理前先「認領」事件 ID：先查本執行個體的 LRU，
+# 會寫入資料的指令再以 processed_events/{webhookEventId} 的 create() 原子性地認領 (跨執行個體)，已存在就代表處理過而直接略過。
+# processed_events 的 expire_at 欄位可搭配 Firestore TTL 政策自動刪除。處理失敗時會釋放認領，讓重送可以重試。
+PROCESSED_EVENTS_COLLECTION = 'processed_events'
+EVENT_DEDUPE_TTL_SECONDS = float(os.environ.get('EVENT_DEDUPE_TTL_SECONDS', '86400'))
+# false 時只使用本執行個體的 LRU (省下每個指令一次寫入，但無法攔截送到其他執行個體的重送)
+EVENT_DEDUPE_PERSISTENT = os.environ.get('EVENT_DEDUPE_PERSISTENT', 'true').lower() in ('1', 'true', 'yes')
+processed_event_cache = caches.LRUTTLCache(max_size=4096, ttl_seconds=EVENT_DEDUPE_TTL_SECONDS)
+_event_claim_lock = threading.Lock()
+duplicate_events = metrics.REGISTRY.counter(
+    'prayer_bot_duplicate_events_total', "略過的重複 (重送) 事件數", ('layer',))
+
+def claim_event(event, persistent=True):
+    """
+    認領事件，回傳 True 表示應該處理；已處理過的重複事件回傳 False。沒有事件 ID 時一律處理。
+    persistent=False 用於重複執行也無妨的事件 (查詢類指令、加好友)，只檢查本執行個體，省下一次寫入。
+    """
+    event_id = getattr(event, 'webhook_event_id', None)
+    if not event_id:
+        return True
+    with _event_claim_lock:
+        if processed_event_cache.get(event_id) is not None:
+            duplicate_events.inc(layer='memory')
+            print(f"INFO (繁中): 略過重複的事件 {event_id} (本執行個體已處理)。")
+            return False
+        processed_event_cache.put(event_id, True)
+    if not (persistent and EVENT_DEDUPE_PERSISTENT):
+        return True
+    delivery_context = getattr(event, 'delivery_context', None)
+    try:
+        db.collection(PROCESSED_EVENTS_COLLECTION).document(event_id).create({
+            'type': getattr(event, 'type', None),
+            'is_redelivery': bool(getattr(delivery_context, 'is_redelivery', False)),
+            'processed_time': firestore.SERVER_TIMESTAMP,
+            'expire_at': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=EVENT_DEDUPE_TTL_SECONDS),
+        })
+    except storage.conflict_errors():
+        duplicate_events.inc(layer='firestore')
+        print(f"INFO (繁中): 略過重複的事件 {event_id} (已由其他請求處理)。")
+        return False
+    except Exception as e:
+        # 去重失敗時仍然處理事件 (寧可重複也不要漏掉)
+        print(f"警告 (繁中): 記錄事件 {event_id} 時發生錯誤，仍繼續處理: {e}")
+    return True
+
+def release_event(event):
+    """事件處理失敗時釋放認領，讓 LINE 的重送可以重新處理。"""
+    event_id = getattr(event, 'webhook_event_id', None)
+    if not event_id:
+        return
+    processed_event_cache.invalidate(event_id)
+    if EVENT_DEDUPE_PERSISTENT:
+        try:
+            db.collection(PROCESSED_EVENTS_COLLECTION).document(event_id).delete()
+        except Exception as e:
+            print(f"警告 (繁中): 釋放事件 {event_id} 時發生錯誤: {e}")
+
+# --- prayer_groups 文件快取 ---
+# 暖機中的執行個體會在多次請求之間保留這份快取。跨執行個體的變動最多延遲 GROUP_CACHE_TTL_SECONDS 秒，
+# 而且只在讀取路徑 (代禱、我的代禱、代禱列表) 使用；會寫入資料的指令一律重新讀取最新的群組文件。
+GROUP_CACHE_TTL_SECONDS = float(os.environ.get('GROUP_CACHE_TTL_SECONDS', '60'))
+group_cache = caches.GroupDocCache(ttl_seconds=GROUP_CACHE_TTL_SECONDS)
+
+# --- 代禱列表快取 ---
+# 每個進行中的輪次保存一份已排序的名單與排版好的列表 (rendering.RoundListing)，
+# 「代禱列表」命中快取時不需查詢 entries，也不需重新排序與排版。
+# 本執行個體上的事項更新會直接改寫快取中的那一行；其他執行個體的更新最多延遲 PRAYER_LIST_CACHE_TTL_SECONDS 秒。
+PRAYER_LIST_CACHE_TTL_SECONDS = float(os.environ.get('PRAYER_LIST_CACHE_TTL_SECONDS', '30'))
+round_list_cache = caches.LRUTTLCache(max_size=32, ttl_seconds=PRAYER_LIST_CACHE_TTL_SECONDS)
+
+def get_round_listing(ctx):
+    """取得 ctx 所在輪次的 RoundListing；快取未命中時才讀取 entries。"""
+    group_version = ctx.group_data.get('version', 0)
+    listing = round_list_cache.get(ctx.round_id)
+    if listing is None:
+        entries = load_round_entries(ctx.round_ref, ctx.round_data)
+        listing = rendering.RoundListing(group_version, ctx.members, entries)
+        round_list_cache.put(ctx.round_id, listing)
+    elif listing.group_version != group_version:
+        # 成員加入或改名：只需重新排序名單
+        listing.set_roster(group_version, ctx.members)
+    return listing
+
+def group_version_bump():
+    """所有會修改 prayer_groups 文件的寫入都要附上這個欄位，讓各執行個體的快取能辨識新舊。"""
+    return {'version': firestore.Increment(1)}
+
+# --- 請求範圍的群組/輪次資料 (Request-scoped Context) ---
+# 記錄每個群組上一次看到的 current_round_id，讓下一次請求可以用 get_all 一次讀取群組與輪次文件。
+# 這份提示只用來猜測要讀哪一份輪次文件，讀回來後仍會以群組文件中的 current_round_id 為準。
+_round_id_hints = {}
+
+class PrayerContext:
+    """
+    單一事件處理期間共用的群組與當前輪次資料。
+    群組文件與當前輪次文件只會讀取一次 (盡量以一次 get_all 往返取得，或由 group_cache 直接提供群組文件)，
+    之後交給各指令處理函式使用，管理員檢查也直接使用同一份群組資料。
+    """
+    def __init__(self, group_id, use_cache=True):
+        self.group_id = group_id
+        self.group_ref = db.collection('prayer_groups').document(group_id) if group_id else None
+        self.use_cache = use_cache
+        self.from_cache = False
+        self._reset()
+
+    def _reset(self):
+        self.group_snapshot = None
+        self.group_data = {}
+        self.round_id = None
+        self.round_ref = None
+        self.round_snapshot = None
+        self.round_data = {}
+        self._loaded = False
+
+    def load(self):
+        """讀取群組與當前輪次文件 (只會執行一次)。"""
+        if self._loaded or not self.group_ref:
+            return self
+        if self.use_cache and self._load_from_cache():
+            return self
+
+        hinted_round_id = _round_id_hints.get(self.group_id)
+        refs = [self.group_ref]
+        if hinted_round_id:
+            refs.append(db.collection('prayer_rounds').document(hinted_round_id))
+        snapshots = {snapshot.reference.path: snapshot for snapshot in db.get_all(refs)}
+
+        self.group_snapshot = snapshots[self.group_ref.path]
+        self.group_data = self.group_snapshot.to_dict() or {}
+        self.from_cache = False
+        if self.group_snapshot.exists:
+            group_cache.put_group(self.group_id, self.group_data)
+        else:
+            group_cache.invalidate(self.group_id)
+        self.round_id = self.group_data.get('current_round_id')
+
+        if self.round_id:
+            self.round_ref = db.collection('prayer_rounds').document(self.round_id)
+            self.round_snapshot = snapshots.get(self.round_ref.path)
+            if self.round_snapshot is None:
+                # 提示過期 (例如輪次已在其他執行個體上更換)，才需要第二次讀取
+                self.round_snapshot = self.round_ref.get()
+            self.round_data = self.round_snapshot.to_dict() or {}
+            _round_id_hints[self.group_id] = self.round_id
+        else:
+            _round_id_hints.pop(self.group_id, None)
+
+        self._loaded = True
+        return self
+
+    def _load_from_cache(self):
+        """
+        以快取中的群組文件搭配一次輪次讀取完成載入。
+        只有在快取指向的輪次確實仍在進行中時才採用，否則視為過期並改走完整讀取。
+        """
+        cached_group = group_cache.get(self.group_id)
+        if not cached_group or not cached_group.get('current_round_id'):
+            return False
+        round_ref = db.collection('prayer_rounds').document(cached_group['current_round_id'])
+        round_snapshot = round_ref.get()
+        if not round_snapshot.exists or not round_snapshot.to_dict().get('is_active'):
+            group_cache.mark_stale(self.group_id)
+            return False
+        self.group_data = cached_group
+        self.round_id = cached_group['current_round_id']
+        self.round_ref = round_ref
+        self.round_snapshot = round_snapshot
+        self.round_data = round_snapshot.to_dict() or {}
+        self.from_cache = True
+        self._loaded = True
+        return True
+
+    def fresh(self):
+        """要求使用 Firestore 上最新的群組文件 (會寫入資料或檢查權限的指令使用)。"""
+        self.use_cache = False
+        if self._loaded and self.from_cache:
+            self._reset()
+        return self
+
+    def member(self, user_id):
+        """
+        取得成員資料。若快取中找不到 (可能是剛在其他執行個體加入的新成員)，
+        會改讀最新的群組文件再確認一次。
+        """
+        member_data = self.members.get(user_id)
+        if member_data is None and self.from_cache:
+            group_cache.mark_stale(self.group_id)
+            member_data = self.fresh().members.get(user_id)
+        return member_data
+
+    @property
+    def group_exists(self):
+        self.load()
+        return self.from_cache or (self.group_snapshot is not None and self.group_snapshot.exists)
+
+    @property
+    def members(self):
+        return self.load().group_data.get('members', {})
+
+    @property
+    def round_exists(self):
+        return self.load().round_snapshot is not None and self.round_snapshot.exists
+
+    @property
+    def has_active_round(self):
+        return self.round_exists and bool(self.round_data.get('is_active'))
+
+    @property
+    def name_index(self):
+        return member_name_index(self.load().group_data)
+
+    def member_by_name(self, name):
+        """依名字 (忽略全形/半形、大小寫與前後空白) 找到成員的 user_id，找不到時回傳 None。"""
+        return self.name_index.get(member_name_key(name))
+
+    def is_admin(self, user_id):
+        if not db_ready() or not self.group_id or not user_id: return False
+        try:
+            if self.group_exists:
+                return user_id in self.group_data.get('admin_user_ids', [])
+        except Exception as e: print(f"錯誤 (繁中): 檢查管理員權限時發生錯誤: {e}")
+        return False
+
+# --- 成員名字索引 ---
+# 群組文件的 name_index 記錄 {正規化後的名字: user_id}，依名字找成員 (修改成員名字、檢查重名) 只需一次 dict 查詢。
+# 正規化方式為 NFKC (全形英數轉半形)、casefold 與空白整理，因此「Ａｍｙ」與「amy 」視為同一個名字。
+# 名字可能含有 . 或空白，更新索引時以 FieldPath 產生加上反引號的欄位路徑。
+# 兩位成員的 LINE 名稱正規化後相同時，索引指向先加入的成員；他改名後索引會改指向另一位同名的成員。
+NAME_INDEX_FIELD = 'name_index'
+
+def member_name_key(name):
+    return ' '.join(unicodedata.normalize('NFKC', name or '').casefold().split())
+
+def build_member_name_index(members_map):
+    index = {}
+    for uid, member_info in members_map.items():
+        key = member_name_key(member_info.get('name'))
+        if key:
+            index.setdefault(key, uid)
+    return index
+
+def member_name_index(group_data):
+    """群組的名字索引；此功能上線前建立的群組文件沒有 name_index，改由 members 建立 (下一次寫入名字時補寫)。"""
+    index = group_data.get(NAME_INDEX_FIELD)
+    return index if index is not None else build_member_name_index(group_data.get('members', {}))
+
+def name_index_updates(group_data, user_id, new_name):
+    """
+    成員加入或改名為 new_name 時，要與 members 一起寫入群組文件的欄位 ({欄位路徑: 值})。
+    只更新受影響的 key；群組文件還沒有 name_index 時則寫入完整的索引。
+    """
+    members_map = group_data.get('members', {})
+    if NAME_INDEX_FIELD not in group_data:
+        updated_members = {**members_map, user_id: {**members_map.get(user_id, {}), 'name': new_name}}
+        return {NAME_INDEX_FIELD: build_member_name_index(updated_members)}
+
+    index = group_data[NAME_INDEX_FIELD]
+    old_key = member_name_key(members_map.get(user_id, {}).get('name'))
+    new_key = member_name_key(new_name)
+    updates = {}
+    if old_key and old_key != new_key and index.get(old_key) == user_id:
+        # 若還有其他同名的成員，索引改指向他
+        heir = next((uid for uid, member_info in members_map.items()
+                     if uid != user_id and member_name_key(member_info.get('name')) == old_key), None)
+        updates[FieldPath(NAME_INDEX_FIELD, old_key).to_api_repr()] = heir or firestore.DELETE_FIELD
+    if new_key and new_key not in index:
+        updates[FieldPath(NAME_INDEX_FIELD, new_key).to_api_repr()] = user_id
+    return updates
+
+def name_index_sync_updates(group_data, new_members):
+    """
+    批次修改名單後 name_index 要寫入的欄位：仍然有效的既有對應保持不變，只寫入新增、改變或刪除的 key。
+    """
+    if NAME_INDEX_FIELD not in group_data:
+        return {NAME_INDEX_FIELD: build_member_name_index(new_members)}
+    old_index = group_data[NAME_INDEX_FIELD]
+    new_index = {key: uid for key, uid in old_index.items()
+                 if uid in new_members and member_name_key(new_members[uid].get('name')) == key}
+    for key, uid in build_member_name_index(new_members).items():
+        new_index.setdefault(key, uid)
+    updates = {FieldPath(NAME_INDEX_FIELD, key).to_api_repr(): uid for key, uid in new_index.items() if old_index.get(key) != uid}
+    updates.update({FieldPath(NAME_INDEX_FIELD, key).to_api_repr(): firestore.DELETE_FIELD for key in old_index if key not in new_index})
+    return updates
+
+# --- 輪次代禱事項的儲存結構 ---
+# 新輪次：每位成員一份文件 prayer_rounds/{round_id}/entries/{user_id}，輪次文件本身只存摘要
+#         (entries_layout='subcollection'、member_count，結束時寫入 summary 統計)。
+#         截止前大家同時更新時，寫入會分散在各自的文件上，不再集中在同一份輪次文件，也不受 1 MiB 文件大小限制。
+# 舊輪次：所有成員的事項都存在輪次文件的 entries map 中。
+# 以下函式同時支援兩種結構，舊資料可用 migrate_round_entries() 轉換。
+ENTRIES_SUBCOLLECTION = 'entries'
+ENTRIES_LAYOUT_SUBCOLLECTION = 'subcollection'
+BATCH_WRITE_LIMIT = 500  # Firestore 單一批次寫入的上限
+
+def round_uses_entry_docs(round_data):
+    return (round_data or {}).get('entries_layout') == ENTRIES_LAYOUT_SUBCOLLECTION
+
+def load_round_entries(round_ref, round_data):
+    """讀取某一輪所有成員的代禱事項 ({user_id: entry})；新結構只需一次集合查詢。"""
+    if round_uses_entry_docs(round_data):
+        return {snapshot.id: snapshot.to_dict() for snapshot in round_ref.collection(ENTRIES_SUBCOLLECTION).stream()}
+    return (round_data or {}).get('entries', {})
+
+def load_round_entry(round_ref, round_data, user_id):
+    """讀取某一輪中單一成員的代禱事項，找不到時回傳 None。"""
+    if round_uses_entry_docs(round_data):
+        snapshot = round_ref.collection(ENTRIES_SUBCOLLECTION).document(user_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+    return (round_data or {}).get('entries', {}).get(user_id)
+
+def write_round_entry(round_ref, round_data, user_id, fields):
+    """
+    更新某一輪中單一成員的代禱事項欄位 (fields 為 {'text': ..., 'status': ...} 這類欄位名稱)。
+    啟用 WRITE_COALESCE_MS 時，會與同一時間窗內其他人的更新合併成一次批次寫入，並等到寫入完成才返回。
+    """
+    coalescer = get_write_coalescer()
+    if round_uses_entry_docs(round_data):
+        entry_ref = round_ref.collection(ENTRIES_SUBCOLLECTION).document(user_id)
+        if coalescer:
+            coalescer.write('set_merge', entry_ref, fields)
+        else:
+            entry_ref.set(fields, merge=True)
+    else:
+        update_data = {f'entries.{user_id}.{field}': value for field, value in fields.items()}
+        if coalescer:
+            coalescer.write('update', round_ref, update_data)
+        else:
+            round_ref.update(update_data)
+    listing = round_list_cache.peek(round_ref.id)
+    if listing is not None:
+        listing.apply_entry_update(user_id, fields)
+
+def load_pending_user_ids(round_ref, round_data):
+    """回傳某一輪中事項仍為 pending (尚未更新) 的成員 user_id 列表。"""
+    if round_uses_entry_docs(round_data):
+        query = round_ref.collection(ENTRIES_SUBCOLLECTION).where('status', '==', 'pending')
+        return [snapshot.id for snapshot in query.stream()]
+    return [uid for uid, entry in (round_data or {}).get('entries', {}).items() if entry.get('status', 'pending') == 'pending']
+
+# --- 代禱事項寫入合併 (截止前大量更新時使用) ---
+write_batch_size = metrics.REGISTRY.histogram(
+    'prayer_bot_write_batch_size', "每次合併寫入提交的文件數", buckets=metrics.DEFAULT_SIZE_BUCKETS)
+write_commit_seconds = metrics.REGISTRY.histogram(
+    'prayer_bot_write_commit_seconds', "合併寫入每次批次提交所花的秒數")
+_write_coalescer = None
+_write_coalescer_lock = threading.Lock()
+
+def get_write_coalescer():
+    """WRITE_COALESCE_MS > 0 時回傳共用的 WriteCoalescer，否則回傳 None。"""
+    global _write_coalescer
+    if WRITE_COALESCE_MS <= 0:
+        return None
+    if _write_coalescer is None:
+        with _write_coalescer_lock:
+            if _write_coalescer is None:
+                _write_coalescer = storage.WriteCoalescer(
+                    db, WRITE_COALESCE_MS / 1000.0, max_batch_size=BATCH_WRITE_LIMIT,
+                    on_commit=lambda size, seconds: (write_batch_size.observe(size), write_commit_seconds.observe(seconds)))
+    return _write_coalescer
+
+def commit_in_batches(operations):
+    """
+    以批次寫入執行一連串的操作，每批最多 BATCH_WRITE_LIMIT 筆。
+    operations 為 (method, doc_ref, data) 的列表，method 為 'set' / 'set_merge' / 'update' / 'delete'。
+    """
+    for start in range(0, len(operations), BATCH_WRITE_LIMIT):
+        batch = db.batch()
+        for method, doc_ref, data in operations[start:start + BATCH_WRITE_LIMIT]:
+            if method == 'delete':
+                batch.delete(doc_ref)
+            elif method == 'set_merge':
+                batch.set(doc_ref, data, merge=True)
+            else:
+                getattr(batch, method)(doc_ref, data)
+        batch.commit()
+
+def create_round(round_ref, round_data, members_map):
+    """
+    建立新輪次：先以批次寫入每位成員的事項文件，最後才寫入輪次文件，
+    確保任何人看到這個輪次時，成員的事項文件都已存在。
+    """
+    entries_ref = round_ref.collection(ENTRIES_SUBCOLLECTION)
+    operations = [('set', entries_ref.document(uid), {
+        'name': member_info.get('name', '未知名字'), # 將名字也存一份在 entry 中，方便列表顯示
+        'text': '',
+        'status': 'pending',
+        'last_updated': firestore.SERVER_TIMESTAMP
+    }) for uid, member_info in members_map.items()]
+    operations.append(('set', round_ref, {**round_data, 'entries_layout': ENTRIES_LAYOUT_SUBCOLLECTION, 'member_count': len(members_map)}))
+    commit_in_batches(operations)
+
+def round_summary_counts(entries):
+    """結束輪次時寫入輪次文件的統計摘要。"""
+    pending = sum(1 for entry in entries.values() if entry.get('status', 'pending') == 'pending' and not entry.get('text'))
+    return {'member_count': len(entries), 'submitted_count': len(entries) - pending, 'pending_count': pending}
+
+def migrate_round_entries(round_id):
+    """
+    將舊結構 (entries map) 的輪次轉換成子集合結構。已轉換過的輪次會直接略過。
+    建議在沒有人更新事項的時段執行 (例如輪次結束後)。回傳搬移的事項數量，略過時回傳 None。
+    """
+    round_ref = db.collection('prayer_rounds').document(round_id)
+    round_snapshot = round_ref.get()
+    if not round_snapshot.exists:
+        return None
+    round_data = round_snapshot.to_dict()
+    if round_uses_entry_docs(round_data):
+        return None
+    entries = round_data.get('entries', {})
+    entries_ref = round_ref.collection(ENTRIES_SUBCOLLECTION)
+    operations = [('set', entries_ref.document(uid), entry) for uid, entry in entries.items()]
+    # 最後一筆才切換輪次文件的結構並移除 entries map
+    operations.append(('update', round_ref, {
+        'entries': firestore.DELETE_FIELD,
+        'entries_layout': ENTRIES_LAYOUT_SUBCOLLECTION,
+        'member_count': len(entries)
+    }))
+    commit_in_batches(operations)
+    print(f"INFO (繁中): 輪次 {round_id} 已轉換為子集合結構 ({len(entries)} 筆事項)。")
+    return len(entries)
+
+def migrate_all_round_entries(group_id=None):
+    """轉換所有 (或指定群組的) 舊結構輪次，回傳轉換的輪次數量。"""
+    query = db.collection('prayer_rounds')
+    if group_id:
+        query = query.where('group_id', '==', group_id)
+    migrated = 0
+    for round_snapshot in query.stream():
+        if not round_uses_entry_docs(round_snapshot.to_dict()) and migrate_round_entries(round_snapshot.id) is not None:
+            migrated += 1
+    return migrated
+
+# --- 已結束輪次的快照 ---
+# 輪次結束後內容就不會再變動，因此結束時會把排序好的名單 (名字與狀態)、事項原文與統計寫成一份精簡的快照
+# prayer_round_snapshots/{輪次 ID}，並放進行程內快取 (不設 TTL)。每段事項只存一次，列表在讀取時才排版，
+# 文件大小與舊的 entries map 相當，不會因為重複存放而逼近 1 MiB 的上限。
+# 「同上週」、「上輪總結」等讀取舊輪次的功能命中快取時不需讀取 Firestore，未命中時也只需讀取這一份小文件。
+# 開始新輪次時會在輪次文件記錄 previous_round_id (取自群組文件的 last_round_id)，「同上週」據此找到上一輪的快照。
+ROUND_SNAPSHOTS_COLLECTION = 'prayer_round_snapshots'
+ROUND_SNAPSHOT_CACHE_SIZE = int(os.environ.get('ROUND_SNAPSHOT_CACHE_SIZE', '1024'))
+round_snapshot_cache = caches.LRUTTLCache(max_size=ROUND_SNAPSHOT_CACHE_SIZE)
+
+def build_round_snapshot(round_id, round_data, members_map, entries):
+    """由輪次文件與事項建立該輪的 rendering.RoundSnapshot (不寫入)。"""
+    return rendering.RoundSnapshot.build(round_id, round_data, members_map, entries, round_summary_counts(entries))
+
+def save_round_snapshot(snapshot):
+    """寫入已結束輪次的快照並放入快取 (先放快取，寫入失敗時本執行個體仍可使用)，回傳 snapshot。"""
+    round_snapshot_cache.put(snapshot.round_id, snapshot)
+    db.collection(ROUND_SNAPSHOTS_COLLECTION).document(snapshot.round_id).set({**snapshot.to_dict(), 'ended_time': firestore.SERVER_TIMESTAMP})
+    return snapshot
+
+def load_round_snapshot(round_id):
+    """
+    取得已結束輪次的快照，輪次不存在或仍在進行中時回傳 None。
+    此功能上線前結束的輪次 (或結束時快照寫入失敗的輪次) 沒有快照：第一次讀取時由輪次文件與事項建立並補寫，之後就與新輪次相同。
+    """
+    snapshot = round_snapshot_cache.get(round_id)
+    if snapshot is not None:
+        return snapshot
+    snapshot_doc = db.collection(ROUND_SNAPSHOTS_COLLECTION).document(round_id).get()
+    if snapshot_doc.exists:
+        snapshot = rendering.RoundSnapshot.from_dict(snapshot_doc.to_dict())
+        round_snapshot_cache.put(round_id, snapshot)
+        return snapshot
+    round_ref = db.collection('prayer_rounds').document(round_id)
+    round_doc = round_ref.get()
+    if not round_doc.exists or round_doc.get('is_active') is not False:
+        return None
+    round_data = round_doc.to_dict()
+    print(f"INFO (繁中): 為舊輪次 {round_id} 建立快照。")
+    snapshot = build_round_snapshot(round_id, round_data, {}, load_round_entries(round_ref, round_data))
+    try:
+        save_round_snapshot(snapshot)
+    except Exception as e:
+        # 補寫失敗不影響這次的讀取 (下一次未命中快取時會再補寫)
+        print(f"警告 (繁中): 補寫輪次 {round_id} 的快照時發生錯誤: {e}")
+    return snapshot
+
+def find_previous_prayer_text(group_id, round_data, user_id):
+    """回傳使用者在上一輪的代禱事項文字，找不到時回傳空字串。"""
+    previous_round_id = round_data.get('previous_round_id')
+    if previous_round_id:
+        snapshot = load_round_snapshot(previous_round_id)
+        return snapshot.texts.get(user_id, '') if snapshot else ''
+
+    # 舊輪次沒有 previous_round_id：查詢該群組所有輪次，按創建時間降序排列，取最近的一個過去輪次
+    current_round_created_time = round_data.get('created_time')
+    if not current_round_created_time:
+        return ''
+    rounds_query = db.collection('prayer_rounds') \
+                    .where('group_id', '==', group_id) \
+                    .where('created_time', '<', current_round_created_time) \
+                    .order_by('created_time', direction=firestore.Query.DESCENDING) \
+                    .limit(1) 
+    previous_rounds = list(rounds_query.stream())
+    if not previous_rounds:
+        return ''
+    # *** 使用 user_id 查找上週事項 ***
+    previous_entry = load_round_entry(previous_rounds[0].reference, previous_rounds[0].to_dict(), user_id)
+    return (previous_entry or {}).get('text', '')
+
+# --- 個人代禱紀錄 (per-user history index) ---
+# 結束輪次時，為每位有事項的成員寫入 prayer_history/{user_id}/items/{round_id}。
+# 查詢個人紀錄只需在自己的子集合上依 created_time (輪次開始時間) 由新到舊排序，
+# 以 start_after 游標分頁，每頁都是一次查詢，與累積了多少輪次無關 (不必掃描 prayer_rounds)。
+PRAYER_HISTORY_COLLECTION = 'prayer_history'
+PRAYER_HISTORY_PAGE_SIZE = 5
+PRAYER_HISTORY_MAX_PAGE_SIZE = 50
+
+def prayer_history_items(user_id):
+    return db.collection(PRAYER_HISTORY_COLLECTION).document(user_id).collection('items')
+
+def save_prayer_history(group_id, group_name, round_id, round_data, entries):
+    """結束輪次時呼叫：把該輪每位成員的事項寫入各自的代禱紀錄 (尚未更新的成員不寫入)。"""
+    created_time = round_data.get('created_time') or datetime.datetime.now(datetime.timezone.utc)
+    operations = []
+    for uid, entry in entries.items():
+        if entry.get('status', 'pending') == 'pending' and not entry.get('text'):
+            continue
+        operations.append(('set', prayer_history_items(uid).document(round_id), {
+            'group_id': group_id,
+            'group_name': group_name,
+            'round_id': round_id,
+            'text': entry.get('text', ''),
+            'status': entry.get('status', 'pending'),
+            'deadline_text': round_data.get('deadline_text'),
+            'created_time': created_time,
+            'ended_time': round_data.get('ended_time') or firestore.SERVER_TIMESTAMP,
+        }))
+    commit_in_batches(operations)
+
+def encode_history_cursor(created_time):
+    """將 created_time 轉為簡短的游標字串 (微秒時間戳的 36 進位)，可直接放在指令或網址中。"""
+    micros = int(created_time.timestamp() * 1_000_000)
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    text = ""
+    while micros:
+        micros, remainder = divmod(micros, 36)
+        text = digits[remainder] + text
+    return text or "0"
+
+def decode_history_cursor(cursor):
+    """encode_history_cursor 的反向，格式錯誤時拋出 ValueError。"""
+    micros = int(cursor.strip().lower(), 36)
+    return datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(microseconds=micros)
+
+def load_prayer_history(user_id, cursor=None, limit=PRAYER_HISTORY_PAGE_SIZE):
+    """
+    讀取使用者的代禱紀錄 (由新到舊)，回傳 (items, next_cursor)；沒有更早的紀錄時 next_cursor 為 None。
+    cursor 為上一頁的 next_cursor。多讀一筆來判斷是否還有下一頁。
+    """
+    query = prayer_history_items(user_id).order_by('created_time', direction=firestore.Query.DESCENDING)
+    if cursor:
+        query = query.start_after({'created_time': decode_history_cursor(cursor)})
+    items = [doc.to_dict() for doc in query.limit(limit + 1).stream()]
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_history_cursor(items[-1]['created_time'])
+
+# --- 代禱事項搜尋索引 (search.py 的 bigram 倒排索引) ---
+# prayer_search_terms/{round_id}_{bigram}: {'group_id', 'term', 'round_id', 'user_ids': [...]}
+# 每個輪次的每個索引詞一份文件，文件大小只與一輪的成員數有關，不會隨輪次累積而變大。
+# 結束輪次時以批次寫入該輪的索引詞，不需要重建。搜尋時以「群組 + 索引詞、依 round_id 由新到舊」的查詢
+# (複合索引 group_id + term + round_id) 一次讀取 SEARCH_ROUNDS_PAGE_SIZE 個輪次，與其他索引詞取交集後
+# 再以一次 get_all 讀取候選者的個人代禱紀錄確認原文，找到足夠的結果就停止，不會掃描 prayer_rounds。
+SEARCH_TERMS_COLLECTION = 'prayer_search_terms'
+SEARCH_MAX_RESULTS = 10
+SEARCH_ROUNDS_PAGE_SIZE = 50
+
+def search_term_ref(round_id, term):
+    return db.collection(SEARCH_TERMS_COLLECTION).document(f"{round_id}_{term}")
+
+def save_search_index(group_id, round_id, entries):
+    """結束輪次時呼叫：寫入該輪每個索引詞的文件 (出現此索引詞的成員)。"""
+    postings = {}
+    for uid, entry in entries.items():
+        for term in search.index_terms(entry.get('text', '')):
+            postings.setdefault(term, []).append(uid)
+    commit_in_batches([
+        ('set', search_term_ref(round_id, term), {'group_id': group_id, 'term': term, 'round_id': round_id, 'user_ids': sorted(uids)})
+        for term, uids in postings.items()
+    ])
+
+def search_term_postings(group_id, term, before=None, oldest=None, limit=None):
+    """
+    讀取群組中含有索引詞的輪次，依 round_id 由新到舊，回傳 [(round_id, [user_id, ...])]。
+    before / oldest 限定 round_id 的範圍 (before 不含、oldest 含)。
+    """
+    query = db.collection(SEARCH_TERMS_COLLECTION).where('group_id', '==', group_id).where('term', '==', term)
+    if before:
+        query = query.where('round_id', '<', before)
+    if oldest:
+        query = query.where('round_id', '>=', oldest)
+    query = query.order_by('round_id', direction=firestore.Query.DESCENDING)
+    if limit:
+        query = query.limit(limit)
+    return [(doc.get('round_id'), doc.get('user_ids')) for doc in query.stream()]
+
+def search_prayer_items(group_id, keyword, limit=SEARCH_MAX_RESULTS):
+    """
+    在群組已結束的輪次中搜尋關鍵字，回傳 (results, has_more)。
+    results 為由新到舊的 [(user_id, 個人代禱紀錄)]；關鍵字無法查詢 (少於兩個字) 時拋出 ValueError。
+    """
+    terms = search.query_terms(keyword)
+    if not terms:
+        raise ValueError(keyword)
+    # 以其中一個索引詞分頁掃描輪次，其他索引詞只查詢同一範圍的輪次
+    first_term, *other_terms = sorted(terms)
+    results = []
+    before = None
+    while True:
+        page = search_term_postings(group_id, first_term, before=before, limit=SEARCH_ROUNDS_PAGE_SIZE)
+        if not page:
+            return results, False
+        oldest = page[-1][0]
+        candidates = {(round_id, uid) for round_id, uids in page for uid in uids}
+        for term in other_terms:
+            if not candidates:
+                break
+            postings = search_term_postings(group_id, term, before=before, oldest=oldest)
+            candidates &= {(round_id, uid) for round_id, uids in postings for uid in uids}
+        # 同一群組的輪次 ID 以開始時間結尾，依 ID 由大到小即為由新到舊
+        ordered = sorted(candidates, reverse=True)
+        for start in range(0, len(ordered), limit):
+            chunk = ordered[start:start + limit]
+            refs = [prayer_history_items(uid).document(round_id) for round_id, uid in chunk]
+            items = {snapshot.reference.path: snapshot.to_dict() for snapshot in db.get_all(refs) if snapshot.exists}
+            for offset, ((round_id, uid), ref) in enumerate(zip(chunk, refs), start + 1):
+                item = items.get(ref.path)
+                if item and search.matches(item.get('text', ''), keyword):
+                    results.append((uid, item))
+                    if len(results) == limit:
+                        return results, offset < len(ordered) or len(page) == SEARCH_ROUNDS_PAGE_SIZE
+        if len(page) < SEARCH_ROUNDS_PAGE_SIZE:
+            return results, False
+        before = oldest
+
+def backfill_prayer_history(group_id=None):
+    """
+    為功能上線前已結束的輪次建立個人代禱紀錄與搜尋索引 (可重複執行，已存在的紀錄會被覆寫為相同內容)。
+    回傳處理的輪次數。
+    """
+    query = db.collection('prayer_rounds').where('is_active', '==', False)
+    if group_id:
+        query = query.where('group_id', '==', group_id)
+    group_names = {}
+    round_count = 0
+    for round_doc in query.stream():
+        round_data = round_doc.to_dict()
+        round_group_id = round_data.get('group_id')
+        if round_group_id not in group_names:
+            group_doc = db.collection('prayer_groups').document(round_group_id).get() if round_group_id else None
+            group_names[round_group_id] = (group_doc.to_dict() or {}).get('group_name') if group_doc and group_doc.exists else None
+        entries = load_round_entries(round_doc.reference, round_data)
+        save_prayer_history(round_group_id, group_names[round_group_id], round_doc.id, round_data, entries)
+        save_search_index(round_group_id, round_doc.id, entries)
+        round_count += 1
+        print(f"INFO (繁中): 已為輪次 {round_doc.id} 建立 {len(entries)} 位成員的代禱紀錄。")
+    return round_count
+
+# --- 使用者 → 群組索引 (多群組支援) ---
+# user_groups/{user_id} 記錄使用者加入的所有群組 (group_ids) 與目前選擇的群組 (active_group_id)，
+# 私訊指令只需一次點查詢就能知道要作用在哪個群組。沒有索引的使用者 (舊資料) 會使用 TARGET_GROUP_ID。
+USER_GROUPS_COLLECTION = 'user_groups'
+user_groups_cache = caches.LRUTTLCache(max_size=1024, ttl_seconds=GROUP_CACHE_TTL_SECONDS)
+NO_GROUP_MESSAGE = "抱歉，您尚未加入任何代禱群組。\n請先在您的小組群組中輸入 加入代禱。"
+
+def load_user_groups(user_id, use_cache=True):
+    """讀取使用者的群組索引，回傳 {'group_ids': [...], 'active_group_id': ...} (沒有索引時為空 dict)。"""
+    if use_cache:
+        cached = user_groups_cache.get(user_id)
+        if cached is not None:
+            return cached
+    snapshot = db.collection(USER_GROUPS_COLLECTION).document(user_id).get()
+    data = snapshot.to_dict() if snapshot.exists else {}
+    user_groups_cache.put(user_id, data)
+    return data
+
+def add_user_group(user_id, group_id, make_active=True):
+    """加入群組後呼叫：把群組加入使用者的索引 (並設為目前選擇的群組)。"""
+    update_data = {'group_ids': firestore.ArrayUnion([group_id]), 'updated_time': firestore.SERVER_TIMESTAMP}
+    if make_active:
+        update_data['active_group_id'] = group_id
+    db.collection(USER_GROUPS_COLLECTION).document(user_id).set(update_data, merge=True)
+    user_groups_cache.invalidate(user_id)
+
+def resolve_dm_group_id(user_id):
+    """
+    決定私訊指令要作用的群組，回傳 (group_id, group_ids)。
+    - 有選擇過且仍在名單中的群組 → 該群組；只加入一個群組 → 該群組
+    - 沒有任何索引 → TARGET_GROUP_ID (可能為 None)
+    - 加入多個群組但尚未選擇 → None，需要使用者以 切換群組 選擇
+    """
+    data = load_user_groups(user_id)
+    group_ids = data.get('group_ids', [])
+    active_group_id = data.get('active_group_id')
+    if active_group_id in group_ids:
+        return active_group_id, group_ids
+    if len(group_ids) == 1:
+        return group_ids[0], group_ids
+    if not group_ids:
+        return TARGET_GROUP_ID, group_ids
+    return None, group_ids
+
+def fetch_group_name(group_id):
+    """向 LINE 查詢群組名稱，失敗時回傳 None。"""
+    try:
+        return line_bot_api.get_group_summary(group_id).group_name
+    except Exception as e:
+        print(f"警告 (繁中): 無法取得群組 {group_id} 的名稱: {e}")
+        return None
+
+def group_choice_text(group_ids, active_group_id=None):
+    """列出使用者加入的群組供 切換群組 選擇。"""
+    group_docs = db.get_all([db.collection('prayer_groups').document(gid) for gid in group_ids])
+    names = {doc.id: (doc.to_dict() or {}).get('group_name') for doc in group_docs if doc.exists}
+    lines = ["您加入了多個代禱群組，請輸入 切換群組 [編號] 選擇要操作的群組："]
+    for index, gid in enumerate(group_ids, start=1):
+        marker = " (目前)" if gid == active_group_id else ""
+        lines.append(f"{index}. {names.get(gid) or gid}{marker}")
+    return "\n".join(lines)
+
+def backfill_user_group_index(group_id=None):
+    """為既有群組的成員建立 user_groups 索引 (不改變成員目前選擇的群組)，回傳寫入的筆數。"""
+    if group_id:
+        snapshots = [db.collection('prayer_groups').document(group_id).get()]
+    else:
+        snapshots = db.collection('prayer_groups').stream()
+    operations = []
+    for group_snapshot in snapshots:
+        if not group_snapshot.exists:
+            continue
+        for uid in (group_snapshot.to_dict() or {}).get('members', {}):
+            operations.append(('set_merge', db.collection(USER_GROUPS_COLLECTION).document(uid),
+                               {'group_ids': firestore.ArrayUnion([group_snapshot.id])}))
+    commit_in_batches(operations)
+    user_groups_cache.clear()
+    return len(operations)
+
+# --- LINE 使用者個人資料快取 ---
+# get_profile 是加入代禱與歡迎訊息中最慢的外部呼叫。顯示名稱很少變動，因此快取 PROFILE_CACHE_TTL_SECONDS 秒；
+# 已封鎖 Bot 或不存在的使用者 (LINE 回傳 404) 也會快取較短的時間 (PROFILE_NEGATIVE_TTL_SECONDS)，避免重複查詢。
+PROFILE_CACHE_TTL_SECONDS = float(os.environ.get('PROFILE_CACHE_TTL_SECONDS', '3600'))
+PROFILE_NEGATIVE_TTL_SECONDS = float(os.environ.get('PROFILE_NEGATIVE_TTL_SECONDS', '300'))
+profile_cache = caches.LRUTTLCache(max_size=2048, ttl_seconds=PROFILE_CACHE_TTL_SECONDS)
+_PROFILE_NOT_FOUND = object()
+
+def get_display_name(user_id, members_map=None):
+    """
+    取得使用者的 LINE 顯示名稱，找不到使用者時回傳 None。
+    依序使用：行程內快取 → members_map 中已記錄的名字 (若有提供) → LINE get_profile。
+    """
+    cached = profile_cache.get(user_id)
+    if cached is not None:
+        return None if cached is _PROFILE_NOT_FOUND else cached
+    member_name = (members_map or {}).get(user_id, {}).get('name')
+    if member_name:
+        return member_name
+    try:
+        display_name = line_bot_api.get_profile(user_id).display_name
+    except Exception as e:
+        if getattr(e, 'status_code', None) == 404:
+            print(f"INFO (繁中): 找不到使用者 {user_id} 的個人資料 (可能已封鎖 Bot)。")
+            profile_cache.put(user_id, _PROFILE_NOT_FOUND, ttl_seconds=PROFILE_NEGATIVE_TTL_SECONDS)
+            return None
+        raise
+    profile_cache.put(user_id, display_name)
+    return display_name
+
+# --- 批次名單匯入與移除 (名單設定 / 移除成員 / tools/import_roster.py) ---
+# 先以名字索引驗證整份名單並算出變動 (plan)，有任何錯誤時完全不寫入；
+# 沒有錯誤時，群組文件的所有成員變動合併成一次 update，再與每位成員的 user_groups 索引一起以 commit_in_batches 分批寫入。
+# 需要查詢 LINE 顯示名稱的新成員會同時查詢 (最多 LINE_API_POOL_SIZE 個並行，與連線池大小一致)。
+
+def fetch_display_names(user_ids):
+    """同時查詢多位使用者的 LINE 顯示名稱，回傳 {user_id: 名字} (查詢失敗或找不到時為 None)。"""
+    if not user_ids:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(LINE_API_POOL_SIZE, len(user_ids)), thread_name_prefix='prayer-bot-profile') as executor:
+        # 每個工作各自複製 contextvars，LINE API 的呼叫次數才會記在目前的指令上
+        futures = {uid: executor.submit(contextvars.copy_context().run, get_display_name, uid) for uid in user_ids}
+    names = {}
+    for uid, future in futures.items():
+        try:
+            names[uid] = future.result()
+        except Exception as e:
+            print(f"警告 (繁中): 無法取得使用者 {uid} 的 LINE 個人資料: {e}")
+            names[uid] = None
+    return names
+
+def plan_roster(ctx, rows, replace=False):
+    """
+    依匯入的名單 (roster.RosterRow 列表) 算出要新增、改名與移除的成員，回傳 (plan, errors)。
+    - 只有名字的行必須對應到名單中既有的成員 (以名字索引比對)。
+    - 只有 user_id 的新成員會查詢 LINE 顯示名稱。
+    - replace=True 時，未列出的成員會被移除 (管理員除外)。
+    """
+    members_map = ctx.members
+    index = ctx.name_index
+    errors = []
+    desired = {}  # user_id -> 匯入後的名字 (None 表示需要查詢 LINE)
+    for row in rows:
+        user_id = row.user_id or index.get(member_name_key(row.name))
+        if not user_id:
+            errors.append((row.line_no, f"名單中找不到「{row.name}」(新成員請提供 user_id)"))
+        elif user_id in desired:
+            errors.append((row.line_no, f"成員重複列出 ({row.name or user_id})"))
+        else:
+            desired[user_id] = row.name if row.user_id else members_map[user_id].get('name')
+
+    lookups = [uid for uid, name in desired.items() if not name and uid not in members_map]
+    for uid, name in fetch_display_names(lookups).items():
+        if name:
+            desired[uid] = name
+        else:
+            errors.append((None, f"找不到 LINE 使用者 {uid} (可能尚未將 Bot 加為好友)"))
+            del desired[uid]
+    for uid, name in desired.items():
+        if not name:
+            desired[uid] = members_map[uid].get('name')
+
+    admin_ids = set(ctx.group_data.get('admin_user_ids', []))
+    removed = [uid for uid in members_map if uid not in desired and uid not in admin_ids] if replace else []
+    kept_admins = [uid for uid in members_map if uid not in desired and uid in admin_ids] if replace else []
+
+    # 匯入後的名字不可與其他成員重複 (以正規化後的名字比較)
+    owners = {}
+    for uid, member_info in members_map.items():
+        if uid not in desired and uid not in removed:
+            owners.setdefault(member_name_key(member_info.get('name')), uid)
+    for uid, name in desired.items():
+        owner = owners.setdefault(member_name_key(name), uid)
+        if owner != uid:
+            errors.append((None, f"名字「{name}」與其他成員重複"))
+
+    plan = {
+        'added': {uid: name for uid, name in desired.items() if uid not in members_map},
+        'renamed': {uid: name for uid, name in desired.items() if uid in members_map and members_map[uid].get('name') != name},
+        'removed': removed,
+        'kept_admins': kept_admins,
+    }
+    plan['unchanged'] = len(desired) - len(plan['added']) - len(plan['renamed'])
+    return plan, errors
+
+def plan_member_removal(ctx, targets):
+    """移除成員：targets 為名字或 user_id，回傳 (plan, errors)。管理員不能以此方式移除。"""
+    members_map = ctx.members
+    admin_ids = set(ctx.group_data.get('admin_user_ids', []))
+    errors, removed = [], []
+    for target in targets:
+        user_id = target if target in members_map else ctx.member_by_name(target)
+        if not user_id:
+            errors.append((None, f"名單中找不到成員「{target}」"))
+        elif user_id in admin_ids:
+            errors.append((None, f"「{members_map[user_id].get('name')}」是管理員，無法移除"))
+        elif user_id not in removed:
+            removed.append(user_id)
+    return {'added': {}, 'renamed': {}, 'removed': removed, 'kept_admins': [], 'unchanged': 0}, errors
+
+def apply_roster_plan(ctx, plan, updated_by):
+    """
+    寫入 plan 的變動：群組文件 (成員、名字索引、版本) 一次 update，
+    新增/移除成員的 user_groups 索引與群組文件一起以 commit_in_batches 分批寫入。回傳寫入的文件數。
+    """
+    members_map = ctx.members
+    new_members = {uid: member_info for uid, member_info in members_map.items() if uid not in plan['removed']}
+    group_updates = {}
+    for uid, name in plan['added'].items():
+        new_members[uid] = {'name': name, 'user_id': uid}
+        group_updates[f'members.{uid}'] = new_members[uid]
+    for uid, name in plan['renamed'].items():
+        new_members[uid] = {**members_map[uid], 'name': name}
+        group_updates[f'members.{uid}.name'] = name
+    for uid in plan['removed']:
+        group_updates[f'members.{uid}'] = firestore.DELETE_FIELD
+    if not group_updates:
+        return 0
+    group_updates.update({
+        **name_index_sync_updates(ctx.group_data, new_members),
+        'last_updated_by': updated_by,
+        'last_updated_time': firestore.SERVER_TIMESTAMP,
+        **group_version_bump()
+    })
+
+    operations = [('update', ctx.group_ref, group_updates)]
+    operations += [('set_merge', db.collection(USER_GROUPS_COLLECTION).document(uid),
+                    {'group_ids': firestore.ArrayUnion([ctx.group_id]), 'updated_time': firestore.SERVER_TIMESTAMP})
+                   for uid in plan['added']]
+    operations += [('set_merge', db.collection(USER_GROUPS_COLLECTION).document(uid),
+                    {'group_ids': firestore.ArrayRemove([ctx.group_id]), 'updated_time': firestore.SERVER_TIMESTAMP})
+                   for uid in plan['removed']]
+    commit_in_batches(operations)
+    group_cache.invalidate(ctx.group_id)
+    for uid in list(plan['added']) + plan['removed']:
+        user_groups_cache.invalidate(uid)
+    return len(operations)
+
+def roster_errors_text(errors, limit=20):
+    lines = [f"▪️ 第 {line_no} 行：{message}" if line_no else f"▪️ {message}" for line_no, message in errors[:limit]]
+    if len(errors) > limit:
+        lines.append(f"...另有 {len(errors) - limit} 個錯誤")
+    return "\n".join(lines)
+
+ROSTER_SUMMARY_MAX_NAMES = 30
+
+def joined_names(names, limit=ROSTER_SUMMARY_MAX_NAMES):
+    names = list(names)
+    text = "、".join(names[:limit])
+    return text + (f" 等 {len(names)} 人" if len(names) > limit else "")
+
+def roster_plan_text(ctx, plan):
+    """名單變動的摘要 (列出新增/改名/移除的成員名字，每類最多 ROSTER_SUMMARY_MAX_NAMES 位)。"""
+    members_map = ctx.members
+    current_names = lambda user_ids: joined_names(members_map[uid].get('name', uid) for uid in user_ids)
+    lines = [f"新增 {len(plan['added'])} 人、更新名字 {len(plan['renamed'])} 人、移除 {len(plan['removed'])} 人"
+             f" (未變動 {plan['unchanged']} 人)。"]
+    if plan['added']:
+        lines.append("➕ " + joined_names(plan['added'].values()))
+    if plan['renamed']:
+        lines.append("✏️ " + joined_names(f"{members_map[uid].get('name')} → {name}" for uid, name in plan['renamed'].items()))
+    if plan['removed']:
+        lines.append(f"➖ {current_names(plan['removed'])}")
+    if plan['kept_admins']:
+        lines.append(f"(管理員 {current_names(plan['kept_admins'])} 未列出，但仍保留在名單中)")
+    return "\n".join(lines)
+
 # --- 指令處理函式 (Command Handlers) ---
 
-# --- 處理私訊中的 加入代禱 指令 ---
+# --- 處理 加入代禱 指令 ---
 # 這個函式會將使用者加入代禱名單，並在 Firestore 中建立或更新對應的群組文件。
 # 如果使用者已經在名單中，則會更新其顯示名稱
-def handle_command_join_prayer(user_id):
-    """處理私訊中的 加入代禱 指令"""
-    if not TARGET_GROUP_ID:
-        print("嚴重錯誤 (繁中): 未設定 TARGET_GROUP_ID")
-        return "抱歉，Bot 目前設定有誤，暫時無法加入。"
+def handle_command_join_prayer(user_id, group_id=None):
+    """
+    處理 加入代禱 指令。
+    - 在群組中：加入該群組的代禱名單。
+    - 在私訊中：加入使用者目前選擇的群組 (沒有時使用 TARGET_GROUP_ID)。
+    """
+    group_id = group_id or TARGET_GROUP_ID
+    if not group_id:
+        return NO_GROUP_MESSAGE
     try:
-        profile = line_bot_api.get_profile(user_id)
-        user_display_name = profile.display_name
-        group_doc_ref = db.collection('prayer_groups').document(TARGET_GROUP_ID)
+        user_display_name = get_display_name(user_id)
+        if not user_display_name:
+            return "抱歉，無法取得您的 LINE 個人資料。\n請先將 Bot 加為好友後再試一次。"
+        group_doc_ref = db.collection('prayer_groups').document(group_id)
         
         update_path = f'members.{user_id}' 
         update_data = {'name': user_display_name, 'user_id': user_id}
         
         group_doc = group_doc_ref.get()
         if not group_doc.exists:
-            update_data['is_admin'] = True
-            group_doc_ref.set({'members': {user_id: update_data}, 'admin_user_ids': [user_id]})
-            return f"✅ {user_display_name}，您已成功加入代禱名單，並成為第一位管理員！"
+            try:
+                # 使用 create 而非 set：若同時有其他人也是第一位加入者，只有一個請求能建立群組文件
+                new_group_data = {'members': {user_id: {**update_data, 'is_admin': True}}, 'admin_user_ids': [user_id], 'version': 1,
+                                  NAME_INDEX_FIELD: build_member_name_index({user_id: update_data})}
+                group_name = fetch_group_name(group_id)
+                if group_name:
+                    new_group_data['group_name'] = group_name
+                group_doc_ref.create(new_group_data)
+                group_cache.invalidate(group_id)
+                add_user_group(user_id, group_id)
+                return f"✅ {user_display_name}，您已成功加入代禱名單，並成為第一位管理員！"
+            except storage.conflict_errors():
+                print(f"INFO (繁中): 群組 {group_id} 的文件已由其他請求建立，改以一般成員身份加入。")
+                group_doc = group_doc_ref.get()
+
+        group_data = group_doc.to_dict()
+        members_map = group_data.get('members', {})
+        if user_id in members_map:
+            add_user_group(user_id, group_id)
+            if members_map[user_id].get('name') != user_display_name:
+                # 只更新自己的欄位，避免覆蓋同時加入的其他成員
+                group_doc_ref.update({f'{update_path}.name': user_display_name,
+                                      **name_index_updates(group_data, user_id, user_display_name), **group_version_bump()})
+                group_cache.invalidate(group_id)
+                return f"{user_display_name}，您已經在名單中了喔！(已為您更新顯示名稱)"
+            return f"{user_display_name}，您已經在代禱名單中了喔！"
         else:
-            members_map = group_doc.to_dict().get('members', {})
-            if user_id in members_map:
-                if members_map[user_id].get('name') != user_display_name:
-                    members_map[user_id]['name'] = user_display_name
-                    group_doc_ref.update({'members': members_map})
-                    return f"{user_display_name}，您已經在名單中了喔！(已為您更新顯示名稱)"
-                return f"{user_display_name}，您已經在代禱名單中了喔！"
-            else:
-                group_doc_ref.update({update_path: update_data})
-                return f"✅ {user_display_name}，您已成功加入代禱名單！"
+            group_doc_ref.update({update_path: update_data, **name_index_updates(group_data, user_id, user_display_name), **group_version_bump()})
+            group_cache.invalidate(group_id)
+            add_user_group(user_id, group_id)
+            return f"✅ {user_display_name}，您已成功加入代禱名單！"
     except Exception as e: 
         print(f"錯誤 (繁中): 處理 加入代禱 時發生內部錯誤: {e}")
         return "抱歉，加入代禱名單時發生了點問題，請稍後再試。"
@@ -236,45 +1416,34 @@ def handle_command_join_prayer(user_id):
 # 這個函式會根據 user_id 自動更新使用者的代禱事項。
 # 如果使用者輸入「同上週」，則會抓取上一輪的代禱事項。
 # 如果沒有正在進行的輪次，則會回覆錯誤訊息。
-def handle_command_update_prayer(user_id, text_received):
+def handle_command_update_prayer(user_id, text_received, ctx=None):
     """
     處理私訊或群組中的 代禱 指令。
     根據 user_id 自動更新使用者的代禱事項。
     """
-    if not TARGET_GROUP_ID:
-        print("嚴重錯誤 (繁中): 未設定 TARGET_GROUP_ID，無法執行 代禱。")
-        return "抱歉，Bot 目前設定有誤，暫時無法更新。"
-
-    if not db_initialized_successfully or not db:
+    if not db_ready():
         print("嚴重錯誤 (繁中): Firestore 未初始化，無法執行 代禱。")
         return "抱歉，資料庫連線暫時有問題，請稍後再試。"
 
+    ctx = ctx or PrayerContext(TARGET_GROUP_ID)
+    if not ctx.group_id:
+        return NO_GROUP_MESSAGE
+
     try:
-        group_doc_ref = db.collection('prayer_groups').document(TARGET_GROUP_ID)
-        group_data_snapshot = group_doc_ref.get()
 
-        if not group_data_snapshot.exists:
+        if not ctx.group_exists:
             return "錯誤：找不到目標群組的設定資料，請聯絡管理員。"
         
-        group_data = group_data_snapshot.to_dict()
-        members_map = group_data.get('members', {})
-        
         # 根據 user_id 檢查用戶是否在名單中
-        sender_member_data = members_map.get(user_id)
+        sender_member_data = ctx.member(user_id)
         
         if not sender_member_data:
             return "抱歉，您尚未加入代禱名單。\n請先輸入 加入代禱"
         
-        current_round_id = group_data.get('current_round_id')
-
-        if not current_round_id:
+        if not ctx.round_id or not ctx.has_active_round:
             return "錯誤：目前沒有正在進行中的代禱輪次。"
         
-        round_doc_ref = db.collection('prayer_rounds').document(current_round_id)
-        round_data_snapshot = round_doc_ref.get()
-
-        if not round_data_snapshot.exists or not round_data_snapshot.to_dict().get('is_active'):
-            return "錯誤：目前沒有正在進行中的代禱輪次。"
+        round_doc_ref = ctx.round_ref
         
         sender_name = sender_member_data.get('name', 'N/A')
         
@@ -288,57 +1457,39 @@ def handle_command_update_prayer(user_id, text_received):
         
         update_data = {}
         timestamp = firestore.SERVER_TIMESTAMP
-        # *** 使用 user_id 作為 entries 的 key ***
-        update_path_prefix = f'entries.{user_id}'
         
         if content.lower() == "同上週":
             # --- 「同上週」內容抓取邏輯 ---
             found_previous_text = False
             previous_prayer_text = ""
-            current_round_created_time = round_data_snapshot.to_dict().get('created_time')
-
-            if current_round_created_time:
-                try:
-                    # 查詢該群組所有輪次，按創建時間降序排列，取最近的一個過去輪次
-                    rounds_query = db.collection('prayer_rounds') \
-                                    .where('group_id', '==', TARGET_GROUP_ID) \
-                                    .where('created_time', '<', current_round_created_time) \
-                                    .order_by('created_time', direction=firestore.Query.DESCENDING) \
-                                    .limit(1) 
-                    
-                    previous_rounds = list(rounds_query.stream())
-                    if previous_rounds:
-                        prev_round_data = previous_rounds[0].to_dict()
-                        prev_entries = prev_round_data.get('entries', {})
-                        # *** 使用 user_id 查找上週事項 ***
-                        if user_id in prev_entries and prev_entries[user_id].get('text'):
-                            previous_prayer_text = prev_entries[user_id]['text']
-                            found_previous_text = True
-                except Exception as e_prev_text: 
-                    print(f"錯誤 (繁中): 抓取「同上週」內容的 Firestore 查詢時發生錯誤: {e_prev_text}")
+            try:
+                previous_prayer_text = find_previous_prayer_text(ctx.group_id, ctx.round_data, user_id)
+                found_previous_text = bool(previous_prayer_text)
+            except Exception as e_prev_text: 
+                print(f"錯誤 (繁中): 抓取「同上週」內容的 Firestore 查詢時發生錯誤: {e_prev_text}")
             
             if found_previous_text:
-                update_data[f'{update_path_prefix}.text'] = previous_prayer_text
-                update_data[f'{update_path_prefix}.status'] = 'updated_from_last_week' 
+                update_data['text'] = previous_prayer_text
+                update_data['status'] = 'updated_from_last_week' 
                 reply_text = f"✅ 您的代禱事項已更新為上週內容：\n「{previous_prayer_text}」"
             else:
-                update_data[f'{update_path_prefix}.text'] = "" 
-                update_data[f'{update_path_prefix}.status'] = 'same_as_last_week' 
+                update_data['text'] = "" 
+                update_data['status'] = 'same_as_last_week' 
                 reply_text = f"✅ 您的代禱事項已標記為：同上週 (未找到您在上一輪的具體代禱文字)。"
             
-            update_data[f'{update_path_prefix}.last_updated'] = timestamp
+            update_data['last_updated'] = timestamp
 
         elif content: # 新的代禱事項
-            update_data[f'{update_path_prefix}.text'] = content
-            update_data[f'{update_path_prefix}.status'] = 'updated'
-            update_data[f'{update_path_prefix}.last_updated'] = timestamp
+            update_data['text'] = content
+            update_data['status'] = 'updated'
+            update_data['last_updated'] = timestamp
             reply_text = f"✅ 您的代禱事項已更新！"
         
         else: # 如果 content 為空字串 (例如用戶只輸入 代禱)
              reply_text = "請在 代禱 後提供您的事項內容，或輸入 同上週。"
         
         if update_data:
-            round_doc_ref.update(update_data)
+            write_round_entry(round_doc_ref, ctx.round_data, user_id, update_data)
             print(f"INFO (繁中): 使用者 {user_id} ({sender_name}) 更新了事項。")
             
         return reply_text
@@ -349,65 +1500,39 @@ def handle_command_update_prayer(user_id, text_received):
 
 # --- 處理私訊中的 我的代禱 指令 ---
 # 這個函式會查詢使用者在當前活躍輪次中的代禱事項。
-def handle_command_my_prayer(user_id):
+def handle_command_my_prayer(user_id, ctx=None):
     """
     處理私訊中的 我的代禱 指令。
     查詢並回覆使用者在當前活躍輪次中的代禱事項。
     """
-    if not TARGET_GROUP_ID:
-        print("嚴重錯誤 (繁中): 未設定 TARGET_GROUP_ID，無法執行 我的代禱。")
-        return "抱歉，Bot 目前設定有誤，暫時無法查詢。 (TGID missing)" # 這種情況需要回覆
-
-    if not db_initialized_successfully or not db:
+    if not db_ready():
         print("嚴重錯誤 (繁中): Firestore 未初始化，無法執行 我的代禱。")
         return "抱歉，資料庫連線暫時有問題，請稍後再試。" # 這種情況需要回覆
 
+    ctx = ctx or PrayerContext(TARGET_GROUP_ID)
+    if not ctx.group_id:
+        return NO_GROUP_MESSAGE # 這種情況需要回覆
+
     try:
-        group_doc_ref = db.collection('prayer_groups').document(TARGET_GROUP_ID)
-        group_data_snapshot = group_doc_ref.get()
 
-        if not group_data_snapshot.exists:
+        if not ctx.group_exists:
             return "抱歉，您尚未加入任何代禱名單。\n請先在群組中由管理員發起代禱，或在私訊中輸入 加入代禱。"
         
-        group_data = group_data_snapshot.to_dict()
-        members_map = group_data.get('members', {})
-        
         # 根據 user_id 檢查用戶是否在名單中
-        sender_member_data = members_map.get(user_id)
+        sender_member_data = ctx.member(user_id)
         
         if not sender_member_data:
             return "抱歉，您尚未加入代禱名單。\n請先輸入 加入代禱"
         
         sender_name = sender_member_data.get('name', 'N/A')
-        current_round_id = group_data.get('current_round_id')
-
-        if not current_round_id:
-            return f"哈囉 {sender_name}！\n目前群組沒有正在進行中的代禱輪次喔。"
-        
-        round_doc_ref = db.collection('prayer_rounds').document(current_round_id)
-        round_data_snapshot = round_doc_ref.get()
 
-        if not round_data_snapshot.exists or not round_data_snapshot.to_dict().get('is_active'):
+        if not ctx.round_id or not ctx.has_active_round:
             return f"哈囉 {sender_name}！\n目前群組沒有正在進行中的代禱輪次喔。"
         
-        entries = round_data_snapshot.to_dict().get('entries', {})
         # 使用 user_id 作為 key 來查找代禱事項
-        my_entry = entries.get(user_id, {}) 
+        my_entry = load_round_entry(ctx.round_ref, ctx.round_data, user_id) or {}
         
-        my_text = my_entry.get('text', '')
-        my_status = my_entry.get('status', 'pending')
-        display_text = ""
-
-        if my_status == 'same_as_last_week':
-            display_text = "同上週 (但未抓取到內容)"
-        elif my_status == 'updated_from_last_week':
-            display_text = f"{my_text} (同上週內容)" if my_text else "同上週 (內容已抓取但為空)"
-        elif my_status == 'pending' and not my_text:
-            display_text = "(您尚未更新)"
-        elif not my_text:
-            display_text = "(內容為空)"
-        else:
-            display_text = my_text
+        display_text = rendering.entry_display_text(my_entry, pending_text="(您尚未更新)")
         
         reply_text = f"哈囉 {sender_name}！\n您在本輪的代禱事項為：\n\n「{display_text}」\n\n您隨時可以在這裡直接用 代禱 [新事項] 來更新喔。"
         return reply_text
@@ -416,34 +1541,66 @@ def handle_command_my_prayer(user_id):
         print(f"錯誤 (繁中): 處理 我的代禱 時發生內部錯誤: {e}")
         return "查詢您的代禱事項時發生了未預期的錯誤，請稍後再試。" # 對於未預期錯誤，也給予用戶回饋
     
+# --- 處理 我的代禱紀錄 指令 (私訊) ---
+def handle_command_prayer_history(user_id, cursor=None):
+    """
+    處理私訊中的 我的代禱紀錄 [游標] 指令。
+    由新到舊列出使用者在過去輪次 (所有群組) 的代禱事項，每次 PRAYER_HISTORY_PAGE_SIZE 筆。
+    """
+    if not db_ready():
+        print("嚴重錯誤 (繁中): Firestore 未初始化，無法執行 我的代禱紀錄。")
+        return "抱歉，資料庫連線暫時有問題，請稍後再試。"
+    try:
+        try:
+            items, next_cursor = load_prayer_history(user_id, cursor or None)
+        except ValueError:
+            return "指令格式錯誤。\n用法：我的代禱紀錄\n或：我的代禱紀錄 [上一頁最後顯示的代碼]"
+        if not items:
+            if cursor:
+                return "沒有更早的代禱紀錄了。"
+            return "目前還沒有您的代禱紀錄喔。\n每一輪代禱結束後，您的代禱事項會自動保存在這裡。"
+
+        tz = deadlines.get_timezone(DEADLINE_TIMEZONE)
+        show_group = len({item.get('group_id') for item in items}) > 1
+        lines = ["📜 您的代禱紀錄 (由新到舊) 📜"]
+        for item in items:
+            header = f"{item['created_time'].astimezone(tz):%Y/%m/%d}"
+            if item.get('deadline_text') and item['deadline_text'] != "無特別截止時間":
+                header += f" (截止：{item['deadline_text']})"
+            if show_group and item.get('group_name'):
+                header += f" 【{item['group_name']}】"
+            lines.append(f"\n▪️ {header}\n{rendering.entry_display_text(item)}")
+        if next_cursor:
+            lines.append(f"\n查看更早的紀錄請輸入：\n我的代禱紀錄 {next_cursor}")
+        return "\n".join(lines)
+    except Exception as e:
+        print(f"錯誤 (繁中): 處理 我的代禱紀錄 時發生內部錯誤: {e}")
+        return "查詢您的代禱紀錄時發生了未預期的錯誤，請稍後再試。"
+
 # --- 處理 開始代禱 指令 ---
 # 這個函式會在群組中由管理員發起新的代禱輪次。
-def handle_command_start_prayer(group_id, user_id, text_received):
+def handle_command_start_prayer(group_id, user_id, text_received, ctx=None):
     """
     處理群組中的 開始代禱 指令。
     """
-    if not is_group_admin(group_id, user_id):
+    ctx = (ctx or PrayerContext(group_id)).fresh()
+    if not ctx.is_admin(user_id):
         return "抱歉，只有本群組代禱事項的管理員才能開始新的代禱輪次。😅"
 
     try:
-        group_doc_ref = db.collection('prayer_groups').document(group_id)
-        group_data_snapshot = group_doc_ref.get()
+        group_doc_ref = ctx.group_ref
         
-        if not group_data_snapshot.exists:
+        if not ctx.group_exists:
             return "錯誤：找不到群組設定資料。請先透過 加入代禱 建立名單。"
         
-        group_data = group_data_snapshot.to_dict()
-        members_map = group_data.get('members', {})
+        members_map = ctx.members
 
         if not isinstance(members_map, dict) or not members_map:
             return "錯誤：此群組尚未有任何成員加入代禱名單。請成員先私訊 Bot 加入代禱。"
 
         # 檢查是否有正在進行中的輪次
-        current_round_id_from_db = group_data.get('current_round_id')
-        if current_round_id_from_db:
-            round_check_doc = db.collection('prayer_rounds').document(current_round_id_from_db).get()
-            if round_check_doc.exists and round_check_doc.to_dict().get('is_active') is True:
-                return "資訊：目前已有一個正在進行中的代禱輪次。如要開始新的輪次，請先使用 結束代禱。"
+        if ctx.round_id and ctx.round_exists and ctx.round_data.get('is_active') is True:
+            return "資訊：目前已有一個正在進行中的代禱輪次。如要開始新的輪次，請先使用 結束代禱。"
         
         # 從 members map 的 value 中獲取名字列表
         member_names_list = [member_info.get('name') for member_info in members_map.values() if member_info.get('name')]
@@ -456,36 +1613,35 @@ def handle_command_start_prayer(group_id, user_id, text_received):
         deadline_text = "無特別截止時間"
         if len(parts) > 1 and parts[1].strip():
             deadline_text = parts[1].strip()
+        deadline_at, deadline_error = parse_round_deadline(deadline_text)
+        if deadline_error:
+            return deadline_error
 
         # 建立新的代禱輪次 ID (使用更唯一的 ID)
         round_timestamp_str = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d-%H%M%S")
         new_round_id = f"{group_id}_{round_timestamp_str}"
         round_doc_ref = db.collection('prayer_rounds').document(new_round_id)
 
-        # 初始化輪次資料 (entries 的 key 現在是 user_id)
-        initial_entries = {}
-        for uid, member_info in members_map.items():
-            initial_entries[uid] = {
-                'name': member_info.get('name', '未知名字'), # 將名字也存一份在 entry 中，方便列表顯示
-                'text': '', 
-                'status': 'pending', 
-                'last_updated': firestore.SERVER_TIMESTAMP
-            }
-        
+        # 初始化輪次資料 (每位成員的事項存在 entries 子集合，文件 ID 為 user_id)
         round_data = {
             'group_id': group_id, 
             'round_date': datetime.date.today().strftime("%Y-%m-%d"),
             'deadline_text': deadline_text, 
             'is_active': True,
-            'entries': initial_entries, 
             'created_by': user_id,
-            'created_time': firestore.SERVER_TIMESTAMP
+            'created_time': firestore.SERVER_TIMESTAMP,
+            'previous_round_id': ctx.group_data.get('last_round_id')
         }
-        round_doc_ref.set(round_data) 
-        group_doc_ref.update({'current_round_id': new_round_id, 'last_round_started_by': user_id})
+        if deadline_at:
+            round_data['deadline_at'] = deadline_at
+            round_data['reminders_sent'] = passed_reminder_marks(deadline_at)
+        create_round(round_doc_ref, round_data, members_map)
+        group_doc_ref.update({'current_round_id': new_round_id, 'last_round_started_by': user_id, **group_version_bump()})
+        group_cache.invalidate(group_id)
+        _round_id_hints[group_id] = new_round_id
         
         # 準備回覆訊息
-        reply_text = f"🔔 新一輪代禱已開始！🔔\n截止時間：{deadline_text}\n\n請各位使用以下格式更新您的代禱事項 (可私訊 Bot)：\n代禱 您的事項內容\n或\n代禱 同上週\n\n目前名單與狀態：\n"
+        reply_text = f"🔔 新一輪代禱已開始！🔔\n截止時間：{deadline_text}{deadline_auto_close_text(deadline_at)}\n\n請各位使用以下格式更新您的代禱事項 (可私訊 Bot)：\n代禱 您的事項內容\n或\n代禱 同上週\n\n目前名單與狀態：\n"
         for name in sorted(member_names_list): # 讓名單按字母/筆劃排序
             reply_text += f"▪️ {name}: (待更新)\n"
         reply_text = reply_text.strip()
@@ -499,86 +1655,40 @@ def handle_command_start_prayer(group_id, user_id, text_received):
     
 # --- 處理群組中的 結束代禱 指令 ---
 # 這個函式會結束當前活躍的代禱輪次。
-def handle_command_end_prayer(group_id, user_id):
+def handle_command_end_prayer(group_id, user_id, ctx=None):
     """
     處理群組中的 結束代禱 指令，並在結束時發布最終代禱事項列表。
     """
-    if not is_group_admin(group_id, user_id):
+    ctx = (ctx or PrayerContext(group_id)).fresh()
+    if not ctx.is_admin(user_id):
         return "抱歉，只有本群組代禱事項的管理員才能結束代禱輪次。😅"
 
     try:
-        group_doc_ref = db.collection('prayer_groups').document(group_id)
-        group_data_snapshot = group_doc_ref.get()
+        group_doc_ref = ctx.group_ref
 
-        if not group_data_snapshot.exists:
+        if not ctx.group_exists:
             return "錯誤：找不到此群組的設定資料。"
         
-        group_data = group_data_snapshot.to_dict()
-        current_round_id = group_data.get('current_round_id')
+        current_round_id = ctx.round_id
 
         if not current_round_id:
             return "資訊：目前沒有正在進行中的代禱輪次可以結束。"
         
-        round_doc_ref = db.collection('prayer_rounds').document(current_round_id)
-        round_data_snapshot = round_doc_ref.get()
-
-        if not round_data_snapshot.exists:
+        if not ctx.round_exists:
             # 資料不一致的情況：group 指向一個不存在的 round
             print(f"警告 (繁中): 群組 {group_id} 指向一個不存在的輪次 ID: {current_round_id}。將清除該 ID。")
-            group_doc_ref.update({'current_round_id': firestore.DELETE_FIELD})
+            group_doc_ref.update({'current_round_id': firestore.DELETE_FIELD, **group_version_bump()})
+            group_cache.invalidate(group_id)
             return "資訊：目前沒有進行中的代禱輪次可以結束 (已清理無效的輪次記錄)。"
         
-        round_data = round_data_snapshot.to_dict()
-        if round_data.get('is_active') is False:
+        if ctx.round_data.get('is_active') is False:
             return f"資訊：此代禱輪次已經是結束狀態。"
         
-        # --- 新增：獲取並格式化最終的代禱事項列表 ---
-        final_list_text = "\n\n📖 本輪最終代禱事項 📖"
-        entries = round_data.get('entries', {})
-        members_map = group_data.get('members', {})
-        
-        # 按照成員名字排序
-        sorted_members = sorted(members_map.values(), key=lambda x: x.get('name', ''))
-        
-        if not sorted_members:
-            final_list_text += "\n本輪沒有成員或代禱事項。"
-        else:
-            for member_info in sorted_members:
-                uid = member_info.get('user_id')
-                name = member_info.get('name')
-                
-                # 只顯示在 entries 中有記錄的成員
-                if uid in entries:
-                    entry_data = entries.get(uid, {})
-                    item_text = entry_data.get('text', '')
-                    status = entry_data.get('status', 'pending')
-
-                    display_text = ""
-                    if status == 'same_as_last_week':
-                        display_text = "同上週 (但未抓取到內容)" 
-                    elif status == 'updated_from_last_week':
-                        display_text = f"{item_text} (同上週內容)" if item_text else "同上週 (內容已抓取但為空)"
-                    elif status == 'pending' and not item_text:
-                        display_text = "(待更新)"
-                    elif not item_text:
-                        display_text = "(內容為空)"
-                    else:
-                        display_text = item_text
-                    
-                    final_list_text += f"\n▪️ {name}：{display_text}"
-
-        final_list_text = final_list_text.strip()
-        # --- 格式化列表結束 ---
-
-        # 更新輪次文件，將其標記為不活躍
-        round_doc_ref.update({
-            'is_active': False,
-            'ended_by': user_id,
-            'ended_time': firestore.SERVER_TIMESTAMP
-        })
-        
-        # 更新群組文件，移除 current_round_id，表示當前沒有活躍輪次
-        group_doc_ref.update({'current_round_id': firestore.DELETE_FIELD})
+        # 結束輪次並獲取最終的代禱事項列表
+        snapshot = close_active_round(ctx, user_id)
+        if snapshot is None:
+            return "資訊：此代禱輪次已經是結束狀態。"
+        final_list_text = final_summary_text(snapshot)
         
         # 組合最終的回覆訊息
         reply_text = f"{final_list_text}\n\n感謝大家的參與！"
@@ -591,7 +1701,7 @@ def handle_command_end_prayer(group_id, user_id):
     
 
     
-def handle_command_prayer_list(group_id, user_id):
+def handle_command_prayer_list(group_id, user_id, ctx=None):
     """
     處理 代禱列表 指令。
     - 在群組中：任何人都可以使用。
@@ -599,46 +1709,28 @@ def handle_command_prayer_list(group_id, user_id):
     """
     target_group_id_to_query = group_id
 
-    # 判斷是否為私訊情境
+    # 判斷是否為私訊情境 (私訊時查詢使用者目前選擇的群組)
     if not group_id:
-        if not TARGET_GROUP_ID:
-            return "抱歉，Bot 目前設定有誤 (TGID missing)。"
-        
-        # # 在私訊中，必須是管理員才能查詢
-        # if not is_group_admin(TARGET_GROUP_ID, user_id):
-        #     return "抱歉，您不是管理員，無法在私訊中使用此指令。😅"
+        target_group_id_to_query = ctx.group_id if ctx else TARGET_GROUP_ID
+        if not target_group_id_to_query:
+            return NO_GROUP_MESSAGE
         
-        target_group_id_to_query = TARGET_GROUP_ID
         print(f"INFO (繁中): 管理員 {user_id} 正在透過私訊查詢群組 {target_group_id_to_query} 的代禱列表。")
 
     try:
-        group_doc_ref = db.collection('prayer_groups').document(target_group_id_to_query)
-        group_data_snapshot = group_doc_ref.get()
+        ctx = ctx or PrayerContext(target_group_id_to_query)
 
-        if not group_data_snapshot.exists:
+        if not ctx.group_exists:
             return "錯誤：找不到此群組的設定資料。請先透過 加入代禱 建立名單。"
         
-        group_data = group_data_snapshot.to_dict()
-        current_round_id = group_data.get('current_round_id')
-
-        if not current_round_id:
-            return "資訊：目前沒有正在進行中的代禱輪次。"
-        
-        round_doc_ref = db.collection('prayer_rounds').document(current_round_id)
-        round_data_snapshot = round_doc_ref.get()
-
-        if not round_data_snapshot.exists or not round_data_snapshot.to_dict().get('is_active'):
+        if not ctx.round_id or not ctx.has_active_round:
             return "資訊：目前沒有正在進行中的代禱輪次。"
         
-        round_data = round_data_snapshot.to_dict()
+        round_data = ctx.round_data
         deadline_text = round_data.get('deadline_text', "未設定")
-        entries = round_data.get('entries', {})
-        members_map = group_data.get('members', {})
-        
-        # 按照成員名字排序
-        sorted_members = sorted(members_map.values(), key=lambda x: x.get('name', ''))
+        listing = get_round_listing(ctx)
 
-        if not sorted_members:
+        if not listing.roster:
             return f"📖 本輪代禱事項 (截止：{deadline_text}) 📖\n\n名單為空或尚無代禱內容。"
         
         # 根據情境加上不同的標題
@@ -646,31 +1738,8 @@ def handle_command_prayer_list(group_id, user_id):
         if not group_id: # 如果是私訊
             title = f"📖 管理員私訊 - 本輪代禱事項 (截止：{deadline_text}) 📖"
             
-        reply_text = title
-        
-        for member_info in sorted_members:
-            uid = member_info.get('user_id')
-            name = member_info.get('name')
-            
-            # 只顯示在 entries 中有記錄的成員
-            if uid in entries:
-                entry_data = entries.get(uid, {})
-                item_text = entry_data.get('text', '')
-                status = entry_data.get('status', 'pending')
-
-                display_text = ""
-                if status == 'same_as_last_week':
-                    display_text = "同上週 (但未抓取到內容)" 
-                elif status == 'updated_from_last_week':
-                    display_text = f"{item_text} (同上週內容)" if item_text else "同上週 (內容已抓取但為空)"
-                elif status == 'pending' and not item_text:
-                    display_text = "(待更新)"
-                elif not item_text:
-                    display_text = "(內容為空)"
-                else:
-                    display_text = item_text
-                
-                reply_text += f"\n▪️ {name}：{display_text}"
+        # 只顯示在 entries 中有記錄的成員
+        reply_text = title + listing.body()
 
         return reply_text.strip()
 
@@ -679,6 +1748,27 @@ def handle_command_prayer_list(group_id, user_id):
         return None # 內部錯誤不回覆
 
 
+# --- 處理 上輪總結 指令 ---
+def handle_command_last_summary(ctx):
+    """重新發布上一輪 (最近結束的輪次) 的總結；內容取自輪次快照，通常不需讀取 Firestore。"""
+    if not ctx.group_id:
+        return NO_GROUP_MESSAGE
+    try:
+        if not ctx.group_exists:
+            return "錯誤：找不到此群組的設定資料。請先透過 加入代禱 建立名單。"
+        last_round_id = ctx.group_data.get('last_round_id')
+        snapshot = load_round_snapshot(last_round_id) if last_round_id else None
+        if snapshot is None:
+            return "資訊：目前還沒有已結束的代禱輪次。"
+        counts = snapshot.counts
+        title = f"📖 上一輪代禱事項 (截止：{snapshot.deadline_text or '未設定'}) 📖"
+        return (f"{final_summary_text(snapshot, title)}\n\n"
+                f"共 {counts.get('member_count', 0)} 人，已更新 {counts.get('submitted_count', 0)} 人。")
+    except Exception as e:
+        print(f"錯誤 (繁中): 處理 上輪總結 時發生內部錯誤: {e}")
+        return None # 內部錯誤不回覆
+
+
 # --- 處理私訊中的 開始代禱 指令 ---
 # 這個函式會在私訊中由管理員發起新的代禱輪次。
 # 主要邏輯與群組版類似，但會在私訊中回覆。
@@ -686,36 +1776,33 @@ def handle_command_prayer_list(group_id, user_id):
 # 如果沒有正在進行的輪次，則會建立新的輪次並推播通知到目標群組。
 # 如果已經有活躍輪次，則會回覆錯誤訊息。
 # 注意：這個函式只在私訊中使用，與群組版的 handle_command_start_prayer 不同。
-def handle_command_start_prayer_dm(user_id, text_received):
+def handle_command_start_prayer_dm(user_id, text_received, ctx=None):
     """
     處理管理員在私訊中使用的 開始代禱 指令。
     """
-    if not TARGET_GROUP_ID:
-        return "抱歉，Bot 目前設定有誤 (TGID missing)。"
+    ctx = ctx or PrayerContext(TARGET_GROUP_ID)
+    if not ctx.group_id:
+        return NO_GROUP_MESSAGE
 
     # 步驟 1：權限檢查
-    if not is_group_admin(TARGET_GROUP_ID, user_id):
+    ctx = ctx.fresh()
+    if not ctx.is_admin(user_id):
         return "抱歉，您不是此代禱群組的管理員，無法使用此指令。😅"
 
     try:
-        group_doc_ref = db.collection('prayer_groups').document(TARGET_GROUP_ID)
-        group_data_snapshot = group_doc_ref.get()
+        group_doc_ref = ctx.group_ref
 
-        if not group_data_snapshot.exists:
+        if not ctx.group_exists:
             return "錯誤：找不到目標群組的設定資料。"
         
-        group_data = group_data_snapshot.to_dict()
-        members_map = group_data.get('members', {})
+        members_map = ctx.members
 
         if not members_map:
             return "錯誤：此群組尚未有任何成員加入代禱名單。"
 
         # 步驟 2：檢查是否已有活躍輪次
-        current_round_id_from_db = group_data.get('current_round_id')
-        if current_round_id_from_db:
-            round_check_doc = db.collection('prayer_rounds').document(current_round_id_from_db).get()
-            if round_check_doc.exists and round_check_doc.to_dict().get('is_active'):
-                return "資訊：目前已有一個正在進行中的代禱輪次。如要開始新的輪次，請先使用 結束代禱。"
+        if ctx.round_id and ctx.has_active_round:
+            return "資訊：目前已有一個正在進行中的代禱輪次。如要開始新的輪次，請先使用 結束代禱。"
 
         # 步驟 3：建立新輪次 (與群組版邏輯相同)
         member_names_list = [member_info.get('name') for member_info in members_map.values() if member_info.get('name')]
@@ -724,34 +1811,35 @@ def handle_command_start_prayer_dm(user_id, text_received):
         deadline_text = "無特別截止時間"
         if len(parts) > 1 and parts[1].strip():
             deadline_text = parts[1].strip()
+        deadline_at, deadline_error = parse_round_deadline(deadline_text)
+        if deadline_error:
+            return deadline_error
 
         round_timestamp_str = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d-%H%M%S")
-        new_round_id = f"{TARGET_GROUP_ID}_{round_timestamp_str}"
+        new_round_id = f"{ctx.group_id}_{round_timestamp_str}"
         round_doc_ref = db.collection('prayer_rounds').document(new_round_id)
 
-        initial_entries = {}
-        for uid, member_info in members_map.items():
-            initial_entries[uid] = {
-                'name': member_info.get('name', '未知名字'),
-                'text': '', 'status': 'pending', 
-                'last_updated': firestore.SERVER_TIMESTAMP
-            }
-        
         round_data = {
-            'group_id': TARGET_GROUP_ID, 
+            'group_id': ctx.group_id, 
             'round_date': datetime.date.today().strftime("%Y-%m-%d"),
             'deadline_text': deadline_text, 'is_active': True,
-            'entries': initial_entries, 'created_by': user_id,
-            'created_time': firestore.SERVER_TIMESTAMP
+            'created_by': user_id,
+            'created_time': firestore.SERVER_TIMESTAMP,
+            'previous_round_id': ctx.group_data.get('last_round_id')
         }
-        round_doc_ref.set(round_data) 
-        group_doc_ref.update({'current_round_id': new_round_id, 'last_round_started_by': user_id})
+        if deadline_at:
+            round_data['deadline_at'] = deadline_at
+            round_data['reminders_sent'] = passed_reminder_marks(deadline_at)
+        create_round(round_doc_ref, round_data, members_map)
+        group_doc_ref.update({'current_round_id': new_round_id, 'last_round_started_by': user_id, **group_version_bump()})
+        group_cache.invalidate(ctx.group_id)
+        _round_id_hints[ctx.group_id] = new_round_id
 
         # 步驟 4：準備群組通知訊息並主動推播 (Push Message)
-        group_notification_text = f"🔔 新一輪代禱已開始！🔔\n截止時間：{deadline_text}\n\n請各位私訊我來更新您的代禱事項喔！"
+        group_notification_text = f"🔔 新一輪代禱已開始！🔔\n截止時間：{deadline_text}{deadline_auto_close_text(deadline_at)}\n\n請各位私訊我來更新您的代禱事項喔！"
         try:
-            line_bot_api.push_message(TARGET_GROUP_ID, TextSendMessage(text=group_notification_text))
-            print(f"INFO (繁中): 已成功推播「開始代禱」通知到群組 {TARGET_GROUP_ID}。")
+            push_text(ctx.group_id, group_notification_text)
+            print(f"INFO (繁中): 已成功推播「開始代禱」通知到群組 {ctx.group_id}。")
         except Exception as e_push:
             print(f"錯誤 (繁中): 推播「開始代禱」通知到群組時發生錯誤: {e_push}")
             return f"輪次已在後台建立，但推播通知到群組時失敗，請檢查日誌。\n錯誤: {e_push}"
@@ -765,78 +1853,341 @@ def handle_command_start_prayer_dm(user_id, text_received):
     
 # --- 處理私訊中的 結束代禱 指令 ---
 # 這個函式會結束當前活躍的代禱輪次，並發布最終代禱事項列表。
-def handle_command_end_prayer_dm(user_id):
+def handle_command_end_prayer_dm(user_id, ctx=None):
     """
     處理管理員在私訊中使用的 結束代禱 指令。
     """
-    if not TARGET_GROUP_ID:
-        return "抱歉，Bot 目前設定有誤 (TGID missing)。"
+    ctx = ctx or PrayerContext(TARGET_GROUP_ID)
+    if not ctx.group_id:
+        return NO_GROUP_MESSAGE
 
     # 步驟 1：權限檢查
-    if not is_group_admin(TARGET_GROUP_ID, user_id):
+    ctx = ctx.fresh()
+    if not ctx.is_admin(user_id):
         return "抱歉，您不是此代禱群組的管理員，無法使用此指令。😅"
 
     try:
-        group_doc_ref = db.collection('prayer_groups').document(TARGET_GROUP_ID)
-        group_data_snapshot = group_doc_ref.get()
-
-        if not group_data_snapshot.exists:
+        if not ctx.group_exists:
             return "錯誤：找不到目標群組的設定資料。"
         
-        group_data = group_data_snapshot.to_dict()
-        current_round_id = group_data.get('current_round_id')
-
-        if not current_round_id:
+        if not ctx.round_id:
             return "資訊：目前沒有正在進行中的代禱輪次可以結束。"
         
-        round_doc_ref = db.collection('prayer_rounds').document(current_round_id)
-        round_data_snapshot = round_doc_ref.get()
-
-        if not round_data_snapshot.exists or not round_data_snapshot.to_dict().get('is_active'):
+        if not ctx.has_active_round:
             return "資訊：此代禱輪次已經是結束狀態。"
         
-        # 步驟 2：獲取最終代禱列表 (與群組版邏輯相同)
-        round_data = round_data_snapshot.to_dict()
-        final_list_text = "\n\n📖 本輪最終代禱事項 📖"
-        entries = round_data.get('entries', {})
-        members_map = group_data.get('members', {})
-        sorted_members = sorted(members_map.values(), key=lambda x: x.get('name', ''))
-        
-        if not sorted_members:
-            final_list_text += "\n本輪沒有成員或代禱事項。"
-        else:
-            for member_info in sorted_members:
-                uid = member_info.get('user_id')
-                name = member_info.get('name')
-                if uid in entries:
-                    entry_data = entries.get(uid, {})
-                    item_text = entry_data.get('text', '(待更新)')
-                    final_list_text += f"\n▪️ {name}：{item_text}"
-        
-        # 步驟 3：更新 Firestore
-        round_doc_ref.update({'is_active': False, 'ended_by': user_id, 'ended_time': firestore.SERVER_TIMESTAMP})
-        group_doc_ref.update({'current_round_id': firestore.DELETE_FIELD})
+        # 步驟 2：結束輪次 (與群組版邏輯相同) 並獲取最終代禱列表
+        snapshot = close_active_round(ctx, user_id)
+        if snapshot is None:
+            return "資訊：此代禱輪次已經是結束狀態。"
+        final_list_text = final_summary_text(snapshot)
         
-        # 步驟 4：準備群組通知訊息並主動推播
-        group_notification_text = f"✅ 代禱輪次已結束！\n{final_list_text.strip()}\n\n感謝大家的參與！"
+        # 步驟 3：準備群組通知訊息並主動推播
+        group_notification_text = f"✅ 代禱輪次已結束！\n{final_list_text}\n\n感謝大家的參與！"
         try:
-            line_bot_api.push_message(TARGET_GROUP_ID, TextSendMessage(text=group_notification_text))
-            print(f"INFO (繁中): 已成功推播「結束代禱」通知到群組 {TARGET_GROUP_ID}。")
+            push_text(ctx.group_id, group_notification_text)
+            print(f"INFO (繁中): 已成功推播「結束代禱」通知到群組 {ctx.group_id}。")
         except Exception as e_push:
             print(f"錯誤 (繁中): 推播「結束代禱」通知到群組時發生錯誤: {e_push}")
             return f"輪次已在後台結束，但推播通知到群組時失敗，請檢查日誌。\n錯誤: {e_push}"
 
-        # 步驟 5：回覆私訊給管理員
+        # 步驟 4：回覆私訊給管理員
         return f"✅ 已成功在目標群組結束代禱輪次，並已發送最終總結！"
 
     except Exception as e:
         print(f"錯誤 (繁中): 處理私訊 結束代禱 時發生內部錯誤: {e}")
         return "處理指令時發生未預期的錯誤，請稍後再試。"
 
+# --- 結束輪次與截止時間處理 ---
+# 結束代禱 (群組/私訊) 與截止時間自動結束共用 close_round，確保摘要、索引與快取的處理一致。
+def commit_round_close(round_ref, group_ref, ended_by, summary=None):
+    """
+    以交易結束輪次：輪次仍在進行中時才寫入 is_active=False (與統計摘要)，群組仍指向此輪次時同時清除 current_round_id 並記住 last_round_id。
+    回傳這次呼叫是否結束了輪次；輪次已被其他請求 (重疊的排程、同時的 結束代禱) 結束或不存在時回傳 False，不做任何寫入。
+    """
+    @firestore.transactional
+    def close_in_transaction(transaction):
+        # 交易中所有讀取都必須在寫入之前
+        round_doc = round_ref.get(transaction=transaction)
+        group_doc = group_ref.get(transaction=transaction) if group_ref else None
+        if not round_doc.exists or round_doc.to_dict().get('is_active') is False:
+            return False
+        round_updates = {'is_active': False, 'ended_by': ended_by, 'ended_time': firestore.SERVER_TIMESTAMP}
+        if summary is not None:
+            round_updates['summary'] = summary
+        transaction.update(round_ref, round_updates)
+        if group_doc and group_doc.exists and group_doc.to_dict().get('current_round_id') == round_ref.id:
+            transaction.update(group_ref, {'current_round_id': firestore.DELETE_FIELD, 'last_round_id': round_ref.id, **group_version_bump()})
+        return True
+
+    return close_in_transaction(db.transaction())
+
+def close_active_round(ctx, ended_by):
+    """結束 ctx 的當前輪次，回傳該輪的 rendering.RoundSnapshot (供組合最終列表)；輪次已經被結束時回傳 None。"""
+    return close_round(ctx, ctx.round_ref, ctx.round_data, ended_by)
+
+def close_round(ctx, round_ref, round_data, ended_by):
+    """
+    結束 ctx 群組中的輪次 round_ref (當前輪次，或截止時間已到但群組已指向其他輪次的孤立輪次)，
+    回傳該輪的 rendering.RoundSnapshot；輪次已經被結束時回傳 None。
+    1. 以交易一次寫入輪次的結束狀態與群組的 current_round_id / last_round_id (commit_round_close)。
+    2. 之後才寫入由輪次衍生的資料 (快照、個人代禱紀錄、搜尋索引)。這些寫入失敗只記錄錯誤，不影響已結束的輪次：
+       快照會在第一次讀取時補建，紀錄與索引可用 tools/backfill_prayer_history.py 補寫。
+    """
+    round_id = round_ref.id
+    group_id = round_data.get('group_id') or ctx.group_id
+    entries = load_round_entries(round_ref, round_data)
+    snapshot = build_round_snapshot(round_id, round_data, ctx.members, entries)
+    closed = commit_round_close(round_ref, ctx.group_ref, ended_by, dict(snapshot.counts))
+    round_list_cache.invalidate(round_id)
+    group_cache.invalidate(ctx.group_id)
+    if not closed:
+        print(f"INFO (繁中): 群組 {group_id} 的代禱輪次 {round_id} 已經被結束，略過。")
+        return None
+
+    derived_writes = (
+        ("輪次快照", lambda: save_round_snapshot(snapshot)),
+        ("個人代禱紀錄", lambda: save_prayer_history(group_id, ctx.group_data.get('group_name'), round_id, round_data, entries)),
+        ("搜尋索引", lambda: save_search_index(group_id, round_id, entries)),
+    )
+    for description, write in derived_writes:
+        try:
+            write()
+        except Exception as e:
+            print(f"警告 (繁中): 輪次 {round_id} 已結束，但寫入{description}時發生錯誤: {e}")
+    return snapshot
+
+def final_summary_text(snapshot, title="📖 本輪最終代禱事項 📖"):
+    """結束代禱時發布的最終代禱事項列表 (以結束時的輪次快照排版，不使用代禱列表快取)。"""
+    if not snapshot.lines:
+        return f"{title}\n本輪沒有成員或代禱事項。"
+    return title + snapshot.body()
+
+def parse_round_deadline(deadline_text, now=None):
+    """
+    開始代禱時解析截止時間，回傳 (deadline_at, 錯誤訊息)。無法解析時 deadline_at 為 None (只保留文字)；
+    已經過去的時間 (例如 2024/1/1) 不會被儲存，否則排程會在下一次執行時立刻結束新的輪次。
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    deadline_at = deadlines.parse_deadline(deadline_text, now=now, tz_name=DEADLINE_TIMEZONE)
+    if deadline_at and deadline_at <= now:
+        return None, (f"錯誤：截止時間「{deadline_text}」({deadlines.format_deadline(deadline_at, DEADLINE_TIMEZONE)}) 已經過了，"
+                      f"請輸入未來的時間，例如：開始代禱 週五 21:00")
+    return deadline_at, None
+
+def deadline_auto_close_text(deadline_at):
+    """開始代禱通知中說明何時會自動結束 (截止時間無法解析時為空字串)。"""
+    if not deadline_at:
+        return ""
+    return f"\n(將於 {deadlines.format_deadline(deadline_at, DEADLINE_TIMEZONE)} 自動結束並發布總結)"
+
+def passed_reminder_marks(deadline_at, now=None):
+    """
+    開始代禱時呼叫：回傳建立輪次時就已經到達的提醒時間點 (存入 reminders_sent)。
+    例如截止前 10 小時才開始的輪次，24 小時的提醒視為已發送，排程不會在輪次一開始就提醒所有成員。
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    hours_left = (deadline_at - now).total_seconds() / 3600
+    return [hours for hours in DEADLINE_REMINDER_HOURS if hours_left <= hours]
+
+def claim_reminder_marks(round_ref, due_marks):
+    """
+    以交易認領提醒時間點：重新讀取輪次，仍在進行中且 due_marks 中最小的時間點尚未記錄時寫入 reminders_sent 並回傳 True；
+    已被其他排程認領 (或輪次已結束) 時回傳 False，不做任何寫入。
+    """
+    @firestore.transactional
+    def claim_in_transaction(transaction):
+        round_doc = round_ref.get(transaction=transaction)
+        round_data = round_doc.to_dict() if round_doc.exists else {}
+        if round_data.get('is_active') is not True or due_marks[-1] in round_data.get('reminders_sent', []):
+            return False
+        transaction.update(round_ref, {'reminders_sent': firestore.ArrayUnion(due_marks)})
+        return True
+
+    return claim_in_transaction(db.transaction())
+
+def process_deadlines(now=None):
+    """
+    由排程呼叫：
+    1. 自動結束 deadline_at 已到的進行中輪次，並在群組發布與 結束代禱 相同的總結。
+    2. 對距離截止不到 DEADLINE_REMINDER_HOURS 小時的輪次，提醒尚未更新的成員 (每個時間點以 claim_reminder_marks 認領，只提醒一次)。
+    兩個查詢都只掃描 is_active == True 且 deadline_at 在範圍內的輪次 (複合索引 is_active + deadline_at)，
+    成本與歷史輪次的數量無關。結束輪次以交易確認輪次仍在進行中 (commit_round_close)，
+    重疊的排程或同時的 結束代禱 不會讓同一輪被結束兩次或發布兩次總結。
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    rounds = db.collection('prayer_rounds')
+    result = {'closed': 0, 'reminded_rounds': 0, 'reminders_sent': 0}
+
+    due_query = rounds.where('is_active', '==', True).where('deadline_at', '<=', now)
+    for round_snapshot in due_query.stream():
+        round_data = round_snapshot.to_dict()
+        group_id = round_data.get('group_id')
+        try:
+            ctx = PrayerContext(group_id, use_cache=False).load()
+            if ctx.round_id != round_snapshot.id or not ctx.has_active_round:
+                # 群組已指向其他輪次：結束這個孤立的輪次 (寫入紀錄與索引)，但不在群組發布總結
+                if close_round(ctx, round_snapshot.reference, round_data, 'system:deadline') is not None:
+                    result['closed'] += 1
+                continue
+            snapshot = close_active_round(ctx, 'system:deadline')
+            if snapshot is None:
+                # 已被其他請求結束 (該請求會發布總結)
+                continue
+            result['closed'] += 1
+            print(f"INFO (繁中): 群組 {group_id} 的代禱輪次 {round_snapshot.id} 已到截止時間，自動結束。")
+            push_text(group_id, f"⏰ 截止時間已到，本輪代禱已自動結束！\n{final_summary_text(snapshot)}\n\n感謝大家的參與！")
+        except Exception as e:
+            print(f"錯誤 (繁中): 自動結束輪次 {round_snapshot.id} 時發生錯誤: {e}")
+
+    if DEADLINE_REMINDER_HOURS:
+        horizon = now + datetime.timedelta(hours=DEADLINE_REMINDER_HOURS[0])
+        upcoming_query = rounds.where('is_active', '==', True).where('deadline_at', '>', now).where('deadline_at', '<=', horizon)
+        for round_snapshot in upcoming_query.stream():
+            round_data = round_snapshot.to_dict()
+            hours_left = (round_data['deadline_at'] - now).total_seconds() / 3600
+            already_sent = set(round_data.get('reminders_sent', []))
+            # 目前所在的提醒時間點 (最小且已經到達的那一個)；較早的時間點若錯過就不再補發
+            due_marks = [hours for hours in DEADLINE_REMINDER_HOURS if hours_left <= hours]
+            if not due_marks or due_marks[-1] in already_sent:
+                continue
+            try:
+                # 先以交易認領時間點再發送，兩次排程重疊時只有一次會發送提醒
+                if not claim_reminder_marks(round_snapshot.reference, due_marks):
+                    continue
+                reminder = send_pending_reminders(PrayerContext(round_data.get('group_id'), use_cache=False))
+                if reminder:
+                    result['reminded_rounds'] += 1
+                    result['reminders_sent'] += reminder['sent']
+            except Exception as e:
+                print(f"錯誤 (繁中): 發送輪次 {round_snapshot.id} 的截止提醒時發生錯誤: {e}")
+    return result
+
+# --- 處理 提醒代禱 指令 ---
+# 私訊提醒本輪尚未更新代禱事項的成員 (以 multicast 一次傳給多人)。
+def send_pending_reminders(ctx):
+    """
+    提醒 ctx 所在群組中本輪事項仍為 pending 的成員。
+    沒有進行中的輪次時回傳 None，否則回傳 {'pending': ..., 'sent': ..., 'failed': ...}。
+    """
+    ctx.load()
+    if not ctx.round_id or not ctx.has_active_round:
+        return None
+    members_map = ctx.members
+    # 只提醒仍在名單中的成員
+    pending_user_ids = [uid for uid in load_pending_user_ids(ctx.round_ref, ctx.round_data) if uid in members_map]
+    if not pending_user_ids:
+        return {'pending': 0, 'sent': 0, 'failed': 0}
+    group_name = ctx.group_data.get('group_name')
+    deadline_text = ctx.round_data.get('deadline_text', "未設定")
+    reminder_text = (f"🔔 代禱提醒{f' ({group_name})' if group_name else ''}\n"
+                     f"本輪代禱 (截止：{deadline_text}) 您還沒有更新代禱事項喔！\n\n"
+                     f"請直接在這裡輸入：\n代禱 [您的事項內容]\n或：代禱 同上週")
+    sent, failed = multicast_text(pending_user_ids, reminder_text)
+    print(f"INFO (繁中): 群組 {ctx.group_id} 的代禱提醒：{len(pending_user_ids)} 位未更新，成功 {sent}，失敗 {failed}。")
+    return {'pending': len(pending_user_ids), 'sent': sent, 'failed': failed}
+
+def handle_command_remind_prayer(user_id, ctx):
+    """
+    處理 提醒代禱 指令 (管理員，群組或私訊皆可)。
+    私訊提醒本輪尚未更新代禱事項的成員，並回報成功/失敗人數。
+    """
+    if not ctx.group_id:
+        return NO_GROUP_MESSAGE
+
+    ctx = ctx.fresh()
+    if not ctx.is_admin(user_id):
+        return "抱歉，只有本群組代禱事項的管理員才能發送提醒。😅"
+
+    try:
+        result = send_pending_reminders(ctx)
+        if result is None:
+            return "資訊：目前沒有正在進行中的代禱輪次。"
+        if not result['pending']:
+            return "🎉 所有成員都已更新代禱事項，不需要提醒！"
+        reply_text = f"✅ 已私訊提醒 {result['sent']} 位尚未更新代禱事項的成員。"
+        if result['failed']:
+            reply_text += f"\n⚠️ 有 {result['failed']} 位成員提醒失敗 (可能已封鎖 Bot)，請檢查日誌。"
+        return reply_text
+
+    except Exception as e:
+        print(f"錯誤 (繁中): 處理 提醒代禱 時發生內部錯誤: {e}")
+        return "發送提醒時發生了未預期的錯誤，請稍後再試。"
+
+# --- 處理 搜尋代禱 指令 (管理員，群組或私訊皆可) ---
+def handle_command_search_prayer(user_id, keyword, ctx):
+    """在已結束的輪次中搜尋代禱事項，由新到舊列出符合的成員與日期。"""
+    if not ctx.group_id:
+        return NO_GROUP_MESSAGE
+    ctx = ctx.fresh()
+    if not ctx.is_admin(user_id):
+        return "抱歉，只有本群組代禱事項的管理員才能搜尋代禱紀錄。😅"
+    if not keyword:
+        return "指令格式錯誤。\n用法：搜尋代禱 [關鍵字]\n例如：搜尋代禱 手術"
+
+    try:
+        try:
+            results, has_more = search_prayer_items(ctx.group_id, keyword)
+        except ValueError:
+            return "關鍵字至少需要兩個字喔。\n例如：搜尋代禱 手術"
+        if not results:
+            return f"🔍 在過去的輪次中找不到「{keyword}」。"
+
+        tz = deadlines.get_timezone(DEADLINE_TIMEZONE)
+        members_map = ctx.members
+        lines = [f"🔍 「{keyword}」的搜尋結果 (由新到舊)："]
+        for uid, item in results:
+            name = members_map.get(uid, {}).get('name') or "(已不在名單中)"
+            lines.append(f"▪️ {item['created_time'].astimezone(tz):%Y/%m/%d} {name}：{rendering.entry_display_text(item)}")
+        if has_more:
+            lines.append(f"\n(只顯示最近 {SEARCH_MAX_RESULTS} 筆，請使用更完整的關鍵字縮小範圍)")
+        return "\n".join(lines)
+
+    except Exception as e:
+        print(f"錯誤 (繁中): 處理 搜尋代禱 時發生內部錯誤: {e}")
+        return "搜尋代禱紀錄時發生了未預期的錯誤，請稍後再試。"
+
+# --- 處理私訊中的 切換群組 指令 ---
+# 加入多個代禱群組的使用者，用這個指令選擇私訊指令要作用的群組。
+def handle_command_switch_group(user_id, text_received):
+    """
+    處理 切換群組 [編號] 指令 (私訊專用)。
+    不帶編號時列出使用者加入的所有群組。
+    """
+    try:
+        user_groups = load_user_groups(user_id, use_cache=False)
+        group_ids = user_groups.get('group_ids', [])
+        if not group_ids:
+            return NO_GROUP_MESSAGE
+
+        parts = text_received.split(" ", 1)
+        if len(parts) < 2 or not parts[1].strip():
+            return group_choice_text(group_ids, user_groups.get('active_group_id'))
+
+        choice = parts[1].strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(group_ids):
+            chosen_group_id = group_ids[int(choice) - 1]
+        elif choice in group_ids:
+            chosen_group_id = choice
+        else:
+            return f"找不到編號「{choice}」。\n\n" + group_choice_text(group_ids, user_groups.get('active_group_id'))
+
+        db.collection(USER_GROUPS_COLLECTION).document(user_id).update({
+            'active_group_id': chosen_group_id,
+            'updated_time': firestore.SERVER_TIMESTAMP
+        })
+        user_groups_cache.invalidate(user_id)
+        group_name = PrayerContext(chosen_group_id).load().group_data.get('group_name') or chosen_group_id
+        return f"✅ 已切換到「{group_name}」，之後的私訊指令都會作用在這個群組。"
+
+    except Exception as e:
+        print(f"錯誤 (繁中): 處理 切換群組 時發生內部錯誤: {e}")
+        return "切換群組時發生了未預期的錯誤，請稍後再試。"
+
 # --- 處理私訊中的 幫助 指令 ---
 # 這個函式會根據使用者是否為管理員，回覆不同的幫助訊息。
 # 在群組中則不回覆任何訊息，以避免洗頻。
-def handle_command_help(user_id, group_id):
+def handle_command_help(user_id, group_id, ctx=None):
     """
     處理 幫助 指令。
     - 在私訊中：根據使用者是否為管理員，回傳不同的訊息。
@@ -847,9 +2198,9 @@ def handle_command_help(user_id, group_id):
         print(f"INFO (繁中): 在群組 {group_id} 中收到 幫助 指令，將不予回覆以避免洗頻。")
         return None
 
-    # 如果指令來自私訊，則檢查其管理員身份
-    # 注意：is_group_admin 需要使用全域的 TARGET_GROUP_ID 來判斷
-    if is_group_admin(TARGET_GROUP_ID, user_id):
+    # 如果指令來自私訊，則檢查其在目前選擇的群組中的管理員身份
+    ctx = (ctx or PrayerContext(TARGET_GROUP_ID)).fresh()
+    if ctx.is_admin(user_id):
         print(f"INFO (繁中): 管理員 {user_id} 在私訊中請求了幫助指令。")
         return ADMIN_HELP_MESSAGE
     else:
@@ -857,7 +2208,7 @@ def handle_command_help(user_id, group_id):
         return USER_HELP_MESSAGE
 
 
-def handle_command_list_members(user_id, group_id=None):
+def handle_command_list_members(user_id, group_id=None, ctx=None):
     """
     處理   指令 (私訊專用)。
     僅限管理員在私訊中使用，以查看成員列表與綁定狀態。
@@ -867,22 +2218,20 @@ def handle_command_list_members(user_id, group_id=None):
         print(f"INFO (繁中): 在群組 {group_id} 中收到 名單列表 指令，將不予回覆以避免洗頻。")
         return None
 
-    if not TARGET_GROUP_ID:
-        return "抱歉，Bot 目前設定有誤 (TGID missing)。"
+    ctx = ctx or PrayerContext(TARGET_GROUP_ID)
+    if not ctx.group_id:
+        return NO_GROUP_MESSAGE
 
     # # 權限檢查：必須是管理員
-    if not is_group_admin(TARGET_GROUP_ID, user_id):
+    ctx = ctx.fresh()
+    if not ctx.is_admin(user_id):
         return "抱歉，您不是此代禱群組的管理員，無法使用此指令。😅"
 
     try:
-        group_doc_ref = db.collection('prayer_groups').document(TARGET_GROUP_ID)
-        group_data_snapshot = group_doc_ref.get()
-
-        if not group_data_snapshot.exists:
+        if not ctx.group_exists:
             return "錯誤：找不到目標群組的設定資料。"
         
-        group_data = group_data_snapshot.to_dict()
-        members_map = group_data.get('members', {})
+        members_map = ctx.members
 
         if not members_map:
             return "目前代禱名單中沒有任何成員。"
@@ -907,7 +2256,7 @@ def handle_command_list_members(user_id, group_id=None):
 # 這個函式會在私訊中由管理員修改成員的名字。
 # 主要邏輯是檢查使用者是否為管理員，
 # 並在 Firestore 中更新對應的成員名字。
-def handle_command_edit_member_name(user_id, text_received, group_id=None):
+def handle_command_edit_member_name(user_id, text_received, group_id=None, ctx=None):
     """
     處理 修改成員名字 [舊名字] [新名字] 指令 (私訊專用)。
     """
@@ -916,11 +2265,13 @@ def handle_command_edit_member_name(user_id, text_received, group_id=None):
         print(f"INFO (繁中): 在群組 {group_id} 中收到 修改成員名字 指令，將不予回覆以避免洗頻。")
         return None
 
-    if not TARGET_GROUP_ID:
-        return "抱歉，Bot 目前設定有誤 (TGID missing)。"
+    ctx = ctx or PrayerContext(TARGET_GROUP_ID)
+    if not ctx.group_id:
+        return NO_GROUP_MESSAGE
 
     # 權限檢查：必須是管理員
-    if not is_group_admin(TARGET_GROUP_ID, user_id):
+    ctx = ctx.fresh()
+    if not ctx.is_admin(user_id):
         return "抱歉，您不是此代禱群組的管理員，無法使用此指令。😅"
 
     try:
@@ -932,49 +2283,39 @@ def handle_command_edit_member_name(user_id, text_received, group_id=None):
         old_name = parts[1].strip()
         new_name = parts[2].strip()
 
-        group_doc_ref = db.collection('prayer_groups').document(TARGET_GROUP_ID)
-        group_data_snapshot = group_doc_ref.get()
+        group_doc_ref = ctx.group_ref
 
-        if not group_data_snapshot.exists or 'members' not in group_data_snapshot.to_dict():
+        if not ctx.group_exists or 'members' not in ctx.group_data:
             return "錯誤：群組名單未設定，無法修改名字。"
 
-        members_map = group_data_snapshot.to_dict().get('members', {})
-        
-        # 檢查新名字是否已存在於名單中
-        for member_data in members_map.values():
-            if member_data.get('name', '').lower() == new_name.lower():
-                return f"錯誤：新名字「{new_name}」已存在於名單中，無法修改。"
-
-        # 根據舊名字找到對應的 user_id
-        target_user_id = None
-        for uid, member_data in members_map.items():
-            if member_data.get('name', '').lower() == old_name.lower():
-                target_user_id = uid
-                break
+        # 以名字索引找到對應的 user_id，並檢查新名字是否已是其他成員的名字 (忽略全形/半形與大小寫)
+        target_user_id = ctx.member_by_name(old_name)
+        new_name_owner = ctx.member_by_name(new_name)
+        if new_name_owner is not None and new_name_owner != target_user_id:
+            return f"錯誤：新名字「{new_name}」已存在於名單中，無法修改。"
         
         if not target_user_id:
             return f"錯誤：名單中找不到成員「{old_name}」。"
 
-        # 步驟 1: 更新 prayer_groups 文件中的成員名字
+        # 步驟 1: 更新 prayer_groups 文件中的成員名字與名字索引
         update_path_for_name = f'members.{target_user_id}.name'
         group_doc_ref.update({
             update_path_for_name: new_name,
+            **name_index_updates(ctx.group_data, target_user_id, new_name),
             'last_updated_by': user_id, 
-            'last_updated_time': firestore.SERVER_TIMESTAMP
+            'last_updated_time': firestore.SERVER_TIMESTAMP,
+            **group_version_bump()
         })
+        group_cache.invalidate(ctx.group_id)
         
         update_round_entry_text = ""
-        current_round_id = group_data_snapshot.to_dict().get('current_round_id')
+        current_round_id = ctx.round_id
         if current_round_id:
             try:
-                round_doc_ref = db.collection('prayer_rounds').document(current_round_id)
-                round_data_snapshot = round_doc_ref.get()
+                round_doc_ref = ctx.round_ref
                 # 步驟 2: 如果有活躍輪次，也同步更新輪次中的名字
-                if round_data_snapshot.exists and target_user_id in round_data_snapshot.to_dict().get('entries', {}):
-                    update_path_for_round_name = f'entries.{target_user_id}.name'
-                    round_doc_ref.update({
-                        update_path_for_round_name: new_name
-                    })
+                if ctx.round_exists and load_round_entry(round_doc_ref, ctx.round_data, target_user_id) is not None:
+                    write_round_entry(round_doc_ref, ctx.round_data, target_user_id, {'name': new_name})
                     update_round_entry_text = "同時已更新當前代禱輪次中的名字。"
             except Exception as e_round_update:
                 print(f"警告 (繁中): 更新輪次 {current_round_id} 的成員名字時發生錯誤: {e_round_update}")
@@ -988,12 +2329,13 @@ def handle_command_edit_member_name(user_id, text_received, group_id=None):
 
 # --- 處理私訊中的 修改我的名字 指令 ---
 # 這個函式會在私訊中由使用者修改自己的名字。
-def handle_command_edit_my_name(user_id, text_received):
+def handle_command_edit_my_name(user_id, text_received, ctx=None):
     """
     處理使用者在私訊中使用的 修改我的名字 [新名字] 指令。
     """
-    if not TARGET_GROUP_ID:
-        return "抱歉，Bot 目前設定有誤 (TGID missing)。"
+    ctx = ctx or PrayerContext(TARGET_GROUP_ID)
+    if not ctx.group_id:
+        return NO_GROUP_MESSAGE
 
     try:
         parts = text_received.split(" ", 1)
@@ -1002,40 +2344,37 @@ def handle_command_edit_my_name(user_id, text_received):
 
         new_name = parts[1].strip()
 
-        group_doc_ref = db.collection('prayer_groups').document(TARGET_GROUP_ID)
-        group_data_snapshot = group_doc_ref.get()
+        ctx = ctx.fresh()
+        group_doc_ref = ctx.group_ref
 
-        if not group_data_snapshot.exists or user_id not in group_data_snapshot.to_dict().get('members', {}):
+        if not ctx.group_exists or not ctx.member(user_id):
             return "抱歉，您尚未加入代禱名單，無法修改名字。\n請先輸入 加入代禱"
 
-        members_map = group_data_snapshot.to_dict().get('members', {})
-        old_name = members_map[user_id].get('name', '未知')
+        old_name = ctx.members[user_id].get('name', '未知')
 
-        # 檢查新名字是否已存在於名單中 (排除自己)
-        for uid, member_data in members_map.items():
-            if uid != user_id and member_data.get('name', '').lower() == new_name.lower():
-                return f"錯誤：新名字「{new_name}」已存在於名單中，無法修改。"
+        # 檢查新名字是否已存在於名單中 (排除自己，忽略全形/半形與大小寫)
+        if ctx.member_by_name(new_name) not in (None, user_id):
+            return f"錯誤：新名字「{new_name}」已存在於名單中，無法修改。"
 
-        # 步驟 1: 更新 prayer_groups 文件中的成員名字
+        # 步驟 1: 更新 prayer_groups 文件中的成員名字與名字索引
         update_path_for_name = f'members.{user_id}.name'
         group_doc_ref.update({
             update_path_for_name: new_name,
+            **name_index_updates(ctx.group_data, user_id, new_name),
             'last_updated_by': user_id, 
-            'last_updated_time': firestore.SERVER_TIMESTAMP
+            'last_updated_time': firestore.SERVER_TIMESTAMP,
+            **group_version_bump()
         })
+        group_cache.invalidate(ctx.group_id)
         
         update_round_entry_text = ""
-        current_round_id = group_data_snapshot.to_dict().get('current_round_id')
+        current_round_id = ctx.round_id
         if current_round_id:
             try:
-                round_doc_ref = db.collection('prayer_rounds').document(current_round_id)
-                round_data_snapshot = round_doc_ref.get()
+                round_doc_ref = ctx.round_ref
                 # 步驟 2: 如果有活躍輪次，也同步更新輪次中的名字
-                if round_data_snapshot.exists and user_id in round_data_snapshot.to_dict().get('entries', {}):
-                    update_path_for_round_name = f'entries.{user_id}.name'
-                    round_doc_ref.update({
-                        update_path_for_round_name: new_name
-                    })
+                if ctx.round_exists and load_round_entry(round_doc_ref, ctx.round_data, user_id) is not None:
+                    write_round_entry(round_doc_ref, ctx.round_data, user_id, {'name': new_name})
                     update_round_entry_text = "同時已更新您在當前代禱輪次中的名字。"
             except Exception as e_round_update:
                 print(f"警告 (繁中): 更新輪次 {current_round_id} 的成員名字時發生錯誤: {e_round_update}")
@@ -1047,79 +2386,186 @@ def handle_command_edit_my_name(user_id, text_received):
         print(f"錯誤 (繁中): 處理 修改我的名字 時發生內部錯誤: {e}")
         return None # 內部錯誤不回覆
 
+# --- 處理私訊中的 名單設定 指令 ---
+# 管理員一次貼上整份名單 (每行一位，或 JSON)，未列出的成員 (管理員除外) 會被移除。
+ROSTER_USAGE = ("用法：名單設定 後換行，每行一位成員：\n"
+                "U開頭的 user_id,名字 (名字可省略，會自動使用 LINE 名稱)\n"
+                "或 名單中既有成員的名字\n"
+                "未列出的成員 (管理員除外) 會從名單中移除。")
+
+def handle_command_set_roster(user_id, roster_text, ctx=None):
+    """
+    處理 名單設定 指令 (私訊專用)：以整份名單覆蓋群組的代禱名單。
+    名單有任何一行無法驗證時完全不修改，並列出錯誤。
+    """
+    ctx = ctx or PrayerContext(TARGET_GROUP_ID)
+    if not ctx.group_id:
+        return NO_GROUP_MESSAGE
+
+    ctx = ctx.fresh()
+    if not ctx.is_admin(user_id):
+        return "抱歉，您不是此代禱群組的管理員，無法使用此指令。😅"
+
+    try:
+        if not ctx.group_exists:
+            return "錯誤：找不到目標群組的設定資料。"
+        try:
+            rows, errors = roster.parse_roster(roster_text)
+        except ValueError as e_parse:
+            return f"錯誤：無法解析名單 ({e_parse})。\n{ROSTER_USAGE}"
+        if not rows and not errors:
+            return f"指令格式錯誤。\n{ROSTER_USAGE}"
+
+        plan, plan_errors = plan_roster(ctx, rows, replace=True)
+        errors += plan_errors
+        if errors:
+            return f"❌ 名單有 {len(errors)} 個問題，未做任何修改：\n{roster_errors_text(errors)}"
+
+        apply_roster_plan(ctx, plan, user_id)
+        print(f"INFO (繁中): 管理員 {user_id} 以 名單設定 更新了群組 {ctx.group_id} 的名單。")
+        return f"✅ 名單已更新：{roster_plan_text(ctx, plan)}"
+
+    except Exception as e:
+        print(f"錯誤 (繁中): 處理 名單設定 時發生內部錯誤: {e}")
+        return "更新名單時發生了未預期的錯誤，請稍後再試。"
+
+# --- 處理私訊中的 移除成員 指令 ---
+def handle_command_remove_members(user_id, targets_text, ctx=None):
+    """
+    處理 移除成員 [名字] 指令 (私訊專用)，可用換行、逗號或頓號一次列出多位成員。
+    任何一位找不到 (或是管理員) 時完全不修改。
+    """
+    ctx = ctx or PrayerContext(TARGET_GROUP_ID)
+    if not ctx.group_id:
+        return NO_GROUP_MESSAGE
+
+    ctx = ctx.fresh()
+    if not ctx.is_admin(user_id):
+        return "抱歉，您不是此代禱群組的管理員，無法使用此指令。😅"
+
+    try:
+        targets = roster.parse_name_list(targets_text)
+        if not targets:
+            return "指令格式錯誤。\n用法：移除成員 [名字]\n一次移除多位成員時以逗號、頓號或換行分隔。"
+        if not ctx.group_exists:
+            return "錯誤：找不到目標群組的設定資料。"
+
+        plan, errors = plan_member_removal(ctx, targets)
+        if errors:
+            return f"❌ 未移除任何成員：\n{roster_errors_text(errors)}"
+
+        apply_roster_plan(ctx, plan, user_id)
+        removed_names = joined_names(ctx.members[uid].get('name', uid) for uid in plan['removed'])
+        print(f"INFO (繁中): 管理員 {user_id} 從群組 {ctx.group_id} 移除了 {len(plan['removed'])} 位成員。")
+        return f"✅ 已從名單中移除 {len(plan['removed'])} 位成員：{removed_names}"
+
+    except Exception as e:
+        print(f"錯誤 (繁中): 處理 移除成員 時發生內部錯誤: {e}")
+        return "移除成員時發生了未預期的錯誤，請稍後再試。"
+
 
 
 
 
 # ... (其他指令的處理函式，例如 handle_command_start_prayer 等，可以陸續加入)
 
+# === 指令表 (匯入時建立一次) ===
+# 處理函式的簽名為 (command, ctx)，command 為 commands.ParsedCommand；
+# 私訊的 ctx 是使用者目前選擇的群組，needs_group=True 的指令在加入多個群組但尚未選擇時會先要求選擇群組。
+# idempotent=True 的指令 (查詢類) 重送時只在本執行個體去重，不寫入 processed_events。
+# EXACT 指令需整則訊息相同，PREFIX 指令後面可以接參數 (例如 代禱 [事項])。
+DM_COMMANDS = commands.CommandRouter(commands.SOURCE_USER)
+DM_COMMANDS.add("幫助", lambda cmd, ctx: handle_command_help(cmd.user_id, None, ctx), idempotent=True)
+DM_COMMANDS.add("help", lambda cmd, ctx: handle_command_help(cmd.user_id, None, ctx), idempotent=True)
+DM_COMMANDS.add("切換群組", lambda cmd, ctx: handle_command_switch_group(cmd.user_id, cmd.text), commands.PREFIX, idempotent=True)
+DM_COMMANDS.add("加入代禱", lambda cmd, ctx: handle_command_join_prayer(cmd.user_id, ctx.group_id), needs_group=True)
+DM_COMMANDS.add("代禱列表", lambda cmd, ctx: handle_command_prayer_list(None, cmd.user_id, ctx), needs_group=True, idempotent=True)
+DM_COMMANDS.add("代禱", lambda cmd, ctx: handle_command_update_prayer(cmd.user_id, cmd.text, ctx), commands.PREFIX, needs_group=True)
+DM_COMMANDS.add("上輪總結", lambda cmd, ctx: handle_command_last_summary(ctx), needs_group=True, idempotent=True)
+DM_COMMANDS.add("我的代禱", lambda cmd, ctx: handle_command_my_prayer(cmd.user_id, ctx), needs_group=True, idempotent=True)
+DM_COMMANDS.add("我的代禱紀錄", lambda cmd, ctx: handle_command_prayer_history(cmd.user_id, cmd.args), commands.PREFIX, idempotent=True)
+DM_COMMANDS.add("開始代禱", lambda cmd, ctx: handle_command_start_prayer_dm(cmd.user_id, cmd.text, ctx), commands.PREFIX, needs_group=True)
+DM_COMMANDS.add("結束代禱", lambda cmd, ctx: handle_command_end_prayer_dm(cmd.user_id, ctx), needs_group=True)
+DM_COMMANDS.add("提醒代禱", lambda cmd, ctx: handle_command_remind_prayer(cmd.user_id, ctx), needs_group=True)
+DM_COMMANDS.add("搜尋代禱", lambda cmd, ctx: handle_command_search_prayer(cmd.user_id, cmd.args, ctx), commands.PREFIX, needs_group=True, idempotent=True)
+DM_COMMANDS.add("名單列表", lambda cmd, ctx: handle_command_list_members(cmd.user_id, None, ctx), needs_group=True, idempotent=True)
+DM_COMMANDS.add("修改成員名字", lambda cmd, ctx: handle_command_edit_member_name(cmd.user_id, cmd.text, None, ctx), commands.PREFIX, needs_group=True)
+DM_COMMANDS.add("名單設定", lambda cmd, ctx: handle_command_set_roster(cmd.user_id, cmd.args, ctx), commands.PREFIX, needs_group=True)
+DM_COMMANDS.add("移除成員", lambda cmd, ctx: handle_command_remove_members(cmd.user_id, cmd.args, ctx), commands.PREFIX, needs_group=True)
+DM_COMMANDS.add("修改我的名字", lambda cmd, ctx: handle_command_edit_my_name(cmd.user_id, cmd.text, ctx), commands.PREFIX, needs_group=True)
+
+GROUP_COMMANDS = commands.CommandRouter(commands.SOURCE_GROUP)
+GROUP_COMMANDS.add("幫助", lambda cmd, ctx: handle_command_help(cmd.user_id, cmd.group_id), idempotent=True)
+GROUP_COMMANDS.add("help", lambda cmd, ctx: handle_command_help(cmd.user_id, cmd.group_id), idempotent=True)
+GROUP_COMMANDS.add("加入代禱", lambda cmd, ctx: handle_command_join_prayer(cmd.user_id, cmd.group_id))
+GROUP_COMMANDS.add("開始代禱", lambda cmd, ctx: handle_command_start_prayer(cmd.group_id, cmd.user_id, cmd.text, ctx), commands.PREFIX)
+GROUP_COMMANDS.add("結束代禱", lambda cmd, ctx: handle_command_end_prayer(cmd.group_id, cmd.user_id, ctx))
+GROUP_COMMANDS.add("提醒代禱", lambda cmd, ctx: handle_command_remind_prayer(cmd.user_id, ctx))
+GROUP_COMMANDS.add("搜尋代禱", lambda cmd, ctx: handle_command_search_prayer(cmd.user_id, cmd.args, ctx), commands.PREFIX, idempotent=True)
+GROUP_COMMANDS.add("代禱列表", lambda cmd, ctx: handle_command_prayer_list(cmd.group_id, cmd.user_id, ctx), idempotent=True)
+GROUP_COMMANDS.add("上輪總結", lambda cmd, ctx: handle_command_last_summary(ctx), idempotent=True)
+
+def run_command(command):
+    """執行已解析的指令，回傳要回覆的文字。"""
+    if command.source_type == commands.SOURCE_USER:
+        # 私訊指令作用於使用者目前選擇的群組 (user_groups 索引)，整個事件共用同一份群組/輪次資料
+        dm_group_id, user_group_ids = resolve_dm_group_id(command.user_id)
+        if command.route.needs_group and dm_group_id is None and user_group_ids:
+            # 加入了多個群組但還沒有選擇
+            return group_choice_text(user_group_ids)
+        return command.route.handler(command, PrayerContext(dm_group_id))
+    return command.route.handler(command, PrayerContext(command.group_id))
+
 # === LINE Bot SDK 事件處理器 ===
-if sdk_initialized_successfully and handler:
+if handler:
     
-    @handler.add(FollowEvent)
+    @on_event(FollowEvent)
     def handle_follow(event):
+        if not claim_event(event, persistent=False):
+            return
         try:
-            profile = line_bot_api.get_profile(event.source.user_id)
-            reply_text = f"哈囉 {profile.display_name}！👋\n我是代禱事項小幫手。\n\n如果您想加入代禱名單，請直接在這裡輸入指令：\n加入代禱"
-            reply_message_handler(event.reply_token, reply_text)
-            print(f"INFO (繁中): 已發送歡迎訊息給新好友 {profile.display_name} ({event.source.user_id})。")
+            with instrumentation.command_scope('follow', commands.SOURCE_USER):
+                # 重新加入好友的成員可以直接使用名單中已記錄的名字
+                follow_group_id, _ = resolve_dm_group_id(event.source.user_id)
+                members_map = PrayerContext(follow_group_id).members if follow_group_id else {}
+                display_name = get_display_name(event.source.user_id, members_map)
+                if not display_name:
+                    return
+                reply_text = f"哈囉 {display_name}！👋\n我是代禱事項小幫手。\n\n如果您想加入代禱名單，請直接在這裡輸入指令：\n加入代禱"
+                reply_to_event(event, reply_text)
+                print(f"INFO (繁中): 已發送歡迎訊息給新好友 {display_name} ({event.source.user_id})。")
         except Exception as e: print(f"錯誤 (繁中): 回覆新好友歡迎訊息時發生錯誤: {e}")
     
-    @handler.add(MessageEvent, message=TextMessageContent)
+    @on_event(MessageEvent, message=TextMessageContent)
     def handle_text_message(event):
         user_id = event.source.user_id
-        text_received = event.message.text.strip()
-        reply_text = None
+        text_received = commands.normalize_text(event.message.text)
+        command = None
         
-        # --- 指令路由器 (Router) ---
+        # --- 指令路由器 (Router)：依來源查詢對應的指令表 ---
         if isinstance(event.source, SourceUser):
             print(f"INFO (繁中): 收到來自用戶 {user_id} 的私訊: {text_received}")
-            if text_received.lower() in ["幫助", "help"]:
-                reply_text = handle_command_help(user_id, None) 
-            elif text_received.lower() == "加入代禱":
-                reply_text = handle_command_join_prayer(user_id)
-            elif text_received.lower() == "代禱列表":
-                reply_text = handle_command_prayer_list(None, user_id)
-            elif text_received.lower().startswith("代禱"):
-                reply_text = handle_command_update_prayer(user_id, text_received)
-            elif text_received.lower() == "我的代禱":
-                reply_text = handle_command_my_prayer(user_id)
-            elif text_received.lower().startswith("開始代禱"):
-                reply_text = handle_command_start_prayer_dm(user_id, text_received)
-            elif text_received.lower() == "結束代禱":
-                reply_text = handle_command_end_prayer_dm(user_id)
-            elif text_received.lower() == "名單列表":
-                reply_text = handle_command_list_members(user_id, None)
-            elif text_received.lower().startswith("修改成員名字"):
-                reply_text = handle_command_edit_member_name(user_id, text_received, None)
-            elif text_received.lower().startswith("修改我的名字"):
-                reply_text = handle_command_edit_my_name(user_id, text_received)
-
-
+            command = DM_COMMANDS.parse(text_received, user_id)
         elif isinstance(event.source, SourceGroup):
             group_id = event.source.group_id
             print(f"INFO (繁中): 收到來自群組 {group_id} (使用者 {user_id}) 的訊息: {text_received}")
-            if text_received.lower() in ["幫助", "help"]:
-                # 呼叫新的幫助函式，傳入 group_id
-                reply_text = handle_command_help(user_id, group_id)
-            elif text_received.lower().startswith("開始代禱"):
-                reply_text = handle_command_start_prayer(group_id, user_id, text_received)
-            elif text_received.lower() == "結束代禱":
-                reply_text = handle_command_end_prayer(group_id, user_id)
-            elif text_received.lower() == "代禱列表":
-                # 呼叫函式，傳入實際的 group_id
-                reply_text = handle_command_prayer_list(group_id, user_id)
+            command = GROUP_COMMANDS.parse(text_received, user_id, group_id)
+        if command is None or not claim_event(event, persistent=not command.route.idempotent):
+            return
             
-            # ... 其他群組指令的呼叫
-            
-        # --- 統一回覆 ---
-        reply_message_handler(event.reply_token, reply_text)
+        # --- 執行指令並統一回覆 (耗時與 Firestore / LINE API 用量依指令記錄到 /metrics) ---
+        try:
+            with instrumentation.command_scope(command.verb, command.source_type):
+                reply_to_event(event, run_command(command))
+        except Exception:
+            release_event(event)
+            raise
 
 # === Google Cloud Functions 的 HTTP 進入點函式 ===
 @functions_framework.http
 def line_bot_handler_function(request_ff):
-    if not sdk_initialized_successfully or not db_initialized_successfully or not TARGET_GROUP_ID:
-        print("嚴重錯誤 (繁中): 服務未完全初始化 (SDK, DB, 或 TARGET_GROUP_ID)。")
+    if not sdk_ready() or not db_ready():
+        print("嚴重錯誤 (繁中): 服務未完全初始化 (SDK 或 DB)。")
         return "服務因內部設定錯誤而不可用。", 503
     with flask_app.request_context(request_ff.environ):
         try:
@@ -0,0 +1,176 @@
+"""
+代禱列表的排版 (Rendering)
+
+- entry_display_text(): 將一筆代禱事項 (text + status) 轉換成列表中顯示的文字。
+- RoundListing: 某一輪依名字排序好的名單、各成員的事項與已排版的每一行。
+  單一成員更新事項時只重新排版他自己那一行。
+  RoundListing 會放在 main.py 的 round_list_cache 中，讓「代禱列表」不必每次都重新查詢與排序。
+- RoundSnapshot: 已結束輪次的不可變快照 (排序好的名單與狀態、事項原文與統計；每一行在讀取時排版)，結束輪次時產生一次，之後只讀不寫。
+- split_text_messages(): 將過長的文字依成員邊界切成多則 LINE 訊息 (每則最多 5000 字)。
+"""
+import collections
+import threading
+import types
+
+# LINE 文字訊息的長度上限 (以 UTF-16 字元計算，emoji 等字元算兩個) 與每次 reply/push 最多可帶的訊息數
+LINE_TEXT_LIMIT = 5000
+LINE_MESSAGES_PER_CALL = 5
+MEMBER_LINE_PREFIX = "▪️ "
+
+
+def entry_display_text(entry, pending_text="(待更新)"):
+    """依照事項的狀態決定顯示文字 (代禱列表、結束代禱、我的代禱共用)。"""
+    item_text = entry.get('text', '')
+    status = entry.get('status', 'pending')
+    if status == 'same_as_last_week':
+        return "同上週 (但未抓取到內容)"
+    if status == 'updated_from_last_week':
+        return f"{item_text} (同上週內容)" if item_text else "同上週 (內容已抓取但為空)"
+    if status == 'pending' and not item_text:
+        return pending_text
+    if not item_text:
+        return "(內容為空)"
+    return item_text
+
+
+def sorted_roster(members_map):
+    """依成員名字排序的 [(user_id, name)]。"""
+    return [(member_info.get('user_id'), member_info.get('name'))
+            for member_info in sorted(members_map.values(), key=lambda x: x.get('name', ''))]
+
+
+class RoundListing:
+    """某一輪的名單與事項，以及排版好的列表內容。"""
+
+    def __init__(self, group_version, members_map, entries):
+        self._lock = threading.Lock()
+        self.group_version = group_version
+        self.roster = sorted_roster(members_map)
+        self.entries = {uid: dict(entry) for uid, entry in entries.items()}
+        self._lines = {uid: entry_display_text(entry) for uid, entry in self.entries.items()}
+        self._body = None
+
+    def set_roster(self, group_version, members_map):
+        with self._lock:
+            self.group_version = group_version
+            self.roster = sorted_roster(members_map)
+            self._body = None
+
+    def apply_entry_update(self, user_id, fields):
+        with self._lock:
+            entry = self.entries.setdefault(user_id, {})
+            entry.update(fields)
+            self._lines[user_id] = entry_display_text(entry)
+            self._body = None
+
+    def body(self):
+        """列表內容 (只包含在本輪有事項記錄的成員)，每行以換行開頭。"""
+        with self._lock:
+            if self._body is None:
+                self._body = "".join(f"\n▪️ {name}：{self._lines[uid]}" for uid, name in self.roster if uid in self._lines)
+            return self._body
+
+
+class RoundSnapshot(collections.namedtuple(
+        'RoundSnapshot', ['round_id', 'group_id', 'deadline_text', 'roster', 'lines', 'texts', 'counts'])):
+    """
+    已結束輪次的快照：roster 為依名字排序的 ((user_id, name, status), ...)，texts 為 {user_id: 事項原文} (「同上週」使用)，
+    lines 為由兩者排版的 ((name, 顯示文字), ...)，counts 為 member_count / submitted_count / pending_count。
+    欄位皆為不可變的型別，可以安心在執行緒之間共用。
+    寫入 Firestore 時只存 roster 與 texts (每段事項只存一次)，lines 在讀取時重新排版。
+    """
+    __slots__ = ()
+
+    @classmethod
+    def _create(cls, round_id, group_id, deadline_text, roster, texts, counts):
+        roster = tuple(roster)
+        lines = tuple((name, entry_display_text({'text': texts.get(uid, ''), 'status': status})) for uid, name, status in roster)
+        return cls(round_id, group_id, deadline_text, roster, lines,
+                   types.MappingProxyType(dict(texts)), types.MappingProxyType(dict(counts)))
+
+    @classmethod
+    def build(cls, round_id, round_data, members_map, entries, counts):
+        """
+        以結束時的名單與事項建立快照；與 RoundListing.body() 相同，只列出名單中在本輪有事項記錄的成員。
+        members_map 為空時 (補建舊輪次的快照，當時的名單已無從得知) 改以事項中保存的名字列出所有事項。
+        texts 仍保留所有事項，離開後又回到名單的成員也能使用「同上週」。
+        """
+        if members_map:
+            roster = sorted_roster(members_map)
+        else:
+            roster = sorted(((uid, entry.get('name', '未知名字')) for uid, entry in entries.items()), key=lambda item: item[1])
+        return cls._create(round_id, (round_data or {}).get('group_id'), (round_data or {}).get('deadline_text'),
+                           ((uid, name, entries[uid].get('status', 'pending')) for uid, name in roster if uid in entries),
+                           {uid: entry['text'] for uid, entry in entries.items() if entry.get('text')}, counts)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls._create(data.get('round_id'), data.get('group_id'), data.get('deadline_text'),
+                           ((item.get('user_id'), item.get('name'), item.get('status', 'pending')) for item in data.get('roster', [])),
+                           data.get('texts') or {}, data.get('summary') or {})
+
+    def to_dict(self):
+        return {'round_id': self.round_id, 'group_id': self.group_id, 'deadline_text': self.deadline_text,
+                'roster': [{'user_id': uid, 'name': name, 'status': status} for uid, name, status in self.roster],
+                'texts': dict(self.texts), 'summary': dict(self.counts)}
+
+    def body(self):
+        """列表內容，每行以換行開頭 (格式與 RoundListing.body() 相同)。"""
+        return "".join(f"\n▪️ {name}：{text}" for name, text in self.lines)
+
+
+def line_text_length(text):
+    """LINE 計算訊息長度的方式 (UTF-16 code units)。"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _hard_split(text, limit):
+    """單一區塊本身就超過上限時，只能依字元數切開。"""
+    pieces, current, current_length = [], [], 0
+    for char in text:
+        char_length = 2 if ord(char) > 0xFFFF else 1
+        if current_length + char_length > limit:
+            pieces.append("".join(current))
+            current, current_length = [], 0
+        current.append(char)
+        current_length += char_length
+    if current:
+        pieces.append("".join(current))
+    return pieces
+
+
+def split_text_messages(text, limit=LINE_TEXT_LIMIT):
+    """
+    將文字切成多段，每段不超過 limit。
+    以「▪️ 」開頭的行 (一位成員) 與空白行視為區塊的開始，同一位成員的事項 (即使有多行) 會留在同一則訊息中；
+    只有單一區塊本身超過上限時才會從中間切開。
+    """
+    if line_text_length(text) <= limit:
+        return [text]
+
+    blocks = []
+    for line in text.split('\n'):
+        if not blocks or line.startswith(MEMBER_LINE_PREFIX) or not line:
+            blocks.append([line])
+        else:
+            blocks[-1].append(line)
+
+    chunks, current, current_length = [], [], 0
+    for block_lines in blocks:
+        block = '\n'.join(block_lines)
+        block_length = line_text_length(block)
+        # 加上與前一個區塊之間的換行
+        if current and current_length + 1 + block_length <= limit:
+            current.append(block)
+            current_length += 1 + block_length
+            continue
+        if current:
+            chunks.append('\n'.join(current))
+            current, current_length = [], 0
+        if block_length <= limit:
+            current, current_length = [block], block_length
+        else:
+            chunks.extend(_hard_split(block, limit))
+    if current:
+        chunks.append('\n'.join(current))
+    return [chunk.strip('\n') for chunk in chunks if chunk.strip('\n')]
@@ -0,0 +1,88 @@
+"""
+批次名單匯入 (Roster Import)
+
+解析管理員貼上的名單 (名單設定 指令) 或 CSV / JSON 檔案 (tools/import_roster.py)，
+轉換成 RosterRow(line_no, user_id, name) 的列表，實際寫入由 main.py 的 apply_roster_plan() 負責。
+
+支援的格式：
+- 每行一位成員 (CSV，逗號或 Tab 分隔)：`U開頭的 user_id[,名字]` 或 `名字` (只有名字時必須是名單中已有的成員)。
+  第一行若為標題 (user_id / name / 名字) 會被略過。
+- JSON：["Uxxxx", ...]、[{"user_id": "Uxxxx", "name": "王小明"}, ...]，或 {"members": [...]}。
+"""
+import collections
+import csv
+import io
+import json
+import re
+
+LINE_USER_ID_PATTERN = re.compile(r'^U[0-9a-f]{32}$')
+HEADER_CELLS = {'user_id', 'userid', 'id', 'name', '名字', '姓名'}
+# 移除成員 可以一次列出多個名字，以換行、逗號或頓號分隔
+NAME_LIST_SEPARATORS = re.compile(r'[\n,，、]')
+
+# name 為 None 表示需要向 LINE 查詢顯示名稱；user_id 為 None 表示以名字對應名單中既有的成員
+RosterRow = collections.namedtuple('RosterRow', ['line_no', 'user_id', 'name'])
+
+
+def is_line_user_id(value):
+    return bool(LINE_USER_ID_PATTERN.match(value or ''))
+
+
+def _row_from_cells(line_no, cells):
+    cells = [cell.strip() for cell in cells if cell and cell.strip()]
+    if not cells:
+        return None, None
+    user_ids = [cell for cell in cells if is_line_user_id(cell)]
+    names = [cell for cell in cells if not is_line_user_id(cell)]
+    if len(user_ids) > 1 or len(names) > 1:
+        return None, (line_no, "格式錯誤 (每行只能有一個 user_id 與一個名字)")
+    return RosterRow(line_no, user_ids[0] if user_ids else None, names[0] if names else None), None
+
+
+def _parse_json(text):
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get('members', [])
+    if not isinstance(data, list):
+        raise ValueError("JSON 名單必須是陣列或 {\"members\": [...]}")
+    rows, errors = [], []
+    for line_no, item in enumerate(data, start=1):
+        if isinstance(item, str):
+            cells = [item]
+        elif isinstance(item, dict):
+            cells = [str(item.get('user_id') or ''), str(item.get('name') or '')]
+        else:
+            errors.append((line_no, "格式錯誤 (必須是字串或物件)"))
+            continue
+        row, error = _row_from_cells(line_no, cells)
+        if error:
+            errors.append(error)
+        elif row:
+            rows.append(row)
+    return rows, errors
+
+
+def parse_roster(text):
+    """
+    解析名單文字，回傳 (rows, errors)；errors 為 [(行號, 說明)]。
+    JSON 格式本身無法解析時拋出 ValueError。
+    """
+    text = (text or '').lstrip('\ufeff').strip()
+    if text.startswith(('[', '{')):
+        return _parse_json(text)
+    rows, errors = [], []
+    dialect = 'excel-tab' if '\t' in text else 'excel'
+    for line_no, cells in enumerate(csv.reader(io.StringIO(text), dialect), start=1):
+        if line_no == 1 and cells and cells[0].strip().lower() in HEADER_CELLS:
+            continue
+        row, error = _row_from_cells(line_no, cells)
+        if error:
+            errors.append(error)
+        elif row:
+            rows.append(row)
+    return rows, errors
+
+
+def parse_name_list(text):
+    """移除成員 的參數：回傳去除空白後的名字 (或 user_id) 列表。"""
+    return [part.strip() for part in NAME_LIST_SEPARATORS.split(text or '') if part.strip()]
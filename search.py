@@ -0,0 +1,44 @@
+"""
+代禱事項的全文搜尋 (Search)
+
+代禱事項多為繁體中文，詞與詞之間沒有空白，因此以「相鄰兩個字」(bigram) 作為索引詞：
+「王伯伯手術」→ 王伯、伯伯、伯手、手術。查詢時關鍵字的所有 bigram 都必須出現，
+再以原文確認關鍵字確實連續出現 (排除 bigram 分散在不同位置的誤判)。
+
+- normalize(): NFKC 正規化 (全形英數轉半形) 並轉小寫，標點與空白視為分隔。
+- index_terms(): 一段事項文字的所有索引詞 (set)。
+- query_terms(): 關鍵字的索引詞；少於兩個字的片段無法以 bigram 查詢。
+- matches(): 以原文確認是否符合關鍵字。
+"""
+import unicodedata
+
+
+def normalize(text):
+    """回傳以空白分隔的片段 (只保留文字與數字，已轉小寫)。"""
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    return ''.join(char if char.isalnum() else ' ' for char in text).split()
+
+
+def _bigrams(run):
+    return {run[i:i + 2] for i in range(len(run) - 1)}
+
+
+def index_terms(text):
+    terms = set()
+    for run in normalize(text):
+        terms |= _bigrams(run)
+    return terms
+
+
+def query_terms(keyword):
+    """關鍵字的索引詞；任一片段只有一個字時回傳 None (無法查詢)。"""
+    runs = normalize(keyword)
+    if not runs or any(len(run) < 2 for run in runs):
+        return None
+    return index_terms(keyword)
+
+
+def matches(text, keyword):
+    """關鍵字的每個片段都連續出現在事項中 (忽略標點、空白與大小寫)。"""
+    haystack = ' '.join(normalize(text))
+    return all(run in haystack for run in normalize(keyword))
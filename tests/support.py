@@ -0,0 +1,15 @@
+"""測試共用：以記憶體後端 (STORAGE_BACKEND=memory) 與假的 LINE 金鑰匯入 main.py，不會連線 GCP 或 LINE。"""
+import contextlib
+import io
+import os
+
+
+def import_main():
+    os.environ.setdefault('STORAGE_BACKEND', 'memory')
+    os.environ.setdefault('LINE_CHANNEL_SECRET', 'test-secret')
+    os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'test-token')
+    # 匯入與初始化儲存後端時的訊息不輸出到測試結果
+    with contextlib.redirect_stdout(io.StringIO()):
+        import main
+        main.db_ready()
+    return main
@@ -0,0 +1,113 @@
+"""caches.LRUTTLCache / GroupDocCache 的單元測試 (以假的時鐘控制 TTL)。"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import caches  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class LRUTTLCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_entries_expire_after_ttl(self):
+        cache = caches.LRUTTLCache(ttl_seconds=10, clock=self.clock)
+        cache.put('a', 1)
+        self.clock.advance(9.9)
+        self.assertEqual(cache.get('a'), 1)
+        self.clock.advance(0.1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('a', 'default'), 'default')
+        self.assertEqual(cache.stats(), {'size': 0, 'hits': 1, 'misses': 2, 'expired': 1, 'evictions': 0})
+
+    def test_per_entry_ttl(self):
+        cache = caches.LRUTTLCache(ttl_seconds=10, clock=self.clock)
+        cache.put('short', 1, ttl_seconds=1)
+        cache.put('forever', 2, ttl_seconds=None)
+        self.clock.advance(1000)
+        self.assertIsNone(cache.get('short'))
+        self.assertEqual(cache.get('forever'), 2)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = caches.LRUTTLCache(max_size=2, clock=self.clock)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.peek('b'))
+        self.assertEqual((cache.peek('a'), cache.peek('c')), (1, 3))
+        self.assertEqual((len(cache), cache.evictions), (2, 1))
+
+    def test_put_refreshes_position_and_expiry(self):
+        cache = caches.LRUTTLCache(max_size=2, ttl_seconds=10, clock=self.clock)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.clock.advance(5)
+        cache.put('a', 10)
+        cache.put('c', 3)
+        self.assertIsNone(cache.peek('b'))
+        self.clock.advance(6)
+        self.assertEqual(cache.get('a'), 10)
+
+    def test_peek_does_not_touch_stats_or_order(self):
+        cache = caches.LRUTTLCache(max_size=2, ttl_seconds=10, clock=self.clock)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.peek('a'), 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.peek('a'))
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+        self.clock.advance(10)
+        self.assertIsNone(cache.peek('c'))
+
+    def test_invalidate_and_clear(self):
+        cache = caches.LRUTTLCache(clock=self.clock)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.invalidate('a')
+        cache.invalidate('missing')
+        self.assertIsNone(cache.get('a'))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class GroupDocCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = caches.GroupDocCache(ttl_seconds=30, clock=self.clock)
+
+    def test_older_version_does_not_replace_newer(self):
+        self.assertTrue(self.cache.put_group('C1', {'version': 3, 'name': 'new'}))
+        self.assertFalse(self.cache.put_group('C1', {'version': 2, 'name': 'old'}))
+        self.assertEqual(self.cache.get('C1')['name'], 'new')
+        self.assertTrue(self.cache.put_group('C1', {'version': 3, 'name': 'same version'}))
+        self.assertEqual(self.cache.get('C1')['name'], 'same version')
+
+    def test_expired_entry_accepts_any_version(self):
+        self.cache.put_group('C1', {'version': 3})
+        self.clock.advance(30)
+        self.assertTrue(self.cache.put_group('C1', {'version': 1}))
+
+    def test_mark_stale(self):
+        self.cache.put_group('C1', {'version': 1})
+        self.cache.mark_stale('C1')
+        self.cache.mark_stale('C1')
+        self.assertIsNone(self.cache.get('C1'))
+        self.assertEqual(self.cache.stats()['stale'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
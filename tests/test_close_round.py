@@ -0,0 +1,85 @@
+"""結束輪次 (close_active_round / commit_round_close) 的單元測試：同一輪只會被結束一次。"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.support import import_main  # noqa: E402
+
+main = import_main()
+
+
+class CloseRoundTest(unittest.TestCase):
+    def setUp(self):
+        self.group_id = f"C{self.id()}"
+        self.round_id = f"{self.group_id}_20261016-120000"
+        members = {'U1': {'name': "Amy", 'user_id': 'U1'}, 'U2': {'name': "Bob", 'user_id': 'U2'}}
+        main.db.collection('prayer_groups').document(self.group_id).set(
+            {'members': members, 'admin_user_ids': ['U1'], 'current_round_id': self.round_id, 'version': 1})
+        round_ref = main.db.collection('prayer_rounds').document(self.round_id)
+        main.create_round(round_ref, {'group_id': self.group_id, 'deadline_text': "週五", 'is_active': True}, members)
+        round_ref.collection(main.ENTRIES_SUBCOLLECTION).document('U2').update({'text': "平安", 'status': 'updated'})
+
+    def context(self):
+        return main.PrayerContext(self.group_id).load()
+
+    def test_close_updates_round_group_and_derived_data(self):
+        snapshot = main.close_active_round(self.context(), 'U1')
+        self.assertEqual(snapshot.lines, (("Amy", "(待更新)"), ("Bob", "平安")))
+        round_data = main.db.collection('prayer_rounds').document(self.round_id).get().to_dict()
+        self.assertIs(round_data['is_active'], False)
+        self.assertEqual(round_data['summary'], {'member_count': 2, 'submitted_count': 1, 'pending_count': 1})
+        group_data = main.db.collection('prayer_groups').document(self.group_id).get().to_dict()
+        self.assertNotIn('current_round_id', group_data)
+        self.assertEqual((group_data['last_round_id'], group_data['version']), (self.round_id, 2))
+        self.assertTrue(main.db.collection(main.ROUND_SNAPSHOTS_COLLECTION).document(self.round_id).get().exists)
+        self.assertTrue(main.prayer_history_items('U2').document(self.round_id).get().exists)
+
+    def test_snapshot_doc_stores_each_text_once(self):
+        snapshot = main.close_active_round(self.context(), 'U1')
+        snapshot_data = main.db.collection(main.ROUND_SNAPSHOTS_COLLECTION).document(self.round_id).get().to_dict()
+        self.assertNotIn('lines', snapshot_data)
+        self.assertEqual(repr(snapshot_data).count("平安"), 1)
+        main.round_snapshot_cache.invalidate(self.round_id)
+        loaded = main.load_round_snapshot(self.round_id)
+        self.assertEqual((loaded.lines, dict(loaded.texts), dict(loaded.counts)),
+                         (snapshot.lines, dict(snapshot.texts), dict(snapshot.counts)))
+
+    def test_missing_snapshot_is_rebuilt_even_if_saving_fails(self):
+        snapshot = main.close_active_round(self.context(), 'U1')
+        main.db.collection(main.ROUND_SNAPSHOTS_COLLECTION).document(self.round_id).delete()
+        main.round_snapshot_cache.invalidate(self.round_id)
+        with mock.patch.object(main, 'save_round_snapshot', side_effect=RuntimeError("firestore down")), \
+                mock.patch('builtins.print'):
+            rebuilt = main.load_round_snapshot(self.round_id)
+        self.assertEqual((rebuilt.lines, dict(rebuilt.texts)), (snapshot.lines, dict(snapshot.texts)))
+
+    def test_round_is_closed_only_once(self):
+        first, second = self.context(), self.context()
+        self.assertIsNotNone(main.close_active_round(first, 'U1'))
+        with mock.patch('builtins.print'):
+            self.assertIsNone(main.close_active_round(second, 'system:deadline'))
+        round_data = main.db.collection('prayer_rounds').document(self.round_id).get().to_dict()
+        self.assertEqual(round_data['ended_by'], 'U1')
+
+    def test_orphan_round_does_not_touch_group(self):
+        orphan_ref = main.db.collection('prayer_rounds').document(f"{self.group_id}_orphan")
+        orphan_ref.set({'group_id': self.group_id, 'is_active': True})
+        group_ref = main.db.collection('prayer_groups').document(self.group_id)
+        self.assertTrue(main.commit_round_close(orphan_ref, group_ref, 'system:deadline'))
+        self.assertFalse(main.commit_round_close(orphan_ref, group_ref, 'system:deadline'))
+        self.assertEqual(group_ref.get().to_dict()['current_round_id'], self.round_id)
+
+    def test_derived_write_failure_keeps_round_closed(self):
+        with mock.patch.object(main, 'save_search_index', side_effect=RuntimeError("search down")), \
+                mock.patch('builtins.print'):
+            snapshot = main.close_active_round(self.context(), 'U1')
+        self.assertIsNotNone(snapshot)
+        self.assertIs(main.db.collection('prayer_rounds').document(self.round_id).get().get('is_active'), False)
+        self.assertTrue(main.prayer_history_items('U2').document(self.round_id).get().exists)
+
+
+if __name__ == '__main__':
+    unittest.main()
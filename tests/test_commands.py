@@ -0,0 +1,69 @@
+"""commands.CommandRouter 的單元測試 (python -m unittest discover tests)。"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import commands  # noqa: E402
+
+
+def make_router():
+    router = commands.CommandRouter(commands.SOURCE_USER)
+    router.add('代禱', 'update', match=commands.PREFIX)
+    router.add('代禱列表', 'list')
+    router.add('開始代禱', 'start', match=commands.PREFIX, needs_group=True)
+    router.add('Help', 'help', idempotent=True)
+    return router
+
+
+class CommandRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.router = make_router()
+
+    def parse_handler(self, text):
+        command = self.router.parse(text)
+        return None if command is None else command.route.handler
+
+    def test_exact_command_must_match_whole_message(self):
+        self.assertEqual(self.parse_handler("代禱列表"), 'list')
+        # 不完全相同時退回較短的 prefix 指令
+        command = self.router.parse("代禱列表 全部")
+        self.assertEqual((command.verb, command.args), ('代禱', "列表 全部"))
+
+    def test_prefix_command_splits_args(self):
+        command = self.router.parse("代禱 工作順利", user_id='U1', group_id='C1')
+        self.assertEqual(command.verb, '代禱')
+        self.assertEqual(command.args, "工作順利")
+        self.assertEqual(command.text, "代禱 工作順利")
+        self.assertEqual((command.source_type, command.user_id, command.group_id),
+                         (commands.SOURCE_USER, 'U1', 'C1'))
+
+    def test_longest_valid_verb_wins(self):
+        self.assertEqual(self.parse_handler("開始代禱 週五"), 'start')
+        self.assertTrue(self.router.parse("開始代禱").route.needs_group)
+
+    def test_not_a_command(self):
+        self.assertIsNone(self.router.parse("大家好"))
+        self.assertIsNone(self.router.parse("代"))
+        self.assertIsNone(self.router.parse(""))
+
+    def test_full_width_space_and_case(self):
+        self.assertEqual(self.router.parse("　代禱　事項　").args, "事項")
+        self.assertEqual(self.parse_handler("HELP"), 'help')
+        self.assertTrue(self.router.parse("help").route.idempotent)
+
+    def test_duplicate_verb_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.router.add('代禱列表', 'again')
+        with self.assertRaises(ValueError):
+            self.router.add('help', 'again')
+
+    def test_match_returns_verb_length(self):
+        route, length = self.router.match("開始代禱 週五")
+        self.assertEqual((route.verb, length), ('開始代禱', 4))
+        self.assertEqual(self.router.match("沒有"), (None, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""deadlines.parse_deadline 的單元測試 (python -m unittest discover tests)。"""
+import datetime
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import deadlines  # noqa: E402
+
+TZ = deadlines.get_timezone()
+# 2026/10/16 是星期五
+FRIDAY_NOON = datetime.datetime(2026, 10, 16, 12, 0, tzinfo=TZ)
+FRIDAY_NIGHT = datetime.datetime(2026, 10, 16, 22, 0, tzinfo=TZ)
+
+
+def local(text, now=FRIDAY_NOON):
+    deadline_at = deadlines.parse_deadline(text, now=now)
+    return None if deadline_at is None else deadline_at.astimezone(TZ).replace(tzinfo=None)
+
+
+class ParseTimeTest(unittest.TestCase):
+    def test_clock_time_with_pm_suffix(self):
+        self.assertEqual(local("週五 9:30pm"), datetime.datetime(2026, 10, 16, 21, 30))
+        self.assertEqual(local("9:30 PM"), datetime.datetime(2026, 10, 16, 21, 30))
+
+    def test_clock_time_with_am_suffix(self):
+        self.assertEqual(local("下週一 9:30am"), datetime.datetime(2026, 10, 19, 9, 30))
+        self.assertEqual(local("明天 12:15am"), datetime.datetime(2026, 10, 17, 0, 15))
+
+    def test_hour_with_am_pm_suffix(self):
+        self.assertEqual(local("9pm"), datetime.datetime(2026, 10, 16, 21, 0))
+        self.assertEqual(local("明天 12pm"), datetime.datetime(2026, 10, 17, 12, 0))
+        self.assertIsNone(local("13pm"))
+
+    def test_evening_prefix_applies_to_clock_time(self):
+        self.assertEqual(local("晚上 9:30"), datetime.datetime(2026, 10, 16, 21, 30))
+        self.assertEqual(local("下午3:15"), datetime.datetime(2026, 10, 16, 15, 15))
+        self.assertEqual(local("今晚 8:00"), datetime.datetime(2026, 10, 16, 20, 0))
+
+    def test_chinese_time(self):
+        self.assertEqual(local("週五 晚上9點"), datetime.datetime(2026, 10, 16, 21, 0))
+        self.assertEqual(local("明天 下午3點半"), datetime.datetime(2026, 10, 17, 15, 30))
+        self.assertEqual(local("明天 早上8點20分"), datetime.datetime(2026, 10, 17, 8, 20))
+        self.assertEqual(local("明天 中午12點"), datetime.datetime(2026, 10, 17, 12, 0))
+        self.assertEqual(local("明天 中午1點"), datetime.datetime(2026, 10, 17, 13, 0))
+
+    def test_midnight_is_start_of_next_day(self):
+        self.assertEqual(local("晚上12點"), datetime.datetime(2026, 10, 17, 0, 0))
+        self.assertEqual(local("週五 晚上12點"), datetime.datetime(2026, 10, 17, 0, 0))
+        self.assertEqual(local("今晚12點"), datetime.datetime(2026, 10, 17, 0, 0))
+        self.assertEqual(local("週六 晚上12點半"), datetime.datetime(2026, 10, 18, 0, 30))
+
+    def test_date_only_defaults_to_end_of_day(self):
+        self.assertEqual(local("明天"), datetime.datetime(2026, 10, 17, 23, 59))
+        self.assertEqual(local("2026/12/25"), datetime.datetime(2026, 12, 25, 23, 59))
+
+    def test_unparseable(self):
+        self.assertIsNone(local("無特別截止時間"))
+        self.assertIsNone(local("2/30"))
+        self.assertIsNone(local(""))
+
+
+class ParseDateTest(unittest.TestCase):
+    def test_weekday(self):
+        self.assertEqual(local("週日"), datetime.datetime(2026, 10, 18, 23, 59))
+        self.assertEqual(local("星期三 21:00"), datetime.datetime(2026, 10, 21, 21, 0))
+        self.assertEqual(local("禮拜五 21:00"), datetime.datetime(2026, 10, 16, 21, 0))
+
+    def test_next_week(self):
+        self.assertEqual(local("下週五 21:00"), datetime.datetime(2026, 10, 23, 21, 0))
+        self.assertEqual(local("下週一"), datetime.datetime(2026, 10, 19, 23, 59))
+
+    def test_month_day_rolls_to_next_year(self):
+        self.assertEqual(local("6/7 21:00"), datetime.datetime(2027, 6, 7, 21, 0))
+        self.assertEqual(local("11/1"), datetime.datetime(2026, 11, 1, 23, 59))
+
+    def test_relative_day(self):
+        self.assertEqual(local("後天 晚上9點"), datetime.datetime(2026, 10, 18, 21, 0))
+
+
+class PastDeadlineTest(unittest.TestCase):
+    def test_weekday_already_passed_today_moves_to_next_week(self):
+        self.assertEqual(local("週五 21:00", now=FRIDAY_NIGHT), datetime.datetime(2026, 10, 23, 21, 0))
+        self.assertEqual(local("週五 9:30pm", now=FRIDAY_NIGHT), datetime.datetime(2026, 10, 23, 21, 30))
+
+    def test_weekday_later_today_stays_today(self):
+        self.assertEqual(local("週五 23:00", now=FRIDAY_NIGHT), datetime.datetime(2026, 10, 16, 23, 0))
+
+    def test_relative_day_already_passed_moves_forward(self):
+        self.assertEqual(local("今天 9:00"), datetime.datetime(2026, 10, 17, 9, 0))
+
+    def test_time_only_already_passed_is_tomorrow(self):
+        self.assertEqual(local("9:00"), datetime.datetime(2026, 10, 17, 9, 0))
+        self.assertEqual(local("21:00", now=FRIDAY_NIGHT), datetime.datetime(2026, 10, 17, 21, 0))
+
+    def test_relative_deadlines_are_always_in_the_future(self):
+        now = FRIDAY_NIGHT
+        for text in ("週五", "週五 21:00", "今天 9:00", "今晚 9點", "21:00", "晚上12點", "9pm"):
+            with self.subTest(text=text):
+                self.assertGreater(deadlines.parse_deadline(text, now=now), now)
+
+    def test_explicit_past_date_is_returned_unchanged(self):
+        deadline_at = deadlines.parse_deadline("2024/1/1", now=FRIDAY_NOON)
+        self.assertEqual(deadline_at.astimezone(TZ).replace(tzinfo=None), datetime.datetime(2024, 1, 1, 23, 59))
+        self.assertLess(deadline_at, FRIDAY_NOON)
+
+
+class FormatDeadlineTest(unittest.TestCase):
+    def test_format(self):
+        deadline_at = deadlines.parse_deadline("週五 21:00", now=FRIDAY_NOON)
+        self.assertEqual(deadlines.format_deadline(deadline_at), "10/16 (五) 21:00")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""個人代禱紀錄分頁游標 (encode_history_cursor / decode_history_cursor) 與 load_prayer_history 的單元測試。"""
+import datetime
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.support import import_main  # noqa: E402
+
+main = import_main()
+
+UTC = datetime.timezone.utc
+
+
+class HistoryCursorTest(unittest.TestCase):
+    def test_round_trip_keeps_microseconds(self):
+        for created_time in (datetime.datetime(2026, 10, 16, 12, 0, tzinfo=UTC),
+                             datetime.datetime(2026, 10, 16, 12, 0, 0, 123457, tzinfo=UTC),
+                             datetime.datetime(2031, 1, 1, 23, 59, 59, 999999, tzinfo=UTC),
+                             datetime.datetime(1970, 1, 1, tzinfo=UTC)):
+            cursor = main.encode_history_cursor(created_time)
+            self.assertEqual(main.decode_history_cursor(cursor), created_time)
+
+    def test_cursor_is_short_and_url_safe(self):
+        cursor = main.encode_history_cursor(datetime.datetime(2026, 10, 16, 12, 0, 0, 1, tzinfo=UTC))
+        self.assertRegex(cursor, r'^[0-9a-z]{1,12}$')
+        self.assertEqual(main.encode_history_cursor(datetime.datetime(1970, 1, 1, tzinfo=UTC)), "0")
+
+    def test_decode_ignores_case_and_spaces(self):
+        created_time = datetime.datetime(2026, 10, 16, 12, 0, 0, 42, tzinfo=UTC)
+        cursor = main.encode_history_cursor(created_time)
+        self.assertEqual(main.decode_history_cursor(f" {cursor.upper()} "), created_time)
+
+    def test_invalid_cursor(self):
+        for cursor in ("", "not a cursor", "abc!"):
+            with self.assertRaises(ValueError):
+                main.decode_history_cursor(cursor)
+
+
+class LoadPrayerHistoryTest(unittest.TestCase):
+    def test_pages_are_newest_first_without_gaps_or_repeats(self):
+        user_id = f"U{self.id()}"
+        start = datetime.datetime(2026, 1, 4, 12, 0, 0, 500, tzinfo=UTC)
+        for week in range(7):
+            main.prayer_history_items(user_id).document(f"round{week}").set(
+                {'round_id': f"round{week}", 'created_time': start + datetime.timedelta(weeks=week)})
+
+        seen, cursor, pages = [], None, 0
+        while True:
+            items, cursor = main.load_prayer_history(user_id, cursor=cursor, limit=3)
+            seen += [item['round_id'] for item in items]
+            pages += 1
+            if cursor is None:
+                break
+        self.assertEqual(seen, [f"round{week}" for week in reversed(range(7))])
+        self.assertEqual(pages, 3)
+
+    def test_exact_page_has_no_next_cursor(self):
+        user_id = f"U{self.id()}"
+        main.prayer_history_items(user_id).document("round0").set(
+            {'round_id': "round0", 'created_time': datetime.datetime(2026, 1, 4, tzinfo=UTC)})
+        self.assertEqual(main.load_prayer_history(user_id, limit=1)[1], None)
+        self.assertEqual(main.load_prayer_history(f"{user_id}-empty"), ([], None))
+
+
+if __name__ == '__main__':
+    unittest.main()
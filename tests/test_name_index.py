@@ -0,0 +1,95 @@
+"""群組文件 name_index 的增量更新 (name_index_updates / name_index_sync_updates) 的單元測試。"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.support import import_main  # noqa: E402
+
+main = import_main()
+
+
+def members(**names):
+    return {uid: {'name': name, 'user_id': uid} for uid, name in names.items()}
+
+
+def index_path(key):
+    return main.FieldPath(main.NAME_INDEX_FIELD, key).to_api_repr()
+
+
+class NameIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.group_ref = main.db.collection('prayer_groups').document(f"C{self.id()}")
+
+    def write_group(self, members_map, with_index=True):
+        group_data = {'members': members_map}
+        if with_index:
+            group_data[main.NAME_INDEX_FIELD] = main.build_member_name_index(members_map)
+        self.group_ref.set(group_data)
+        return group_data
+
+    def apply(self, member_updates, index_updates):
+        """與正式的指令相同：成員與索引在同一次 update 中寫入，回傳寫入後的 name_index。"""
+        self.group_ref.update({**member_updates, **index_updates})
+        return self.group_ref.get().to_dict()[main.NAME_INDEX_FIELD]
+
+    def test_name_key_normalization(self):
+        self.assertEqual(main.member_name_key(" Ａmy  Lee "), "amy lee")
+        self.assertEqual(main.member_name_key(None), "")
+        self.assertEqual(main.build_member_name_index(members(U1="Amy", U2="amy", U3="")), {"amy": "U1"})
+
+    def test_join_adds_only_the_new_key(self):
+        group_data = self.write_group(members(U1="Amy"))
+        updates = main.name_index_updates(group_data, "U2", "Bob")
+        self.assertEqual(updates, {index_path("bob"): "U2"})
+        self.assertEqual(self.apply({'members.U2': {'name': "Bob", 'user_id': "U2"}}, updates), {"amy": "U1", "bob": "U2"})
+
+    def test_rename_moves_key_to_remaining_member_with_same_name(self):
+        group_data = self.write_group(members(U1="Amy", U2="amy"))
+        updates = main.name_index_updates(group_data, "U1", "Amelia")
+        self.assertEqual(updates, {index_path("amy"): "U2", index_path("amelia"): "U1"})
+        self.assertEqual(self.apply({'members.U1.name': "Amelia"}, updates), {"amy": "U2", "amelia": "U1"})
+
+    def test_rename_deletes_unused_key(self):
+        group_data = self.write_group(members(U1="Amy"))
+        updates = main.name_index_updates(group_data, "U1", "Amelia")
+        self.assertEqual(self.apply({'members.U1.name': "Amelia"}, updates), {"amelia": "U1"})
+
+    def test_existing_key_is_not_taken_over(self):
+        group_data = self.write_group(members(U1="Amy"))
+        self.assertEqual(main.name_index_updates(group_data, "U2", "AMY"), {})
+
+    def test_key_with_dots_and_spaces(self):
+        group_data = self.write_group(members(U1="Amy"))
+        updates = main.name_index_updates(group_data, "U2", "Dr. Wang")
+        self.assertEqual(self.apply({'members.U2': {'name': "Dr. Wang", 'user_id': "U2"}}, updates),
+                         {"amy": "U1", "dr. wang": "U2"})
+
+    def test_legacy_group_gets_full_index(self):
+        group_data = self.write_group(members(U1="Amy"), with_index=False)
+        self.assertEqual(main.member_name_index(group_data), {"amy": "U1"})
+        self.assertEqual(main.name_index_updates(group_data, "U2", "Bob"),
+                         {main.NAME_INDEX_FIELD: {"amy": "U1", "bob": "U2"}})
+
+    def test_sync_writes_only_changed_keys(self):
+        group_data = self.write_group(members(U1="Amy", U2="Bob", U3="amy"))
+        new_members = members(U2="Bobby", U3="amy", U4="Cat")
+        updates = main.name_index_sync_updates(group_data, new_members)
+        self.assertEqual(updates, {index_path("amy"): "U3", index_path("bobby"): "U2", index_path("cat"): "U4",
+                                   index_path("bob"): main.firestore.DELETE_FIELD})
+        index = self.apply({'members': new_members}, updates)
+        self.assertEqual(index, main.build_member_name_index(new_members))
+
+    def test_sync_without_changes_is_empty(self):
+        group_data = self.write_group(members(U1="Amy", U2="Bob"))
+        self.assertEqual(main.name_index_sync_updates(group_data, group_data['members']), {})
+
+    def test_sync_for_legacy_group(self):
+        group_data = self.write_group(members(U1="Amy"), with_index=False)
+        self.assertEqual(main.name_index_sync_updates(group_data, members(U2="Bob")),
+                         {main.NAME_INDEX_FIELD: {"bob": "U2"}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""截止時間排程 (process_deadlines / claim_reminder_marks) 的單元測試。"""
+import datetime
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.support import import_main  # noqa: E402
+
+main = import_main()
+
+NOW = datetime.datetime(2026, 10, 16, 4, 0, tzinfo=datetime.timezone.utc)
+
+
+class ClaimReminderMarksTest(unittest.TestCase):
+    def setUp(self):
+        self.round_ref = main.db.collection('prayer_rounds').document(f"R{self.id()}")
+        self.round_ref.set({'is_active': True, 'deadline_at': NOW + datetime.timedelta(hours=1), 'reminders_sent': [24.0]})
+
+    def test_mark_is_claimed_only_once(self):
+        self.assertTrue(main.claim_reminder_marks(self.round_ref, [24.0, 2.0]))
+        # 重疊的排程以同樣 (已過時) 的查詢結果再次認領
+        self.assertFalse(main.claim_reminder_marks(self.round_ref, [24.0, 2.0]))
+        self.assertEqual(self.round_ref.get().to_dict()['reminders_sent'], [24.0, 2.0])
+
+    def test_closed_round_is_not_claimed(self):
+        self.round_ref.update({'is_active': False})
+        self.assertFalse(main.claim_reminder_marks(self.round_ref, [24.0, 2.0]))
+
+
+
+class OrphanRoundTest(unittest.TestCase):
+    def test_orphan_round_is_closed_with_history_and_search_index(self):
+        group_id = f"C{self.id()}"
+        members = {'U1': {'name': "Amy", 'user_id': 'U1'}}
+        main.db.collection('prayer_groups').document(group_id).set(
+            {'members': members, 'admin_user_ids': ['U1'], 'current_round_id': f"{group_id}_current"})
+        deadline_at = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+        for round_id, is_due in ((f"{group_id}_current", False), (f"{group_id}_orphan", True)):
+            main.create_round(main.db.collection('prayer_rounds').document(round_id),
+                              {'group_id': group_id, 'is_active': True,
+                               'deadline_at': deadline_at if is_due else NOW + datetime.timedelta(days=30)}, members)
+        orphan_ref = main.db.collection('prayer_rounds').document(f"{group_id}_orphan")
+        orphan_ref.collection(main.ENTRIES_SUBCOLLECTION).document('U1').update({'text': "孤立輪次的事項", 'status': 'updated'})
+
+        with mock.patch.object(main, 'push_text') as push_text, mock.patch('builtins.print'):
+            result = main.process_deadlines(deadline_at + datetime.timedelta(hours=1))
+        self.assertEqual(result['closed'], 1)
+        push_text.assert_not_called()
+        self.assertIs(orphan_ref.get().to_dict()['is_active'], False)
+        self.assertEqual(main.db.collection('prayer_groups').document(group_id).get().to_dict()['current_round_id'],
+                         f"{group_id}_current")
+        self.assertTrue(main.prayer_history_items('U1').document(orphan_ref.id).get().exists)
+        self.assertEqual([uid for uid, _ in main.search_prayer_items(group_id, "孤立")[0]], ['U1'])
+        self.assertIsNotNone(main.load_round_snapshot(orphan_ref.id))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""roster.py 的名單解析與 main.py 名單變動計畫 (plan_roster / plan_member_removal) 的單元測試。"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import roster  # noqa: E402
+from tests.support import import_main  # noqa: E402
+
+main = import_main()
+
+AMY = 'U' + 'a' * 32
+BOB = 'U' + 'b' * 32
+CAT = 'U' + 'c' * 32
+DAN = 'U' + 'd' * 32
+
+
+class ParseRosterTest(unittest.TestCase):
+    def test_csv_with_header_and_bom(self):
+        rows, errors = roster.parse_roster(f"\ufeffuser_id,name\n{AMY},王小明\n{BOB}\n陳大文\n")
+        self.assertEqual(errors, [])
+        self.assertEqual(rows, [roster.RosterRow(2, AMY, '王小明'), roster.RosterRow(3, BOB, None),
+                                roster.RosterRow(4, None, '陳大文')])
+
+    def test_tab_separated_and_blank_lines(self):
+        rows, errors = roster.parse_roster(f"王小明\t{AMY}\n\n{BOB}\t陳大文")
+        self.assertEqual(errors, [])
+        self.assertEqual(rows, [roster.RosterRow(1, AMY, '王小明'), roster.RosterRow(3, BOB, '陳大文')])
+
+    def test_line_with_two_names_is_an_error(self):
+        rows, errors = roster.parse_roster(f"{AMY},王小明,小明")
+        self.assertEqual(rows, [])
+        self.assertEqual([line_no for line_no, _ in errors], [1])
+
+    def test_json_formats(self):
+        expected = [roster.RosterRow(1, AMY, None), roster.RosterRow(2, BOB, '陳大文')]
+        self.assertEqual(roster.parse_roster(f'["{AMY}", {{"user_id": "{BOB}", "name": "陳大文"}}]'), (expected, []))
+        self.assertEqual(roster.parse_roster(f'{{"members": ["{AMY}", {{"user_id": "{BOB}", "name": "陳大文"}}]}}'),
+                         (expected, []))
+        rows, errors = roster.parse_roster(f'["{AMY}", 3]')
+        self.assertEqual((rows, [line_no for line_no, _ in errors]), ([roster.RosterRow(1, AMY, None)], [2]))
+
+    def test_invalid_json(self):
+        with self.assertRaises(ValueError):
+            roster.parse_roster('[{"user_id": ')
+        with self.assertRaises(ValueError):
+            roster.parse_roster('{"members": "x"}')
+
+    def test_user_id_format(self):
+        self.assertTrue(roster.is_line_user_id(AMY))
+        self.assertFalse(roster.is_line_user_id('U123'))
+        self.assertFalse(roster.is_line_user_id(AMY.upper()))
+        self.assertFalse(roster.is_line_user_id(None))
+
+    def test_parse_name_list(self):
+        self.assertEqual(roster.parse_name_list("王小明, 陳大文、\n小美，"), ['王小明', '陳大文', '小美'])
+        self.assertEqual(roster.parse_name_list(""), [])
+
+
+class PlanRosterTest(unittest.TestCase):
+    def setUp(self):
+        self.group_id = f"C{self.id()}"
+        members = {AMY: {'name': '王小明', 'user_id': AMY}, BOB: {'name': '陳大文', 'user_id': BOB},
+                   CAT: {'name': 'Cat', 'user_id': CAT}}
+        main.db.collection('prayer_groups').document(self.group_id).set({
+            'members': members, 'admin_user_ids': [AMY],
+            main.NAME_INDEX_FIELD: main.build_member_name_index(members),
+        })
+        self.ctx = main.PrayerContext(self.group_id).load()
+        display_names = {DAN: 'Dan'}
+        patcher = mock.patch.object(main, 'get_display_name', side_effect=lambda uid, *args: display_names.get(uid))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def plan(self, text, replace=False):
+        rows, errors = roster.parse_roster(text)
+        self.assertEqual(errors, [])
+        return main.plan_roster(self.ctx, rows, replace=replace)
+
+    def test_add_rename_and_match_by_name(self):
+        plan, errors = self.plan(f"{DAN}\n{BOB},陳大大\nＣＡＴ")
+        self.assertEqual(errors, [])
+        self.assertEqual(plan['added'], {DAN: 'Dan'})
+        self.assertEqual(plan['renamed'], {BOB: '陳大大'})
+        self.assertEqual((plan['removed'], plan['unchanged']), ([], 1))
+
+    def test_replace_removes_unlisted_members_but_keeps_admins(self):
+        plan, errors = self.plan(f"{BOB}", replace=True)
+        self.assertEqual(errors, [])
+        self.assertEqual(plan['removed'], [CAT])
+        self.assertEqual(plan['kept_admins'], [AMY])
+
+    def test_unknown_name_duplicate_row_and_unknown_user(self):
+        unknown = 'U' + 'e' * 32
+        _, errors = self.plan(f"小美\n{BOB}\n陳大文\n{unknown}")
+        self.assertEqual([line_no for line_no, _ in errors], [1, 3, None])
+
+    def test_name_must_not_collide_with_other_member(self):
+        _, errors = self.plan(f"{BOB},cat")
+        self.assertEqual(len(errors), 1)
+        self.assertIn("cat", errors[0][1])
+
+    def test_member_removal(self):
+        plan, errors = main.plan_member_removal(self.ctx, ['陳大文', CAT, CAT, '王小明', '小美'])
+        self.assertEqual(plan['removed'], [BOB, CAT])
+        self.assertEqual(len(errors), 2)
+
+    def test_apply_plan_updates_members_and_name_index(self):
+        plan, _ = self.plan(f"{DAN}\n{BOB},陳大大", replace=True)
+        main.apply_roster_plan(self.ctx, plan, AMY)
+        ctx = main.PrayerContext(self.group_id).fresh().load()
+        self.assertEqual(set(ctx.members), {AMY, BOB, DAN})
+        self.assertEqual(ctx.member_by_name('陳大大'), BOB)
+        self.assertIsNone(ctx.member_by_name('Cat'))
+        self.assertEqual(main.load_user_groups(DAN, use_cache=False).get('group_ids'), [self.group_id])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""search.py (bigram 索引詞) 的單元測試 (python -m unittest discover tests)。"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search  # noqa: E402
+
+
+class NormalizeTest(unittest.TestCase):
+    def test_full_width_and_case(self):
+        self.assertEqual(search.normalize("ＡＢＣ公司"), ['abc公司'])
+
+    def test_punctuation_and_spaces_split_runs(self):
+        self.assertEqual(search.normalize("王伯伯，手術 順利！"), ['王伯伯', '手術', '順利'])
+        self.assertEqual(search.normalize(""), [])
+        self.assertEqual(search.normalize(None), [])
+
+
+class IndexTermsTest(unittest.TestCase):
+    def test_bigrams_of_each_run(self):
+        self.assertEqual(search.index_terms("王伯伯手術"), {'王伯', '伯伯', '伯手', '手術'})
+
+    def test_bigrams_do_not_cross_punctuation(self):
+        self.assertEqual(search.index_terms("伯伯 手術"), {'伯伯', '手術'})
+
+    def test_single_characters_have_no_terms(self):
+        self.assertEqual(search.index_terms("王 手"), set())
+
+
+class QueryTermsTest(unittest.TestCase):
+    def test_keyword_terms(self):
+        self.assertEqual(search.query_terms("手術"), {'手術'})
+        self.assertEqual(search.query_terms("Ａbc"), {'ab', 'bc'})
+
+    def test_too_short_keyword(self):
+        self.assertIsNone(search.query_terms("手"))
+        self.assertIsNone(search.query_terms("手術 王"))
+        self.assertIsNone(search.query_terms("　"))
+
+    def test_query_terms_are_subset_of_index_terms(self):
+        text = "為王伯伯的手術禱告"
+        self.assertLessEqual(search.query_terms("王伯伯"), search.index_terms(text))
+        self.assertLessEqual(search.query_terms("手術 禱告"), search.index_terms(text))
+
+
+class MatchesTest(unittest.TestCase):
+    def test_keyword_must_appear_contiguously(self):
+        self.assertTrue(search.matches("為王伯伯的手術禱告", "手術"))
+        # 所有 bigram 都出現，但關鍵字並不連續
+        self.assertFalse(search.matches("伯伯 手術", "伯伯手術"))
+        self.assertTrue(search.matches("王伯伯手術後恢復", "伯伯手術"))
+
+    def test_ignores_case_width_and_punctuation(self):
+        self.assertTrue(search.matches("ＡＢＣ公司面試", "abc"))
+        self.assertTrue(search.matches("家人，平安", "家人 平安"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""storage.WriteCoalescer 的單元測試 (使用記憶體後端的 Client)。"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+
+WINDOW_SECONDS = 0.2
+
+
+class WriteCoalescerTest(unittest.TestCase):
+    def setUp(self):
+        self.client = storage.Client(latency_ms=0)
+        self.commits = []
+        self.coalescer = storage.WriteCoalescer(
+            self.client, WINDOW_SECONDS, on_commit=lambda size, seconds: self.commits.append(size))
+        self.round_ref = self.client.collection('prayer_rounds').document('R1')
+        self.round_ref.set({'entries': {}})
+
+    def write_concurrently(self, writes):
+        """第一筆寫入成為 leader 後，其餘寫入在同一個時間窗內送出；回傳每筆寫入的例外 (成功為 None)。"""
+        errors = [None] * len(writes)
+
+        def run(position, method, doc_ref, data):
+            try:
+                self.coalescer.write(method, doc_ref, data)
+            except Exception as e:
+                errors[position] = e
+
+        threads = [threading.Thread(target=run, args=(position, *write)) for position, write in enumerate(writes)]
+        threads[0].start()
+        deadline = time.monotonic() + WINDOW_SECONDS
+        while not self.coalescer._leader_active and time.monotonic() < deadline:
+            time.sleep(0.001)
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_single_write_is_persisted_before_returning(self):
+        self.coalescer.write('update', self.round_ref, {'entries.U1.text': "平安"})
+        self.assertEqual(self.round_ref.get().to_dict()['entries'], {'U1': {'text': "平安"}})
+        self.assertEqual(self.commits, [1])
+
+    def test_writes_to_same_document_are_merged(self):
+        errors = self.write_concurrently([('update', self.round_ref, {f'entries.U{i}.text': f"事項{i}"}) for i in range(5)])
+        self.assertEqual(errors, [None] * 5)
+        self.assertEqual(self.commits, [1])
+        self.assertEqual(len(self.round_ref.get().to_dict()['entries']), 5)
+
+    def test_different_documents_share_one_batch(self):
+        refs = [self.client.collection('user_groups').document(f"U{i}") for i in range(3)]
+        errors = self.write_concurrently([('set_merge', ref, {'group_ids': ['C1']}) for ref in refs])
+        self.assertEqual(errors, [None] * 3)
+        self.assertEqual(self.commits, [3])
+        self.assertTrue(all(ref.get().exists for ref in refs))
+
+    def test_set_merge_writes_merge_nested_maps(self):
+        user_ref = self.client.collection('user_groups').document('U1')
+        first = {'groups': {'C1': {'name': "小組一"}}}
+        errors = self.write_concurrently([('set_merge', user_ref, first),
+                                          ('set_merge', user_ref, {'groups': {'C2': {'name': "小組二"}}}),
+                                          ('set_merge', user_ref, {'groups': {'C1': {'role': 'admin'}}})])
+        self.assertEqual(errors, [None] * 3)
+        self.assertEqual(self.commits, [1])
+        self.assertEqual(user_ref.get().to_dict()['groups'],
+                         {'C1': {'name': "小組一", 'role': 'admin'}, 'C2': {'name': "小組二"}})
+        # 呼叫端傳入的資料不會被合併修改
+        self.assertEqual(first, {'groups': {'C1': {'name': "小組一"}}})
+
+    def test_batches_are_split_at_max_batch_size(self):
+        self.coalescer.max_batch_size = 2
+        refs = [self.client.collection('user_groups').document(f"U{i}") for i in range(5)]
+        self.write_concurrently([('set_merge', ref, {'group_ids': ['C1']}) for ref in refs])
+        self.assertEqual(self.commits, [2, 2, 1])
+
+    def test_failed_batch_raises_in_every_writer(self):
+        missing_ref = self.client.collection('prayer_rounds').document('missing')
+        errors = self.write_concurrently([('update', self.round_ref, {'entries.U1.text': "平安"}),
+                                          ('update', missing_ref, {'entries.U2.text': "工作"})])
+        self.assertTrue(all(isinstance(error, storage.NotFound) for error in errors))
+        self.assertEqual(self.commits, [])
+        # 批次寫入是原子的：同一批中的其他寫入也不會生效
+        self.assertEqual(self.round_ref.get().to_dict()['entries'], {})
+
+    def test_next_window_starts_after_flush(self):
+        self.coalescer.write('update', self.round_ref, {'entries.U1.text': "一"})
+        self.coalescer.write('update', self.round_ref, {'entries.U1.text': "二"})
+        self.assertEqual(self.commits, [1, 1])
+        self.assertEqual(self.round_ref.get().to_dict()['entries']['U1']['text'], "二")
+
+
+if __name__ == '__main__':
+    unittest.main()
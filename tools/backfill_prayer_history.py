@@ -0,0 +1,32 @@
+"""
+為功能上線前已結束的輪次建立個人代禱紀錄 (prayer_history) 與搜尋索引 (prayer_search_terms)，
+讓「我的代禱紀錄」與「搜尋代禱」也能查到較早的輪次。
+可以重複執行；搜尋索引的格式改變後也可用來重建索引。
+
+用法 (於專案根目錄執行，會使用 .env 中的 GCP 設定)：
+    python tools/backfill_prayer_history.py                 # 所有群組
+    python tools/backfill_prayer_history.py --group-id Cxxx # 只處理指定群組
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def run():
+    parser = argparse.ArgumentParser(description="為已結束的輪次建立個人代禱紀錄與搜尋索引")
+    parser.add_argument('--group-id', help="只處理此群組")
+    args = parser.parse_args()
+
+    if not main.db_ready():
+        sys.exit("錯誤：Firestore 未初始化，請確認 GCP 設定。")
+
+    round_count = main.backfill_prayer_history(args.group_id)
+    print(f"完成，共處理 {round_count} 個輪次。")
+
+
+if __name__ == '__main__':
+    run()
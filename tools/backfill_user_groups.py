@@ -0,0 +1,31 @@
+"""
+為既有群組的成員建立 user_groups 索引 (使用者 → 群組)，讓已在名單中的成員也能使用多群組的私訊指令。
+不會改變成員目前選擇的群組。
+
+用法 (於專案根目錄執行，會使用 .env 中的 GCP 設定)：
+    python tools/backfill_user_groups.py                 # 所有群組
+    python tools/backfill_user_groups.py --group-id Cxxx # 只處理指定群組
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def run():
+    parser = argparse.ArgumentParser(description="為既有群組的成員建立 user_groups 索引")
+    parser.add_argument('--group-id', help="只處理此群組")
+    args = parser.parse_args()
+
+    if not main.db_ready():
+        sys.exit("錯誤：Firestore 未初始化，請確認 GCP 設定。")
+
+    written = main.backfill_user_group_index(args.group_id)
+    print(f"完成，共寫入 {written} 筆索引。")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,91 @@
+"""
+代禱列表分頁的效能測試：產生大型名單 (預設 600 人)，量測排版與切割訊息所需時間，
+並檢查每則訊息都在 LINE 的長度上限內、每位成員的事項都沒有被切到兩則訊息。
+
+用法 (於專案根目錄執行，不需要 LINE 或 Firestore 設定)：
+    python tools/bench_pagination.py
+    python tools/bench_pagination.py --members 1000 --item-length 120 --repeat 50
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rendering  # noqa: E402
+
+SAMPLE_TEXT = "為家人的健康與工作代禱，求主賜平安與智慧🙏 "
+
+
+def build_roster(member_count, item_length, seed):
+    rng = random.Random(seed)
+    members_map, entries = {}, {}
+    for i in range(member_count):
+        uid = f"U{i:05d}"
+        members_map[uid] = {'user_id': uid, 'name': f"成員{rng.randrange(100000):05d}"}
+        if rng.random() < 0.2:
+            entries[uid] = {'text': '', 'status': 'pending'}
+        else:
+            length = rng.randint(item_length // 2, item_length)
+            text = (SAMPLE_TEXT * (length // len(SAMPLE_TEXT) + 1))[:length]
+            if rng.random() < 0.1:
+                text = text[:length // 2] + "\n" + text[length // 2:]
+            entries[uid] = {'text': text, 'status': 'updated'}
+    return members_map, entries
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run():
+    parser = argparse.ArgumentParser(description="代禱列表分頁效能測試")
+    parser.add_argument('--members', type=int, default=600)
+    parser.add_argument('--item-length', type=int, default=80, help="每位成員事項的最大字數")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    members_map, entries = build_roster(args.members, args.item_length, args.seed)
+    title = "📖 本輪代禱事項 (截止：週五晚上) 📖"
+
+    render_times, split_times, cached_times = [], [], []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        listing = rendering.RoundListing(0, members_map, entries)
+        text = (title + listing.body()).strip()
+        render_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        chunks = rendering.split_text_messages(text)
+        split_times.append(time.perf_counter() - started)
+
+        # 快取命中：一位成員更新後重新取得列表
+        listing.apply_entry_update("U00000", {'text': "更新後的事項", 'status': 'updated'})
+        started = time.perf_counter()
+        rendering.split_text_messages((title + listing.body()).strip())
+        cached_times.append(time.perf_counter() - started)
+
+    # 正確性檢查
+    lengths = [rendering.line_text_length(chunk) for chunk in chunks]
+    assert max(lengths) <= rendering.LINE_TEXT_LIMIT, "有訊息超過 LINE 長度上限"
+    assert "\n".join(chunks) == text, "切割後的內容與原文不一致"
+    for chunk in chunks[1:]:
+        assert chunk.startswith(rendering.MEMBER_LINE_PREFIX), "訊息不是從成員邊界開始"
+
+    per_call = rendering.LINE_MESSAGES_PER_CALL
+    push_calls = max(0, (len(chunks) - per_call + per_call - 1) // per_call)
+    print(f"成員數: {args.members}，列表總長度: {rendering.line_text_length(text)} 字")
+    print(f"訊息數: {len(chunks)} (最長 {max(lengths)} 字)，reply 1 次 + push {push_calls} 次")
+    for label, samples in (("排版 (無快取)", render_times), ("切割訊息", split_times),
+                           ("更新一行後重新排版與切割", cached_times)):
+        print(f"{label}: p50 {percentile(samples, 0.5) * 1000:.2f} ms / "
+              f"p95 {percentile(samples, 0.95) * 1000:.2f} ms / 平均 {statistics.mean(samples) * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    run()
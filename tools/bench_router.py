@@ -0,0 +1,94 @@
+"""
+指令路由的效能測試：在指令表中加入大量假指令 (預設 10 / 100 / 1000 / 10000 個)，
+比較字首樹 (commands.CommandRouter) 與逐一比對的 if/elif 寫法，確認分派時間不會隨指令數量增加。
+
+用法 (於專案根目錄執行，不需要 LINE 或 Firestore 設定)：
+    python tools/bench_router.py
+    python tools/bench_router.py --sizes 10,1000,100000 --repeat 20000
+"""
+import argparse
+import contextlib
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import commands  # noqa: E402
+
+
+def load_real_commands():
+    """目前 bot 實際註冊的指令 (main.DM_COMMANDS 與 main.GROUP_COMMANDS 的聯集)。"""
+    # 使用記憶體後端且不讀取 .env，匯入 main 時不會連線到 Firestore 或 LINE
+    os.environ.update({'STORAGE_BACKEND': 'memory', 'K_SERVICE': 'bench-router'})
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        import main
+    real = {}
+    for router in (main.DM_COMMANDS, main.GROUP_COMMANDS):
+        for route in router.routes:
+            real.setdefault(route.verb, route.match)
+    return list(real.items())
+
+
+SAMPLE_MESSAGES = ["代禱 為家人的健康與工作代禱，求主賜平安與智慧", "代禱列表", "我的代禱", "修改我的名字 小明",
+                   "今天天氣很好，大家晚上見！", "help"]
+
+
+def noop(command, ctx):
+    return None
+
+
+def build_commands(real_commands, extra_count):
+    """真實指令加上 extra_count 個假指令 (放在前面，模擬 if/elif 最差情況)。"""
+    fake = [(f"指令{i:06d}", commands.PREFIX if i % 2 else commands.EXACT) for i in range(extra_count)]
+    return fake + real_commands
+
+
+def linear_dispatch(command_list, text):
+    """原本 if/elif 的寫法：依序比對每個指令。"""
+    lowered = commands.normalize_text(text).lower()
+    for verb, match in command_list:
+        if lowered == verb if match == commands.EXACT else lowered.startswith(verb):
+            return verb
+    return None
+
+
+def time_per_call(fn, messages, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text in messages:
+            fn(text)
+        samples.append((time.perf_counter() - started) / len(messages))
+    return statistics.median(samples)
+
+
+def run():
+    parser = argparse.ArgumentParser(description="指令路由效能測試")
+    parser.add_argument('--sizes', default="10,100,1000,10000", help="額外加入的假指令數量 (逗號分隔)")
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    real_commands = load_real_commands()
+    print(f"{'指令數':>8} | {'字首樹 (µs/則)':>14} | {'if/elif (µs/則)':>15}")
+    for size in [int(value) for value in args.sizes.split(',')]:
+        command_list = build_commands(real_commands, size)
+        router = commands.CommandRouter(commands.SOURCE_USER)
+        for verb, match in command_list:
+            router.add(verb, noop, match)
+
+        # 正確性：兩種寫法選到的指令必須相同
+        for text in SAMPLE_MESSAGES:
+            parsed = router.parse(text)
+            assert (parsed.verb if parsed else None) == linear_dispatch(command_list, text), text
+
+        trie = time_per_call(router.parse, SAMPLE_MESSAGES, args.repeat)
+        # 逐一比對在指令很多時太慢，減少次數
+        linear = time_per_call(lambda text: linear_dispatch(command_list, text), SAMPLE_MESSAGES,
+                               max(1, args.repeat * 10 // max(len(command_list), 10)))
+        print(f"{len(command_list):>8} | {trie * 1e6:>14.2f} | {linear * 1e6:>15.2f}")
+
+
+if __name__ == '__main__':
+    run()
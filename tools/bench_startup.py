@@ -0,0 +1,117 @@
+"""
+冷啟動效能測試：以 `python -X importtime -c "import main"` 在新的行程中重複匯入 main.py，
+統計匯入時間的 p50 / p95，並列出最花時間的模組。
+
+結果可與 tools/startup_baseline.json 比較，作為回歸檢查 (超過基準值加容許誤差時結束碼為 1)。
+基準值與執行環境有關，更換機器或 Python 版本時請以 --update-baseline 重新產生。
+
+用法 (於專案根目錄執行，預設使用記憶體後端，不需要 LINE 或 Firestore 設定)：
+    python tools/bench_startup.py
+    python tools/bench_startup.py --runs 30 --top 15
+    python tools/bench_startup.py --check              # 與基準值比較
+    python tools/bench_startup.py --update-baseline    # 更新基準值
+    python tools/bench_startup.py --backend firestore  # 正式環境的後端 (需要安裝 google-cloud-firestore)
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT_DIR, 'tools', 'startup_baseline.json')
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 的輸出，回傳 {模組名稱: (self 微秒, cumulative 微秒)}。"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure_once(backend):
+    env = dict(os.environ, STORAGE_BACKEND=backend, K_SERVICE='bench-startup')
+    env.setdefault('LINE_CHANNEL_SECRET', 'bench-secret')
+    env.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'bench-token')
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'],
+                            cwd=ROOT_DIR, env=env, capture_output=True, text=True)
+    wall_seconds = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"匯入 main 失敗:\n{result.stderr[-2000:]}")
+    modules = parse_importtime(result.stderr)
+    return modules['main'][1] / 1e6, wall_seconds, modules
+
+
+def run():
+    parser = argparse.ArgumentParser(description="冷啟動 (匯入 main.py) 效能測試")
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--backend', default='memory', choices=('memory', 'firestore'))
+    parser.add_argument('--top', type=int, default=10, help="列出最花時間的前幾個模組 (依 cumulative)")
+    parser.add_argument('--check', action='store_true', help="與基準值比較，超過時結束碼為 1")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="--check 的容許誤差 (比例)")
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args()
+
+    import_times, wall_times, last_modules = [], [], {}
+    for _ in range(args.runs):
+        import_seconds, wall_seconds, last_modules = measure_once(args.backend)
+        import_times.append(import_seconds)
+        wall_times.append(wall_seconds)
+
+    result = {
+        'backend': args.backend,
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'import_main_p50_ms': round(percentile(import_times, 0.5) * 1000, 1),
+        'import_main_p95_ms': round(percentile(import_times, 0.95) * 1000, 1),
+        'process_p50_ms': round(percentile(wall_times, 0.5) * 1000, 1),
+        'process_p95_ms': round(percentile(wall_times, 0.95) * 1000, 1),
+    }
+    print(f"後端: {args.backend}，執行 {args.runs} 次 (Python {result['python']})")
+    print(f"匯入 main: p50 {result['import_main_p50_ms']} ms / p95 {result['import_main_p95_ms']} ms")
+    print(f"整個行程 (含直譯器啟動): p50 {result['process_p50_ms']} ms / p95 {result['process_p95_ms']} ms")
+    print(f"最花時間的模組 (最後一次，cumulative)：")
+    heaviest = sorted(last_modules.items(), key=lambda item: item[1][1], reverse=True)
+    for name, (self_us, cumulative_us) in heaviest[1:args.top + 1]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    if args.update_baseline:
+        baselines = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH, encoding='utf-8') as f:
+                baselines = json.load(f)
+        baselines[args.backend] = result
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f"已更新基準值: {BASELINE_PATH}")
+
+    if args.check:
+        with open(BASELINE_PATH, encoding='utf-8') as f:
+            baseline = json.load(f).get(args.backend)
+        if not baseline:
+            print(f"錯誤: 基準值中沒有 {args.backend} 後端的資料，請先執行 --update-baseline")
+            sys.exit(1)
+        failed = False
+        for key in ('import_main_p50_ms', 'import_main_p95_ms'):
+            limit = baseline[key] * (1 + args.tolerance)
+            status = "OK" if result[key] <= limit else "回歸"
+            failed = failed or result[key] > limit
+            print(f"{key}: {result[key]} ms (基準 {baseline[key]} ms，上限 {limit:.1f} ms) {status}")
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    run()
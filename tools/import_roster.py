@@ -0,0 +1,63 @@
+"""
+從 CSV 或 JSON 檔案批次匯入 (或移除) 群組的代禱名單，格式與 名單設定 指令相同 (見 roster.py)。
+新成員的 LINE 顯示名稱會同時查詢，所有變動以批次寫入，一次完成整個小組的建檔。
+
+用法 (於專案根目錄執行，會使用 .env 中的 GCP 與 LINE 設定)：
+    python tools/import_roster.py --group-id Cxxx roster.csv             # 新增/更新名單中的成員
+    python tools/import_roster.py --group-id Cxxx roster.json --replace  # 覆蓋整份名單 (未列出的非管理員會被移除)
+    python tools/import_roster.py --group-id Cxxx leaving.txt --remove   # 移除檔案中列出的成員 (名字或 user_id)
+    python tools/import_roster.py --group-id Cxxx roster.csv --dry-run   # 只顯示變動，不寫入
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+import roster  # noqa: E402
+
+
+def run():
+    parser = argparse.ArgumentParser(description="從 CSV / JSON 檔案批次匯入或移除代禱名單")
+    parser.add_argument('file', help="名單檔案 (CSV、Tab 分隔或 JSON)")
+    parser.add_argument('--group-id', required=True)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--replace', action='store_true', help="覆蓋整份名單 (未列出的非管理員會被移除)")
+    mode.add_argument('--remove', action='store_true', help="移除檔案中列出的成員")
+    parser.add_argument('--dry-run', action='store_true', help="只顯示變動，不寫入")
+    args = parser.parse_args()
+
+    if not main.db_ready():
+        sys.exit("錯誤：Firestore 未初始化，請確認 GCP 設定。")
+
+    with open(args.file, encoding='utf-8-sig') as f:
+        text = f.read()
+    ctx = main.PrayerContext(args.group_id, use_cache=False)
+    if not ctx.group_exists:
+        sys.exit(f"錯誤：找不到群組 {args.group_id} 的設定資料。")
+
+    if args.remove:
+        plan, errors = main.plan_member_removal(ctx, roster.parse_name_list(text))
+    else:
+        try:
+            rows, errors = roster.parse_roster(text)
+        except ValueError as e:
+            sys.exit(f"錯誤：無法解析名單 ({e})")
+        plan, plan_errors = main.plan_roster(ctx, rows, replace=args.replace)
+        errors += plan_errors
+    if errors:
+        print(f"名單有 {len(errors)} 個問題，未做任何修改：")
+        print(main.roster_errors_text(errors, limit=len(errors)))
+        sys.exit(1)
+
+    print(main.roster_plan_text(ctx, plan))
+    if args.dry_run:
+        print("(--dry-run：未寫入)")
+        return
+    written = main.apply_roster_plan(ctx, plan, 'tool:import_roster')
+    print(f"完成，共寫入 {written} 份文件。")
+
+
+if __name__ == '__main__':
+    run()
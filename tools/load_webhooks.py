@@ -0,0 +1,277 @@
+"""
+Webhook 壓力測試 / 重播工具：產生 (或讀取錄下的) LINE Webhook 內容，以 Channel Secret 簽章後，
+依指定的速率與並行數呼叫 main.line_bot_handler_function，最後回報吞吐量、延遲 p50/p99 與錯誤數。
+
+執行時使用記憶體儲存後端 (STORAGE_BACKEND=memory) 與假的 LINE API (不會真的發送訊息)，
+可用 --store-latency-ms / --line-latency-ms 模擬 Firestore 與 LINE API 的網路延遲。
+
+預設情境模擬截止前的尖峰：--users 位成員先在群組中加入代禱、管理員開始新一輪，
+接著依 --mix 的比例送出私訊更新事項、查詢列表、我的代禱、群組列表與加好友事件。
+
+用法 (於專案根目錄執行)：
+    python tools/load_webhooks.py
+    python tools/load_webhooks.py --users 300 --requests 3000 --concurrency 16 --rate 200
+    python tools/load_webhooks.py --store-latency-ms 20 --line-latency-ms 80 --json
+    python tools/load_webhooks.py --replay recorded.jsonl    # 每行一個 Webhook body (JSON)
+"""
+import argparse
+import base64
+import collections
+import contextlib
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHANNEL_SECRET = 'load-test-secret'
+GROUP_ID = 'C' + '0' * 31 + '1'
+DEFAULT_MIX = "update=70,list=10,my=10,group_list=5,follow=5"
+SAMPLE_ITEMS = ["為家人的健康代禱", "為工作上的決定求智慧", "同上週", "求主保守期中考", "為教會的新朋友代禱"]
+
+
+class FakeLineBotApi:
+    """取代 LineBotApi：只記錄呼叫次數，每次呼叫等待 latency_seconds 模擬網路延遲。"""
+
+    def __init__(self, latency_seconds=0.0):
+        self.latency_seconds = latency_seconds
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _call(self, name):
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    def reply_message(self, reply_token, messages, *args, **kwargs):
+        self._call('reply_message')
+
+    def push_message(self, to, messages, *args, **kwargs):
+        self._call('push_message')
+
+    def multicast(self, to, messages, *args, **kwargs):
+        self._call('multicast')
+
+    def get_profile(self, user_id, *args, **kwargs):
+        self._call('get_profile')
+        return type('Profile', (), {'user_id': user_id, 'display_name': f"成員{user_id[-4:]}"})()
+
+    def get_group_summary(self, group_id, *args, **kwargs):
+        self._call('get_group_summary')
+        return type('GroupSummary', (), {'group_id': group_id, 'group_name': "壓力測試小組"})()
+
+
+class WebhookFactory:
+    """產生 Webhook 事件 (格式與 LINE 送來的相同)。"""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def _base(self, event_type, source):
+        n = next(self._ids)
+        return {'type': event_type, 'mode': 'active', 'timestamp': int(time.time() * 1000), 'source': source,
+                'webhookEventId': f"01LOAD{n:020d}", 'deliveryContext': {'isRedelivery': False},
+                'replyToken': f"loadtest{n:024d}"}
+
+    def text(self, user_id, text, group_id=None):
+        source = {'type': 'group', 'groupId': group_id, 'userId': user_id} if group_id else {'type': 'user', 'userId': user_id}
+        event = self._base('message', source)
+        event['message'] = {'type': 'text', 'id': event['replyToken'][-18:], 'text': text}
+        return event
+
+    def follow(self, user_id):
+        return self._base('follow', {'type': 'user', 'userId': user_id})
+
+    def refresh(self, event):
+        """重播錄下的事件時更新時間與事件 ID，避免 reply token 過期判斷與重送去重影響結果。"""
+        fresh = self._base(event.get('type', 'message'), event.get('source', {}))
+        return {**event, 'timestamp': fresh['timestamp'], 'webhookEventId': fresh['webhookEventId']}
+
+
+def sign(body):
+    return base64.b64encode(hmac.new(CHANNEL_SECRET.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()).decode('utf-8')
+
+
+def build_request(body):
+    from werkzeug.test import EnvironBuilder
+    from flask import Request
+    builder = EnvironBuilder(path='/callback', method='POST', data=body.encode('utf-8'),
+                             headers={'X-Line-Signature': sign(body), 'Content-Type': 'application/json'})
+    return Request(builder.get_environ())
+
+
+def send(main, events):
+    """送出一個 Webhook，回傳 (HTTP 狀態碼, 秒數)。"""
+    body = json.dumps({'destination': 'Uloadtest', 'events': events}, ensure_ascii=False)
+    request = build_request(body)
+    started = time.perf_counter()
+    try:
+        response = main.line_bot_handler_function(request)
+        status = response[1] if isinstance(response, tuple) else response.status_code
+    except Exception:
+        status = 'exception'
+    return status, time.perf_counter() - started
+
+
+def parse_mix(text):
+    weights = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - {'update', 'list', 'my', 'group_list', 'follow'}
+    if unknown:
+        raise SystemExit(f"未知的事件類型: {', '.join(sorted(unknown))}")
+    return weights
+
+
+def synthetic_bodies(factory, user_ids, mix, count, events_per_request, rng):
+    kinds, weights = zip(*mix.items())
+    for _ in range(count):
+        events = []
+        for _ in range(events_per_request):
+            kind = rng.choices(kinds, weights)[0]
+            user_id = rng.choice(user_ids)
+            if kind == 'update':
+                events.append(factory.text(user_id, f"代禱 {rng.choice(SAMPLE_ITEMS)}"))
+            elif kind == 'list':
+                events.append(factory.text(user_id, "代禱列表"))
+            elif kind == 'my':
+                events.append(factory.text(user_id, "我的代禱"))
+            elif kind == 'group_list':
+                events.append(factory.text(user_ids[0], "代禱列表", GROUP_ID))
+            else:
+                events.append(factory.follow(user_id))
+        yield events
+
+
+def replay_bodies(factory, path, count):
+    with open(path, encoding='utf-8') as f:
+        recorded = [json.loads(line) for line in f if line.strip()]
+    if not recorded:
+        raise SystemExit(f"{path} 沒有任何 Webhook 內容")
+    for i in range(count or len(recorded)):
+        yield [factory.refresh(event) for event in recorded[i % len(recorded)].get('events', [])]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Webhook 壓力測試 / 重播")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--requests', type=int, help="送出的 Webhook 數 (預設 1000，重播時預設為檔案行數)")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=0, help="每秒送出的 Webhook 數，0 表示不限速")
+    parser.add_argument('--events-per-request', type=int, default=1)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"各類事件的比例 (預設 {DEFAULT_MIX})")
+    parser.add_argument('--replay', help="重播錄下的 Webhook body (JSON Lines)，取代合成事件")
+    parser.add_argument('--store-latency-ms', type=float, default=0, help="模擬每次 Firestore RPC 的延遲")
+    parser.add_argument('--line-latency-ms', type=float, default=0, help="模擬每次 LINE API 呼叫的延遲")
+    parser.add_argument('--async-webhook', action='store_true', help="以 ASYNC_WEBHOOK=true 執行 (只量測收到 200 的時間)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="以 JSON 輸出結果")
+    parser.add_argument('--verbose', action='store_true', help="顯示 Bot 的日誌")
+    args = parser.parse_args()
+
+    os.environ.update({
+        'STORAGE_BACKEND': 'memory', 'MEMORY_STORE_LATENCY_MS': str(args.store_latency_ms),
+        'LINE_CHANNEL_SECRET': CHANNEL_SECRET, 'LINE_CHANNEL_ACCESS_TOKEN': 'load-test-token',
+        'TARGET_GROUP_ID': GROUP_ID, 'ASYNC_WEBHOOK': 'true' if args.async_webhook else 'false',
+        'K_SERVICE': 'load-test',  # 不讀取 .env，避免使用到正式環境的設定
+    })
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    with quiet:
+        import main
+        fake_api = FakeLineBotApi(args.line_latency_ms / 1000.0)
+        main.line_bot_api = fake_api
+
+        rng = random.Random(args.seed)
+        factory = WebhookFactory()
+        user_ids = [f"U{i:032x}" for i in range(1, args.users + 1)]
+        if not args.replay:
+            # 準備：所有成員加入代禱，第一位 (管理員) 開始新一輪
+            for user_id in user_ids:
+                send(main, [factory.text(user_id, "加入代禱", GROUP_ID)])
+            send(main, [factory.text(user_ids[0], "開始代禱 週五晚上", GROUP_ID)])
+            bodies = synthetic_bodies(factory, user_ids, parse_mix(args.mix), args.requests or 1000, args.events_per_request, rng)
+        else:
+            bodies = replay_bodies(factory, args.replay, args.requests)
+        bodies = list(bodies)
+        setup_calls = sum(fake_api.calls.values())
+
+        latencies, statuses = [], collections.Counter()
+        lock = threading.Lock()
+        started = time.perf_counter()
+
+        def worker(index, events):
+            if args.rate:
+                # 依速率排程 (open loop)：第 index 個 Webhook 在 started + index / rate 送出
+                delay = started + index / args.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            status, seconds = send(main, events)
+            with lock:
+                latencies.append(seconds)
+                statuses[str(status)] += 1
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for future in [pool.submit(worker, index, events) for index, events in enumerate(bodies)]:
+                future.result()
+        elapsed = time.perf_counter() - started
+        worker_stats = None
+        if args.async_webhook:
+            # 非同步模式：200 已經回覆，再等背景執行緒處理完所有事件
+            main.get_worker_pool().drain()
+            worker_stats = main.get_worker_pool().stats()
+        total_elapsed = time.perf_counter() - started
+
+    errors = sum(count for status, count in statuses.items() if status != '200')
+    if worker_stats:
+        errors += worker_stats['failed']
+    result = {
+        'webhooks': len(latencies),
+        'events': sum(len(events) for events in bodies),
+        'seconds': round(elapsed, 3),
+        'throughput_per_second': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.5) * 1000, 2),
+            'p90': round(percentile(latencies, 0.9) * 1000, 2),
+            'p99': round(percentile(latencies, 0.99) * 1000, 2),
+            'max': round(max(latencies, default=0) * 1000, 2),
+            'mean': round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+        },
+        'status': dict(statuses),
+        'errors': errors,
+        'line_api_calls': {name: count for name, count in fake_api.calls.items()},
+        'line_api_calls_during_setup': setup_calls,
+    }
+    if worker_stats:
+        result['background'] = {'seconds': round(total_elapsed, 3), 'failed': worker_stats['failed']}
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+    print(f"Webhook: {result['webhooks']} 個，並行 {args.concurrency}，"
+          f"速率 {'不限' if not args.rate else f'{args.rate:g}/秒'}，耗時 {result['seconds']} 秒")
+    print(f"吞吐量: {result['throughput_per_second']} 個/秒")
+    latency = result['latency_ms']
+    print(f"延遲: p50 {latency['p50']} ms / p90 {latency['p90']} ms / p99 {latency['p99']} ms / "
+          f"最大 {latency['max']} ms")
+    print(f"狀態碼: {result['status']}，錯誤: {errors}")
+    if worker_stats:
+        print(f"背景處理完所有事件: {result['background']['seconds']} 秒 (失敗 {worker_stats['failed']} 個)")
+    print(f"LINE API 呼叫 (含準備階段 {setup_calls} 次): {result['line_api_calls']}")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,37 @@
+"""
+將舊結構 (entries map 存在輪次文件中) 的代禱輪次轉換為子集合結構
+(prayer_rounds/{round_id}/entries/{user_id})。
+
+用法 (於專案根目錄執行，會使用 .env 中的 GCP 設定)：
+    python tools/migrate_round_entries.py                 # 轉換所有輪次
+    python tools/migrate_round_entries.py --group-id Cxxx # 只轉換指定群組
+    python tools/migrate_round_entries.py --round-id Cxxx_20240101-120000
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def run():
+    parser = argparse.ArgumentParser(description="將代禱輪次的 entries map 轉換為子集合結構")
+    parser.add_argument('--group-id', help="只轉換此群組的輪次")
+    parser.add_argument('--round-id', help="只轉換單一輪次")
+    args = parser.parse_args()
+
+    if not main.db_ready():
+        sys.exit("錯誤：Firestore 未初始化，請確認 GCP 設定。")
+
+    if args.round_id:
+        moved = main.migrate_round_entries(args.round_id)
+        print("此輪次不需轉換 (不存在或已是新結構)。" if moved is None else f"完成，共搬移 {moved} 筆事項。")
+    else:
+        migrated = main.migrate_all_round_entries(args.group_id)
+        print(f"完成，共轉換 {migrated} 個輪次。")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,27 @@
+"""
+執行一次截止時間處理 (自動結束到期的輪次、發送截止前提醒)，效果與呼叫 POST /tasks/deadlines 相同。
+適合在本地或自架主機上以 cron 定期執行，例如每 10 分鐘：
+    */10 * * * * cd /path/to/Beersheba_prayer_bot && python tools/run_deadlines.py
+
+用法 (於專案根目錄執行，會使用 .env 中的 LINE 與 GCP 設定)：
+    python tools/run_deadlines.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+def run():
+    if not main.db_ready() or not main.sdk_ready():
+        sys.exit("錯誤：Firestore 或 LINE SDK 未初始化，請確認設定。")
+
+    result = main.process_deadlines()
+    print(f"完成：自動結束 {result['closed']} 個輪次，"
+          f"提醒 {result['reminded_rounds']} 個輪次共 {result['reminders_sent']} 位成員。")
+
+
+if __name__ == '__main__':
+    run()
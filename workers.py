@@ -0,0 +1,105 @@
+"""
+背景工作執行緒 (Background Workers)
+
+- 讓 Webhook 在驗證簽章後立即回應 LINE 200 OK，實際的事件處理
+  (Firestore 讀寫與 reply_message) 交給行程內的執行緒池在背景完成。
+- 同一個 Webhook 中不同使用者的事件可以同時處理，
+  但同一位使用者的多個事件仍依序執行 (submit_ordered)。
+
+注意：部署在 Cloud Functions (Gen2) / Cloud Run 時，回應送出後 CPU 預設會被節流，
+背景執行緒可能被暫停。使用非同步模式時請將服務設定為「CPU 一律分配」
+(gcloud run services update <服務名稱> --no-cpu-throttling)。
+"""
+import collections
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class BackgroundWorkerPool:
+    """
+    有上限的執行緒池，並統計已提交 / 完成 / 失敗的工作數量。
+    submit_ordered(key, ...) 保證相同 key 的工作依提交順序一個接一個執行，不同 key 之間則平行處理。
+    """
+
+    def __init__(self, max_workers, name='prayer-bot-worker'):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._key_queues = {}  # key -> deque[(future, fn, args, kwargs)]，存在代表該 key 正有工作在執行
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, fn, *args, **kwargs):
+        future = self._executor.submit(self._run, fn, args, kwargs)
+        with self._lock:
+            self.submitted += 1
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def submit_ordered(self, key, fn, *args, **kwargs):
+        future = Future()
+        with self._lock:
+            queue = self._key_queues.get(key)
+            start_runner = queue is None
+            if start_runner:
+                queue = self._key_queues[key] = collections.deque()
+            queue.append((future, fn, args, kwargs))
+            self.submitted += 1
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+        if start_runner:
+            self._executor.submit(self._drain_key, key)
+        return future
+
+    def _drain_key(self, key):
+        """在同一個執行緒中依序執行某個 key 的所有排隊工作，直到佇列清空。"""
+        while True:
+            with self._lock:
+                queue = self._key_queues[key]
+                if not queue:
+                    del self._key_queues[key]
+                    return
+                future, fn, args, kwargs = queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._run(fn, args, kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _run(self, fn, args, kwargs):
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            print(f"錯誤 (繁中): 背景工作執行失敗: {e}")
+            raise
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def _discard(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def drain(self, timeout=None):
+        """等待目前所有已提交的工作完成 (供本地測試與壓力測試使用)。回傳是否全部完成。"""
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                # 失敗已在 _run 中記錄
+                pass
+        with self._lock:
+            return not self._pending
+
+    def stats(self):
+        with self._lock:
+            return {'max_workers': self.max_workers, 'pending': len(self._pending),
+                    'submitted': self.submitted, 'completed': self.completed, 'failed': self.failed}